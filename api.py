@@ -0,0 +1,790 @@
+"""Headless HTTP API for VyaparGPT.
+
+Runs on a plain asyncio server (no web framework dependency) and reuses the
+same helpers as the Streamlit UI. LLM answers stream as Server-Sent Events;
+SQLite work runs in a thread pool and PDF work in a process pool, so one slow
+parse never stalls the event loop.
+
+    python api.py --port 8080 [--pdf-workers 4]
+
+Endpoints (all JSON unless noted; everything but /v1/auth/token needs
+`Authorization: Bearer <token>`):
+
+    POST   /v1/auth/token          {"username", "password"} -> {"token", "expires_at"}
+    DELETE /v1/auth/token          revoke the presented token
+    GET    /v1/history?limit=N&before=ID
+                                   the newest N turns (default 50, at most 500) older than
+                                   turn ID; "oldest_id" in the reply pages further back
+    GET    /v1/history/export?format=jsonl|csv|pdf
+                                   full history incl. archive, streamed (chunked)
+    DELETE /v1/history             clear chat history
+    POST   /v1/intent              {"text"} -> {"intent", "data"}
+    POST   /v1/chat                {"message"} -> SSE (or JSON with "stream": false)
+    POST   /v1/invoice             {"customer", "amount"} -> application/pdf
+    POST   /v1/legal               {"doc_type", "name"} -> application/pdf
+    POST   /v1/documents/preview   PDF request body -> {"pages", "first_page"}
+    POST   /v1/documents/explain?pages=2-5
+                                   PDF request body -> SSE explanation of those pages (default all)
+    GET    /v1/jobs?id=N           background job status
+    GET    /v1/jobs/result?id=N    finished job's result (PDF or JSON)
+
+PDF bodies may be up to VYAPAR_MAX_UPLOAD_MB (default 50); bodies over
+VYAPAR_UPLOAD_SPOOL_MB are spooled to a temporary file as they arrive
+(uploads.py) instead of being held in memory.
+
+Add `?async=1` to /v1/invoice, /v1/legal or /v1/documents/explain to queue a
+background job (jobs.py) instead: 202 {"job_id"}, then poll /v1/jobs.
+
+SSE events: `delta` ({"content": "..."}), then `done` ({"content": full
+answer}) or `error` ({"error": "..."}). On /v1/chat, `intent` ({"intent",
+"data"}) instead of `done` means the intent classifier found a tool request
+mid-answer: drop the partial answer and open the tool, as for a JSON
+{"intent", "data"} reply.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs, quote, urlsplit
+
+import chatstore
+import db
+import documents
+import export
+import jobs
+import llm
+import metrics
+import prompts
+import retention
+import uploads
+from ratelimit import RateLimited
+
+MAX_BODY = uploads.MAX_UPLOAD_BYTES  # bytes; bodies over uploads.SPOOL_BYTES are spooled to disk
+KEEPALIVE_TIMEOUT = 30.0  # for the request line and headers
+BODY_IDLE_TIMEOUT = 30.0  # between reads of a body; a slow upload may take longer in all
+HISTORY_LIMIT = 50
+MAX_HISTORY_LIMIT = 500
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message=None, headers=None):
+        self.status = status
+        self.message = message or HTTPStatus(status).phrase
+        self.headers = headers or {}
+        super().__init__(self.message)
+
+
+def int_param(request, name, default, lo, hi):
+    """An integer query parameter in [lo, hi]; 400 for anything else."""
+    raw = request.query.get(name, "")
+    if raw == "":
+        return default
+    try:
+        value = int(raw)
+    except ValueError:
+        raise HTTPError(400, f"{name} must be an integer")
+    if not lo <= value <= hi:
+        raise HTTPError(400, f"{name} must be between {lo} and {hi}")
+    return value
+
+
+class Request:
+    def __init__(self, method, target, headers, body, upload=None):
+        self.method = method
+        parts = urlsplit(target)
+        self.path = parts.path.rstrip("/") or "/"
+        self.query = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        self.headers = headers
+        self.body = body
+        self.user = None
+        self.token = None
+        self._upload = upload  # large bodies arrive spooled, with an empty `body`
+
+    @property
+    def upload(self):
+        """The body as an uploads.Upload (PDF endpoints)."""
+        if self._upload is None:
+            self._upload = uploads.from_bytes(self.body)
+        return self._upload
+
+    def close(self):
+        if self._upload is not None:
+            self._upload.close()
+
+    def json(self):
+        if self._upload is not None and self._upload.spooled:
+            raise HTTPError(413, "JSON body too large")
+        try:
+            return json.loads(self.body or b"{}")
+        except ValueError:
+            raise HTTPError(400, "request body must be JSON")
+
+
+class Response:
+    def __init__(self, body=b"", status=200, content_type="application/json", headers=None):
+        self.body = body
+        self.status = status
+        self.content_type = content_type
+        self.headers = headers or {}
+
+
+def json_response(payload, status=200, headers=None):
+    return Response(json.dumps(payload).encode(), status, headers=headers)
+
+
+_UNSAFE_FILENAME = re.compile(r"[^A-Za-z0-9.-]+")  # runs of anything else (and "_") become one "_"
+
+
+def attachment(filename):
+    """Content-Disposition for a download named from user input (customer, employee name).
+
+    `filename` gets an ASCII slug; the full name goes in filename* (RFC 6266),
+    percent-encoded, so neither quotes, CR/LF nor non-Latin scripts reach the header raw.
+    """
+    slug = _UNSAFE_FILENAME.sub("_", filename).strip("_.") or "download"
+    return f"attachment; filename=\"{slug}\"; filename*=UTF-8''{quote(filename, safe='')}"
+
+
+class EventStream:
+    """SSE response fed by an async iterator of (event, payload) pairs."""
+
+    def __init__(self, events):
+        self.events = events
+
+
+class StreamingResponse:
+    """Chunked response fed by an async iterator of bytes."""
+
+    def __init__(self, chunks, content_type, headers=None):
+        self.chunks = chunks
+        self.content_type = content_type
+        self.headers = headers or {}
+
+
+# =========================
+# SYNC -> ASYNC BRIDGING
+# =========================
+async def iterate_in_thread(make_iterator, maxsize=0):
+    """Consume a blocking iterator on its own thread, yielding items here.
+
+    LLM streams block on network reads, so each one gets a dedicated thread
+    instead of tying up a pool worker for the whole answer. If the consumer
+    goes away, the iterator is closed on its own thread, which cancels the
+    upstream request. With `maxsize`, the thread waits while that many items
+    are unread (backpressure for large downloads).
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize)
+    cancelled = threading.Event()
+    done = object()
+
+    def put(entry):
+        if maxsize:
+            asyncio.run_coroutine_threadsafe(queue.put(entry), loop).result()
+        else:
+            loop.call_soon_threadsafe(queue.put_nowait, entry)
+
+    def pump():
+        iterator = None
+        try:
+            iterator = make_iterator()
+            for item in iterator:
+                if cancelled.is_set():
+                    break
+                put((item, None))
+        except BaseException as e:
+            if not cancelled.is_set():
+                put((done, e))
+            return
+        finally:
+            if cancelled.is_set() and hasattr(iterator, "close"):
+                iterator.close()
+        if not cancelled.is_set():
+            put((done, None))
+
+    threading.Thread(target=pump, daemon=True).start()
+    try:
+        while True:
+            item, error = await queue.get()
+            if item is done:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        cancelled.set()
+        # Free a pump thread blocked on a full queue so it sees the cancel
+        while not queue.empty():
+            queue.get_nowait()
+
+
+async def stream_answer(chunks, on_complete, routed=None):
+    """SSE events for an LLM answer; `on_complete(text)` persists it off-loop.
+
+    `routed` is the llm.RoutedStream behind `chunks`, if any; when it was
+    redirected the partial answer is not persisted.
+    """
+    loop = asyncio.get_running_loop()
+    full = ""
+    try:
+        async for chunk in chunks:
+            delta = chunk.choices[0].delta.content
+            if delta:
+                full += delta
+                yield "delta", {"content": delta}
+    except Exception as e:
+        yield "error", {"error": str(e)}
+        return
+    finally:
+        await chunks.aclose()
+    if routed is not None and routed.redirected:
+        yield "intent", {"intent": routed.intent, "data": routed.data}
+        return
+    await loop.run_in_executor(None, on_complete, full)
+    yield "done", {"content": full}
+
+
+# =========================
+# API
+# =========================
+def _pdf_bytes(kind, *args):
+    # Runs in the PDF process pool; BytesIO does not need to cross the boundary.
+    if kind == "invoice":
+        return documents.generate_invoice_pdf(*args).getvalue()
+    return documents.generate_legal_doc_pdf(*args).getvalue()
+
+
+# These run in the PDF process pool; a spooled upload crosses the boundary as its path.
+def _extract_text(upload, max_chars, pages=None):
+    # (text, page count); both come from the page cache when the file was seen before
+    text = documents.read_pdf_text(upload, max_chars=max_chars, pages=pages)
+    return text, documents.PdfDocument(upload).page_count
+
+
+def _preview(upload, max_chars):
+    doc = documents.PdfDocument(upload)
+    return {"pages": doc.page_count, "first_page": doc.page_text(1)[:max_chars] if doc.page_count else ""}
+
+
+class VyaparAPI:
+    def __init__(self, pdf_workers=2, db_workers=8, admission_workers=64):
+        self.db_pool = ThreadPoolExecutor(max_workers=db_workers, thread_name_prefix="api-db")
+        # Admission may queue a request for the shared LLM quota for a while
+        self.admission_pool = ThreadPoolExecutor(max_workers=admission_workers, thread_name_prefix="api-admit")
+        if pdf_workers > 0:
+            # spawn, not fork: forking a process that already runs pool and
+            # stream threads can copy a held lock into the child.
+            self.pdf_pool = ProcessPoolExecutor(
+                max_workers=pdf_workers, mp_context=multiprocessing.get_context("spawn"))
+        else:
+            self.pdf_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="api-pdf")
+        self.routes = {
+            ("POST", "/v1/auth/token"): (self.create_token, False),
+            ("DELETE", "/v1/auth/token"): (self.revoke_token, True),
+            ("GET", "/v1/history"): (self.history, True),
+            ("GET", "/v1/history/export"): (self.export_history, True),
+            ("DELETE", "/v1/history"): (self.clear_history, True),
+            ("POST", "/v1/intent"): (self.intent, True),
+            ("POST", "/v1/chat"): (self.chat, True),
+            ("POST", "/v1/invoice"): (self.invoice, True),
+            ("POST", "/v1/legal"): (self.legal, True),
+            ("POST", "/v1/documents/preview"): (self.preview_document, True),
+            ("POST", "/v1/documents/explain"): (self.explain_document, True),
+            ("GET", "/v1/jobs"): (self.job_status, True),
+            ("GET", "/v1/jobs/result"): (self.job_result, True),
+        }
+
+    async def run_db(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.db_pool, fn, *args)
+
+    async def run_pdf(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.pdf_pool, fn, *args)
+
+    async def llm_stream(self, messages, user_id):
+        # llm_chat admits the request eagerly (raising RateLimited before any
+        # response bytes are sent), then the chunks are read on their own thread.
+        stream = await asyncio.get_running_loop().run_in_executor(
+            self.admission_pool, lambda: llm.llm_chat(messages, user_id=user_id))
+        return iterate_in_thread(lambda: stream)
+
+    async def routed_stream(self, messages, user_id, user_text, classify):
+        """llm_stream via llm.routed_chat: (RoutedStream, chunks)."""
+        routed = await asyncio.get_running_loop().run_in_executor(
+            self.admission_pool,
+            lambda: llm.routed_chat(messages, user_text, user_id=user_id, classify=classify))
+        return routed, iterate_in_thread(lambda: routed)
+
+    def close(self):
+        self.db_pool.shutdown(wait=False)
+        self.admission_pool.shutdown(wait=False)
+        self.pdf_pool.shutdown(wait=False)
+
+    async def dispatch(self, request):
+        retention.touch()
+        route = self.routes.get((request.method, request.path))
+        if route is None:
+            if any(path == request.path for _, path in self.routes):
+                raise HTTPError(405)
+            raise HTTPError(404)
+        handler, needs_auth = route
+        if needs_auth:
+            auth = request.headers.get("authorization", "")
+            scheme, _, token = auth.partition(" ")
+            if scheme.lower() != "bearer" or not token:
+                raise HTTPError(401, "missing bearer token", {"WWW-Authenticate": "Bearer"})
+            user = await self.run_db(db.get_user_by_api_token, token.strip())
+            if user is None:
+                raise HTTPError(401, "invalid or expired token", {"WWW-Authenticate": "Bearer"})
+            request.user, request.token = user, token.strip()
+        return await handler(request)
+
+    # ---- auth ------------------------------------------------------------
+    async def create_token(self, request):
+        body = request.json()
+        user = await self.run_db(db.authenticate_user, body.get("username", ""), body.get("password", ""))
+        metrics.AUTH_EVENTS.labels(action="api_token", outcome="ok" if user else "rejected").inc()
+        if not user:
+            raise HTTPError(401, "invalid username or password")
+        token, expires_at = await self.run_db(db.create_api_token, user.id)
+        return json_response({"token": token, "expires_at": expires_at}, status=201)
+
+    async def revoke_token(self, request):
+        await self.run_db(db.revoke_api_token, request.token)
+        return Response(status=204)
+
+    # ---- chat ------------------------------------------------------------
+    async def history(self, request):
+        limit = int_param(request, "limit", HISTORY_LIMIT, 1, MAX_HISTORY_LIMIT)
+        before = int_param(request, "before", None, 1, 2**63 - 1)
+        messages, oldest_id = await self.run_db(db.load_chat_window, request.user.id, limit, before)
+        return json_response({"messages": messages, "oldest_id": oldest_id if len(messages) == limit else None})
+
+    async def export_history(self, request):
+        fmt = request.query.get("format", "jsonl")
+        if fmt not in export.FORMATS:
+            raise HTTPError(400, f"format must be one of: {', '.join(sorted(export.FORMATS))}")
+        user_id = request.user.id
+        fmt, content_type, ext = await self.run_db(export.resolve_format, fmt, user_id)
+        chunks = iterate_in_thread(lambda: export.iter_export(user_id, fmt), maxsize=4)
+        return StreamingResponse(chunks, content_type, {
+            "Content-Disposition": f'attachment; filename="vyapargpt_history.{ext}"',
+        })
+
+    async def clear_history(self, request):
+        await self.run_db(db.clear_chat_history, request.user.id)
+        return Response(status=204)
+
+    async def intent(self, request):
+        intent, data = llm.detect_intent(str(request.json().get("text", "")))
+        return json_response({"intent": intent, "data": data})
+
+    async def chat(self, request):
+        body = request.json()
+        message = str(body.get("message", "")).strip()
+        if not message:
+            raise HTTPError(400, "message is required")
+        user_id = request.user.id
+
+        # The same bounded window a chat session keeps (chatstore.py), not the whole history
+        messages = await self.run_db(chatstore.recent_messages, user_id)
+        await self.run_db(db.save_chat_message, user_id, "user", message)
+        messages.append({"role": "user", "content": message})
+
+        intent, data, sure = llm.rule_intent(message)
+        if intent != "chat":
+            metrics.CHAT_REQUESTS.labels(intent=intent).inc()
+            # Same hand-off as the UI: the client decides how to open the tool.
+            return json_response({"intent": intent, "data": data})
+
+        def persist(text):
+            db.save_chat_message(user_id, "assistant", text)
+
+        request_messages = prompts.chat_messages(messages, first_name=request.user.first_name)
+        try:
+            routed, chunks = await self.routed_stream(request_messages, user_id, message, classify=not sure)
+        except RateLimited:
+            metrics.CHAT_REQUESTS.labels(intent="chat").inc()
+            raise
+        async def counted(events):
+            # Counted once the final intent is known
+            try:
+                async for item in events:
+                    yield item
+            finally:
+                await events.aclose()
+                metrics.CHAT_REQUESTS.labels(intent=routed.intent).inc()
+
+        events = counted(stream_answer(chunks, persist, routed))
+        if body.get("stream", True):
+            return EventStream(events)
+        try:
+            async for event, payload in events:
+                if event == "error":
+                    return json_response(payload, status=502)
+                if event == "intent":
+                    return json_response(payload)
+                if event == "done":
+                    return json_response({"intent": "chat", "content": payload["content"]})
+        finally:
+            await events.aclose()
+
+    # ---- jobs ------------------------------------------------------------
+    async def submit_job(self, request, kind, params, input=None):
+        job_id = await self.run_db(jobs.enqueue, request.user.id, kind, params, input)
+        return json_response({"job_id": job_id, "status": jobs.QUEUED}, status=202,
+                             headers={"Location": f"/v1/jobs?id={job_id}"})
+
+    async def _own_job(self, request):
+        try:
+            job_id = int(request.query.get("id", ""))
+        except ValueError:
+            raise HTTPError(400, "id is required")
+        job = await self.run_db(jobs.get, job_id, request.user.id)
+        if job is None:
+            raise HTTPError(404, "no such job")
+        return job
+
+    async def job_status(self, request):
+        job = await self._own_job(request)
+        payload = {
+            "id": job.id, "kind": job.kind, "status": job.status, "progress": round(job.progress, 3),
+            "message": job.message, "error": job.error, "attempts": job.attempts,
+        }
+        if job.kind == "explain" and job.result:
+            # Partial answer while the explanation streams in
+            payload["answer"] = json.loads(job.result)["answer"]
+        return json_response(payload)
+
+    async def job_result(self, request):
+        job = await self._own_job(request)
+        if job.status != jobs.DONE:
+            raise HTTPError(409, f"job is {job.status}")
+        return Response(job.result, content_type=job.result_type)
+
+    # ---- documents -------------------------------------------------------
+    async def invoice(self, request):
+        body = request.json()
+        try:
+            amount = float(body.get("amount", 0) or 0)
+        except (TypeError, ValueError):
+            raise HTTPError(400, "amount must be a number")
+        customer = str(body.get("customer", ""))
+        if request.query.get("async"):
+            return await self.submit_job(request, "invoice", {"customer": customer, "amount": amount})
+        pdf = await self.run_pdf(_pdf_bytes, "invoice", customer, amount)
+        return Response(pdf, content_type="application/pdf", headers={
+            "Content-Disposition": attachment(f"invoice_{customer or 'customer'}.pdf"),
+        })
+
+    async def legal(self, request):
+        body = request.json()
+        doc_type = body.get("doc_type", "")
+        if doc_type not in ("Offer Letter", "NDA", "Leave Policy"):
+            raise HTTPError(400, "doc_type must be one of: Offer Letter, NDA, Leave Policy")
+        name = str(body.get("name", ""))
+        if request.query.get("async"):
+            return await self.submit_job(request, "legal", {"doc_type": doc_type, "name": name})
+        pdf = await self.run_pdf(_pdf_bytes, "legal", doc_type, name)
+        filename = f"{doc_type.replace(' ', '_').lower()}_{name or 'document'}.pdf"
+        return Response(pdf, content_type="application/pdf", headers={
+            "Content-Disposition": attachment(filename),
+        })
+
+    async def preview_document(self, request):
+        if not request.upload.size:
+            raise HTTPError(400, "send the PDF as the request body")
+        try:
+            preview = await self.run_pdf(_preview, request.upload, int_param(request, "max_chars", 1500, 1, 10**6))
+        except Exception as e:
+            raise HTTPError(422, f"could not read the PDF: {e}")
+        return json_response(preview)
+
+    async def explain_document(self, request):
+        if not request.upload.size:
+            raise HTTPError(400, "send the PDF as the request body")
+        max_chars = int_param(request, "max_chars", 8000, 1, 10**6)
+        try:
+            pages = documents.parse_page_range(request.query.get("pages"))
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+        if request.query.get("async"):
+            params = {"max_chars": max_chars}
+            if pages is not None:
+                params["pages"] = f"{pages[0]}-{pages[1]}"
+            return await self.submit_job(request, "explain", params, request.upload)
+        try:
+            text, page_count = await self.run_pdf(_extract_text, request.upload, max_chars, pages)
+        except documents.PageRangeError as e:
+            raise HTTPError(400, str(e))
+        except Exception as e:
+            metrics.DOCUMENTS_PROCESSED.labels(outcome="error").inc()
+            raise HTTPError(422, f"could not read the PDF: {e}")
+        user_id = request.user.id
+        summary_prompt = documents.document_summary_prompt(text, pages, page_count)
+        messages = await self.run_db(chatstore.recent_messages, user_id)
+        messages.append({"role": "user", "content": summary_prompt})
+        request_messages = prompts.chat_messages(messages, first_name=request.user.first_name)
+
+        def persist(answer):
+            db.save_chat_message(user_id, "user", summary_prompt)
+            db.save_chat_message(user_id, "assistant", answer)
+            metrics.DOCUMENTS_PROCESSED.labels(outcome="ok").inc()
+
+        return EventStream(stream_answer(await self.llm_stream(request_messages, user_id), persist))
+
+
+# =========================
+# HTTP/1.1 SERVER
+# =========================
+async def read_head(reader):
+    """(method, target, headers), or None when the client closed the connection."""
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, _ = line.decode("latin-1").rstrip("\r\n").split(" ", 2)
+    except ValueError:
+        raise HTTPError(400, "malformed request line")
+    headers = {}
+    while True:
+        raw = await reader.readline()
+        if raw in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = raw.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return method, target, headers
+
+
+async def read_body(reader, size):
+    """Exactly `size` bytes; the timeout is per read, so only an idle client times out."""
+    parts = []
+    remaining = size
+    while remaining:
+        part = await asyncio.wait_for(reader.read(min(remaining, 2**16)), BODY_IDLE_TIMEOUT)
+        if not part:
+            raise asyncio.IncompleteReadError(b"".join(parts), size)
+        parts.append(part)
+        remaining -= len(part)
+    return b"".join(parts)
+
+
+async def read_request(reader):
+    head = await asyncio.wait_for(read_head(reader), KEEPALIVE_TIMEOUT)
+    if head is None:
+        return None
+    method, target, headers = head
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        raise HTTPError(411, "chunked request bodies are not supported")
+    try:
+        length = int(headers.get("content-length") or 0)
+    except ValueError:
+        raise HTTPError(400, "bad content-length")
+    if length < 0:
+        raise HTTPError(400, "bad content-length")
+    if length > MAX_BODY:
+        raise HTTPError(413)
+    if length <= uploads.SPOOL_BYTES:
+        return Request(method.upper(), target, headers, await read_body(reader, length))
+    # A large body (a PDF) goes to a spool file as it arrives, hashed on the way;
+    # the file writes run on the default executor, off the event loop
+    loop = asyncio.get_running_loop()
+    upload = uploads.Upload()
+    try:
+        while upload.size < length:
+            chunk = await read_body(reader, min(uploads.CHUNK_SIZE, length - upload.size))
+            await loop.run_in_executor(None, upload.write, chunk)
+        await loop.run_in_executor(None, upload.finish)
+    except BaseException:
+        upload.close()
+        raise
+    return Request(method.upper(), target, headers, b"", upload)
+
+
+def _head(status, headers):
+    lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}"]
+    for k, v in headers.items():
+        v = str(v)
+        if "\r" in v or "\n" in v:
+            raise ValueError(f"response header {k} contains CR/LF")
+        lines.append(f"{k}: {v}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+async def write_response(writer, response, keep_alive):
+    headers = {
+        "Content-Type": response.content_type,
+        "Content-Length": str(len(response.body)),
+        "Connection": "keep-alive" if keep_alive else "close",
+        **response.headers,
+    }
+    writer.write(_head(response.status, headers) + response.body)
+    await writer.drain()
+
+
+async def write_event_stream(writer, stream, keep_alive):
+    writer.write(_head(200, {
+        "Content-Type": "text/event-stream",
+        "Cache-Control": "no-cache",
+        "Transfer-Encoding": "chunked",
+        "Connection": "keep-alive" if keep_alive else "close",
+    }))
+    events = stream.events
+    try:
+        async for event, payload in events:
+            data = f"event: {event}\ndata: {json.dumps(payload)}\n\n".encode()
+            writer.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+            await writer.drain()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+    finally:
+        # Closing the generator stops the upstream stream if the client left.
+        await events.aclose()
+
+
+async def write_streaming_response(writer, response, keep_alive):
+    writer.write(_head(200, {
+        "Content-Type": response.content_type,
+        "Transfer-Encoding": "chunked",
+        "Connection": "keep-alive" if keep_alive else "close",
+        **response.headers,
+    }))
+    chunks = response.chunks
+    try:
+        async for chunk in chunks:
+            writer.write(f"{len(chunk):X}\r\n".encode() + chunk + b"\r\n")
+            # drain() waits for the socket, which in turn pauses the producer
+            await writer.drain()
+    except (ConnectionError, asyncio.CancelledError):
+        raise
+    except Exception as e:
+        # Headers are gone already; dropping the connection without the final
+        # chunk tells the client the download is incomplete.
+        print(f"api: streaming response failed: {e}")
+        writer.close()
+        return
+    finally:
+        await chunks.aclose()
+    writer.write(b"0\r\n\r\n")
+    await writer.drain()
+
+
+class ApiServer:
+    def __init__(self, api, host="127.0.0.1", port=8080):
+        self.api = api
+        self.host = host
+        self.port = port
+        self._server = None
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except HTTPError as e:
+                    await write_response(writer, json_response({"error": e.message}, e.status, e.headers), False)
+                    return
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+                    return
+                if request is None:
+                    return
+                keep_alive = request.headers.get("connection", "").lower() != "close"
+                try:
+                    try:
+                        response = await self.api.dispatch(request)
+                    except HTTPError as e:
+                        response = json_response({"error": e.message}, e.status, e.headers)
+                    except RateLimited as e:
+                        response = json_response(
+                            {"error": "rate_limited", "reason": e.reason, "retry_after": round(e.retry_after, 1)},
+                            429, {"Retry-After": str(max(1, round(e.retry_after)))})
+                    except Exception as e:
+                        response = json_response({"error": f"internal error: {e}"}, 500)
+                    if isinstance(response, EventStream):
+                        await write_event_stream(writer, response, keep_alive)
+                    elif isinstance(response, StreamingResponse):
+                        await write_streaming_response(writer, response, keep_alive)
+                    else:
+                        try:
+                            await write_response(writer, response, keep_alive)
+                        except ValueError as e:
+                            # A header _head refused (CR/LF, not Latin-1); nothing was written yet
+                            await write_response(
+                                writer, json_response({"error": f"internal error: {e}"}, 500), keep_alive)
+                finally:
+                    # Removes a spooled upload once the response is out
+                    request.close()
+                if not keep_alive:
+                    return
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self.handle, self.host, self.port, limit=2**16)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def serve_forever(self):
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    def start_in_thread(self):
+        """Run on a private event loop in a daemon thread (benchmarks, embedding)."""
+        started = threading.Event()
+
+        def run():
+            loop = asyncio.new_event_loop()
+            self.loop = loop
+            loop.run_until_complete(self.start())
+            started.set()
+            loop.run_forever()
+            loop.close()
+
+        self._thread = threading.Thread(target=run, name="vyapar-api", daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    async def shutdown(self):
+        self._server.close()
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stop(self):
+        loop = getattr(self, "loop", None)
+        if loop is not None:
+            asyncio.run_coroutine_threadsafe(self.shutdown(), loop).result(timeout=10)
+            loop.call_soon_threadsafe(loop.stop)
+            self._thread.join()
+        self.api.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="VyaparGPT headless API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--pdf-workers", type=int, default=2, help="PDF worker processes (0 = threads)")
+    args = parser.parse_args(argv)
+
+    db.init_db()
+    metrics.start_exporter_from_env()
+    jobs.start_workers_from_env()
+    retention.start_maintenance_from_env()
+    server = ApiServer(VyaparAPI(pdf_workers=args.pdf_workers), args.host, args.port)
+    print(f"VyaparGPT API listening on http://{args.host}:{args.port}")
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
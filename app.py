@@ -1,138 +1,57 @@
+import json
 import os
-import re
-import sqlite3
-from io import BytesIO
-import streamlit as st
-from hashlib import sha256
+import tempfile
 import time
-import uuid
 
-# Groq OpenAI-compatible client
-from openai import OpenAI
+import streamlit as st
 
-# Optional imports for PDFs
-try:
-    from reportlab.lib.pagesizes import A4
-    from reportlab.pdfgen import canvas
-except Exception:
-    A4 = None
-    canvas = None
+import chatstore
+import documents
+import export
+import generation
+import jobs
+import metrics
+import prompts
+import retention
+import tracing
+import uploads
+import usage
+
+from db import (
+    init_db, register_user, authenticate_user, get_user_by_username,
+    create_password_reset_token, validate_reset_token, update_password,
+    save_chat_message, clear_chat_history,
+    create_session, get_user_by_session, revoke_session,
+)
+from llm import routed_chat, rule_intent
+from ratelimit import RateLimited
 
-try:
-    import PyPDF2
-except Exception:
-    PyPDF2 = None
+# How often a page with a running background job polls for progress
+JOB_POLL_SECONDS = 1.0
+# A fresh session picks up the user's jobs from this far back
+JOB_RESUME_WINDOW = 3600
+# How often the chat page redraws an answer that is still streaming
+STREAM_REFRESH_SECONDS = 0.05
 
-# =========================
-# DATABASE SETUP
-# =========================
-DB_PATH = "users.db"
+# Chat turns loaded when a conversation is opened; older ones load on demand
+HISTORY_WINDOW = int(os.environ.get("VYAPAR_HISTORY_WINDOW", "50"))
+# Login sessions (the ?sid= URL parameter) survive refreshes for this long
+SESSION_TTL = int(os.environ.get("VYAPAR_SESSION_TTL", str(7 * 24 * 3600)))
 
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
-    # Create users table
-    c.execute("""
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT UNIQUE NOT NULL,
-        password TEXT NOT NULL,
-        first_name TEXT,
-        last_name TEXT,
-        email TEXT,
-        phone TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )
-    """)
-    
-    # Create password_reset_tokens table
-    c.execute("""
-    CREATE TABLE IF NOT EXISTS password_reset_tokens (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        token TEXT NOT NULL,
-        expires_at TIMESTAMP NOT NULL,
-        used BOOLEAN DEFAULT FALSE,
-        FOREIGN KEY (user_id) REFERENCES users (id)
-    )
-    """)
-    
-    # Create chat_history table
-    c.execute("""
-    CREATE TABLE IF NOT EXISTS chat_history (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        role TEXT NOT NULL,
-        content TEXT NOT NULL,
-        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (user_id) REFERENCES users (id)
-    )
-    """)
-    
-    conn.commit()
-    conn.close()
-
-def hash_password(password: str) -> str:
-    return sha256(password.encode()).hexdigest()
-
-def register_user(username, password, first_name, last_name, email="", phone=""):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    try:
-        c.execute(
-            "INSERT INTO users (username, password, first_name, last_name, email, phone) VALUES (?, ?, ?, ?, ?, ?)",
-            (username, hash_password(password), first_name, last_name, email, phone)
-        )
-        conn.commit()
-        return True, "Registration successful!"
-    except sqlite3.IntegrityError:
-        return False, "Username already exists."
-    finally:
-        conn.close()
-
-def authenticate_user(username, password):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT * FROM users WHERE username = ? AND password = ?", 
-              (username, hash_password(password)))
-    user = c.fetchone()
-    conn.close()
-    return user
-
-def get_user_by_username(username):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT * FROM users WHERE username = ?", (username,))
-    user = c.fetchone()
-    conn.close()
-    return user
-
-# def create_password_reset_token(user_id):
-#     conn = sqlite3.connect(DB_PATH)
-#     c = conn.cursor()
-#     token = str(uuid.uuid4())
-#     expires_at = time.time() + 3600  # 1 hour from now
-#     c.execute(
-#         "INSERT INTO password_reset_tokens (user_id, token, expires_at) VALUES (?, ?, ?)",
-#         (user_id, token, expires_at)
-#     )
-#     conn.commit()
-#     conn.close()
-#     return token
-
-def create_password_reset_token(user_id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    token = str(uuid.uuid4())
-    expires_at = time.time() + 3600  # 1 hour from now
-    c.execute(
-        "INSERT INTO password_reset_tokens (user_id, token, expires_at) VALUES (?, ?, ?)",
-        (user_id, token, expires_at)
-    )
-    conn.commit()
-    conn.close()
-    return token
+# Larger history exports are only offered through the streaming API
+UI_EXPORT_LIMIT = 25 * 2**20
+
+# Usernames allowed to see the LLM usage admin page
+ADMIN_USERS = {u.strip() for u in os.environ.get("VYAPAR_ADMIN_USERS", "").split(",") if u.strip()}
+
+def queued_message(eta):
+    return f"⏳ Lots of MSMEs are asking right now — you're in the queue (about {max(1, round(eta))}s)…"
+
+def throttled_message(e):
+    if e.reason == "busy":
+        return f"🚦 VyaparGPT is very busy right now. Please try again in about {max(1, round(e.retry_after))} seconds."
+    return (f"🚦 You've hit your plan's usage limit for the moment. "
+            f"Please try again in about {max(1, round(e.retry_after))} seconds, or send a shorter message.")
 
 def send_reset_email(email, token):
     """Mock email sending function - in production, integrate with real email service"""
@@ -159,7 +78,7 @@ def show_password_reset():
             
             if st.button("Update Password"):
                 if new_password == confirm_password:
-                    update_password(user[0], new_password)
+                    update_password(user.id, new_password)
                     st.success("Password updated successfully! Please login with your new password.")
                     st.session_state.reset_token = None
                     st.rerun()
@@ -176,8 +95,8 @@ def show_password_reset():
         if st.button("Send Reset Link"):
             user = get_user_by_username(username)
             if user:
-                token = create_password_reset_token(user[0])
-                user_email = user[5]  # email is at index 5
+                token = create_password_reset_token(user.id)
+                user_email = user.email
                 
                 if user_email:  # If user registered with email
                     if send_reset_email(user_email, token):
@@ -192,65 +111,6 @@ def show_password_reset():
             else:
                 st.error("Username not found")
 
-def validate_reset_token(token):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("""
-        SELECT u.* FROM password_reset_tokens t
-        JOIN users u ON t.user_id = u.id
-        WHERE t.token = ? AND t.expires_at > ? AND t.used = FALSE
-    """, (token, time.time()))
-    user = c.fetchone()
-    conn.close()
-    return user
-
-def update_password(user_id, new_password):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute(
-        "UPDATE users SET password = ? WHERE id = ?",
-        (hash_password(new_password), user_id))
-    c.execute(
-        "UPDATE password_reset_tokens SET used = TRUE WHERE user_id = ?",
-        (user_id,))
-    conn.commit()
-    conn.close()
-
-def save_chat_message(user_id, role, content):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute(
-        "INSERT INTO chat_history (user_id, role, content) VALUES (?, ?, ?)",
-        (user_id, role, content))
-    conn.commit()
-    conn.close()
-
-def load_chat_history(user_id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("""
-        SELECT role, content FROM chat_history 
-        WHERE user_id = ? 
-        ORDER BY timestamp ASC
-    """, (user_id,))
-    messages = [{"role": row[0], "content": row[1]} for row in c.fetchall()]
-    conn.close()
-    
-    # Ensure system message is always first
-    if not messages or messages[0]["role"] != "system":
-        system_message = {
-            "role": "system",
-            "content": "You are VyaparGPT, an AI assistant helping Indian MSMEs with business, compliance, invoices, legal, HR, and documents."
-        }
-        messages.insert(0, system_message)
-    return messages
-
-def clear_chat_history(user_id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("DELETE FROM chat_history WHERE user_id = ?", (user_id,))
-    conn.commit()
-    conn.close()
 
 # =========================
 # CONFIG & PAGE SETUP
@@ -302,18 +162,15 @@ st.markdown(
           0%, 60%, 100% { transform: translateY(0); }
           30% { transform: translateY(-5px); }
       }
+      .wf-row { font-size: 0.75rem; margin-bottom: 0.2rem; }
+      .wf-track { background: #f0f2f6; height: 6px; border-radius: 3px; }
+      .wf-bar { background: #1e88e5; height: 6px; border-radius: 3px; }
+      .wf-ms { color: #666; }
     </style>
     """,
     unsafe_allow_html=True,
 )
 
-# =========================
-# GROQ CLIENT SETUP
-# =========================
-GROQ_API_KEY = "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"
-client = OpenAI(api_key=GROQ_API_KEY, base_url="https://api.groq.com/openai/v1")
-DEFAULT_MODEL = "llama-3.1-8b-instant"
-
 # =========================
 # SESSION STATE
 # =========================
@@ -332,141 +189,82 @@ def init_state():
         st.session_state.logged_in_user = None
     if "user_details" not in st.session_state:
         st.session_state.user_details = {}
-    if "messages" not in st.session_state:
-        st.session_state.messages = [
-            {"role": "system", "content": "You are VyaparGPT, an AI assistant helping Indian MSMEs with business, compliance, invoices, legal, HR, and documents."}
-        ]
+    if "chat" not in st.session_state:
+        st.session_state.chat = None  # chatstore.ChatStore of the logged-in user
     if "typing_complete" not in st.session_state:
         st.session_state.typing_complete = False
     if "current_response" not in st.session_state:
         st.session_state.current_response = ""
     if "reset_token" not in st.session_state:
         st.session_state.reset_token = None
+    if "tracer" not in st.session_state:
+        st.session_state.tracer = tracing.Tracer()
+    if "jobs" not in st.session_state:
+        st.session_state.jobs = {}  # kind -> job id shown on that page
+    if "explain_upload" not in st.session_state:
+        st.session_state.explain_upload = None  # (file_id, documents.PdfDocument) of the current upload
+    if "explain_pending" not in st.session_state:
+        st.session_state.explain_pending = set()  # explain jobs whose answer still has to join the chat
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = None
+    if "generation" not in st.session_state:
+        st.session_state.generation = None  # key of a background answer that still has to join the chat
+    if "chat_notice" not in st.session_state:
+        st.session_state.chat_notice = None
 
 init_state()
+metrics.start_exporter_from_env()
+
+# Stage timings are only collected while the debug sidebar is on
+if st.session_state.debug:
+    tracing.activate(st.session_state.tracer)
+    st.session_state.tracer.begin_run()
+else:
+    tracing.activate(None)
+
 init_db()
+jobs.start_workers_from_env()
+retention.start_maintenance_from_env()
+retention.touch()
 
 # =========================
-# HELPERS
+# SESSIONS & HISTORY WINDOW
 # =========================
-def llm_chat(messages, model=DEFAULT_MODEL, max_tokens=800):
-    resp = client.chat.completions.create(
-        model=model,
-        messages=messages,
-        max_tokens=max_tokens,
-        stream=True
-    )
-    return resp
-
-def detect_intent(user_text: str):
-    text = user_text.lower()
-    
-    # More precise invoice detection
-    invoice_phrases = [
-        "create invoice", "generate invoice", "make invoice",
-        "create bill", "generate bill", "make bill",
-        "invoice for", "bill for"
-    ]
-    if any(phrase in text for phrase in invoice_phrases):
-        name_match = re.search(r"(?:invoice|bill|for)\s+(?:for|to|of)?\s*([a-zA-Z\s]+?)\s*(?:for|of|₹|rs|rupees|amount)", text)
-        amt_match = re.search(r"(?:₹|rs\.?|rupees?|inr)\s*(\d{2,7}(?:,\d{3})*(?:\.\d{1,2})?)", text) or \
-                   re.search(r"\b(\d{2,7}(?:,\d{3})*(?:\.\d{1,2})?)\s*(?:₹|rs|rupees|inr)?\b", text)
-        
-        cust = name_match.group(1).strip().title() if name_match else ""
-        amt = float(amt_match.group(1).replace(',', '')) if amt_match else 0.0
-        return ("invoice", {"customer": cust, "amount": amt})
-    
-    # Strict document detection - only when user explicitly mentions uploading
-    doc_phrases = [
-        "upload document", "explain document", "analyze document",
-        "upload pdf", "explain pdf", "analyze pdf",
-        "upload gst", "explain gst", "analyze notice",
-        "can you analyze this", "help me understand this document"
-    ]
-    # Only trigger if user explicitly mentions uploading or analyzing a document
-    has_upload_words = any(word in text for word in ["upload", "analyze", "explain"])
-    has_doc_words = any(word in text for word in ["document", "pdf", "gst", "notice"])
-    if (has_upload_words and has_doc_words) or any(phrase in text for phrase in doc_phrases):
-        return ("document", {})
-    
-    return ("chat", {})
-
-def generate_invoice_pdf(customer: str, amount: float) -> BytesIO:
-    if canvas is None or A4 is None:
-        raise RuntimeError("reportlab not installed. Run: pip install reportlab")
-    buffer = BytesIO()
-    pdf = canvas.Canvas(buffer, pagesize=A4)
-    width, height = A4
-    pdf.setFont("Helvetica-Bold", 18)
-    pdf.drawString(72, height - 72, "VyaparGPT - Invoice")
-    pdf.setFont("Helvetica", 12)
-    y = height - 120
-    pdf.drawString(72, y, f"Customer: {customer or '-'}"); y -= 20
-    pdf.drawString(72, y, f"Amount: ₹{amount:,.2f}"); y -= 20
-    pdf.drawString(72, y, "Status: Pending"); y -= 30
-    pdf.setFont("Helvetica-Oblique", 10)
-    pdf.drawString(72, 72, "Generated by VyaparGPT (demo)")
-    pdf.showPage()
-    pdf.save()
-    buffer.seek(0)
-    return buffer
-
-def read_pdf_text(uploaded_file, max_chars=8000) -> str:
-    if PyPDF2 is None:
-        raise RuntimeError("PyPDF2 not installed. Run: pip install PyPDF2")
-    reader = PyPDF2.PdfReader(uploaded_file)
-    text_chunks = []
-    for page in reader.pages:
-        try:
-            text_chunks.append(page.extract_text() or "")
-        except Exception:
-            pass
-        if sum(len(t) for t in text_chunks) > max_chars:
-            break
-    text = "\n".join(text_chunks)
-    if len(text) > max_chars:
-        text = text[:max_chars]
-    return text.strip()
-
-def generate_legal_doc_pdf(doc_type: str, name: str) -> BytesIO:
-    if canvas is None or A4 is None:
-        raise RuntimeError("reportlab not installed. Run: pip install reportlab")
-    buffer = BytesIO()
-    pdf = canvas.Canvas(buffer, pagesize=A4)
-    width, height = A4
-    pdf.setFont("Helvetica-Bold", 16)
-    pdf.drawString(72, height - 72, f"{doc_type}")
-    pdf.setFont("Helvetica", 12)
-    y = height - 120
-    if doc_type == "Offer Letter":
-        lines = [
-            f"Dear {name or 'Candidate'},",
-            "We are pleased to offer you a position at our company.",
-            "This offer is subject to company policies and applicable laws.",
-            "Please sign and return to confirm your acceptance.",
-        ]
-    elif doc_type == "NDA":
-        lines = [
-            f"Non-Disclosure Agreement with {name or 'Party'}",
-            "The parties agree to keep confidential information private.",
-            "This agreement covers disclosures, obligations, and term.",
-        ]
+def sign_in(user, session_id):
+    st.session_state.logged_in_user = user
+    st.session_state.user_details = {
+        "first_name": user.first_name,
+        "last_name": user.last_name,
+        "email": user.email,
+        "phone": user.phone
+    }
+    st.session_state.session_id = session_id
+    st.query_params["sid"] = session_id
+    # Chat history is read when a page first needs it (ensure_history)
+    st.session_state.chat = chatstore.ChatStore(user.id)
+
+def resume_session():
+    """Log back in from the ?sid= URL parameter after a refresh or in a new tab."""
+    session_id = st.query_params.get("sid")
+    if not session_id:
+        return
+    user = get_user_by_session(session_id)
+    metrics.AUTH_EVENTS.labels(action="session_resume", outcome="ok" if user else "rejected").inc()
+    if user:
+        sign_in(user, session_id)
+        # An answer still streaming for this login (e.g. before a refresh)
+        running = generation.manager.latest(session_id)
+        if running is not None and not running.finished:
+            st.session_state.generation = running.key
     else:
-        lines = [
-            "Leave Policy (Summary)",
-            "- Earned Leave, Casual Leave, Sick Leave as per policy.",
-            "- Prior approval required for planned leaves.",
-            "- Medical certificate may be required for extended sick leave.",
-        ]
-    for line in lines:
-        pdf.drawString(72, y, line)
-        y -= 20
-    pdf.setFont("Helvetica-Oblique", 10)
-    pdf.drawString(72, 72, "Generated by VyaparGPT (demo)")
-    pdf.showPage()
-    pdf.save()
-    buffer.seek(0)
-    return buffer
+        del st.query_params["sid"]
+
+def ensure_history():
+    """Load the most recent HISTORY_WINDOW turns into the chat context, once per session."""
+    st.session_state.chat.load(HISTORY_WINDOW)
+
+if st.session_state.logged_in_user is None:
+    resume_session()
 
 # =========================
 # PASSWORD RESET FUNCTIONS
@@ -482,7 +280,8 @@ def show_password_reset():
             
             if st.button("Update Password"):
                 if new_password == confirm_password:
-                    update_password(user[0], new_password)
+                    update_password(user.id, new_password)
+                    metrics.AUTH_EVENTS.labels(action="password_reset", outcome="ok").inc()
                     st.success("Password updated successfully! Please login with your new password.")
                     st.session_state.reset_token = None
                     st.rerun()
@@ -498,8 +297,9 @@ def show_password_reset():
         
         if st.button("Send Reset Link"):
             user = get_user_by_username(username)
+            metrics.AUTH_EVENTS.labels(action="reset_request", outcome="ok" if user else "rejected").inc()
             if user:
-                token = create_password_reset_token(user[0])
+                token = create_password_reset_token(user.id)
                 # In a real app, you would send this token via email
                 st.success(f"Reset token generated (would be sent via email in production): {token}")
                 st.info("For demo purposes, you can use this token to reset your password")
@@ -526,6 +326,7 @@ if st.session_state.logged_in_user is None:
             phone = st.sidebar.text_input("Phone (optional)")
             if st.sidebar.button("Register"):
                 success, msg = register_user(username, password, first_name, last_name, email, phone)
+                metrics.AUTH_EVENTS.labels(action="register", outcome="ok" if success else "rejected").inc()
                 if success:
                     st.success(msg)
                 else:
@@ -537,17 +338,10 @@ if st.session_state.logged_in_user is None:
             password = st.sidebar.text_input("Password", type="password")
             if st.sidebar.button("Login"):
                 user = authenticate_user(username, password)
+                metrics.AUTH_EVENTS.labels(action="login", outcome="ok" if user else "rejected").inc()
                 if user:
-                    st.session_state.logged_in_user = user
-                    st.session_state.user_details = {
-                        "first_name": user[3],
-                        "last_name": user[4],
-                        "email": user[5],
-                        "phone": user[6]
-                    }
-                    # Load user's chat history
-                    st.session_state.messages = load_chat_history(user[0])
-                    st.success(f"Welcome {user[3]} {user[4]}!")
+                    sign_in(user, create_session(user.id, ttl=SESSION_TTL))
+                    st.success(f"Welcome {user.first_name} {user.last_name}!")
                     st.rerun()
                 else:
                     st.error("Invalid username or password.")
@@ -556,27 +350,167 @@ if st.session_state.logged_in_user is None:
             st.session_state.reset_token = None
             show_password_reset()
 else:
-    st.sidebar.success(f"Logged in as: {st.session_state.logged_in_user[3]} {st.session_state.logged_in_user[4]}")
+    st.sidebar.success(f"Logged in as: {st.session_state.logged_in_user.first_name} {st.session_state.logged_in_user.last_name}")
     if st.sidebar.button("Logout"):
+        if st.session_state.session_id:
+            generation.manager.stop_session(st.session_state.session_id)
+            revoke_session(st.session_state.session_id)
+        st.session_state.generation = None
+        st.session_state.session_id = None
+        st.query_params.pop("sid", None)
         st.session_state.logged_in_user = None
         st.session_state.user_details = {}
-        st.session_state.messages = [
-            {"role": "system", "content": "You are VyaparGPT, an AI assistant helping Indian MSMEs with business, compliance, invoices, legal, HR, and documents."}
-        ]
+        st.session_state.chat = None
+        st.session_state.jobs = {}
+        st.session_state.explain_pending = set()
         st.rerun()
 
+# =========================
+# BACKGROUND JOBS
+# =========================
+def submit_job(kind, params=None, input=None):
+    job_id = jobs.enqueue(st.session_state.logged_in_user.id, kind, params, input)
+    st.session_state.jobs[kind] = job_id
+    return job_id
+
+def page_job(kind):
+    """The job shown on a page: this session's, else the user's latest recent one."""
+    user_id = st.session_state.logged_in_user.id
+    job_id = st.session_state.jobs.get(kind)
+    if job_id is not None:
+        return jobs.get(job_id, user_id)
+    job = jobs.latest(user_id, kind, since=time.time() - JOB_RESUME_WINDOW)
+    if job is not None:
+        st.session_state.jobs[kind] = job.id
+    return job
+
+def job_poller(job_id, render_partial=None):
+    job = jobs.get(job_id)
+    if job is None or job.finished:
+        # Full rerun: the page renders the result and stops polling
+        st.rerun()
+    if job.status == "queued":
+        text = job.message or "Waiting for a worker…"
+    else:
+        text = job.message or "Working…"
+    st.progress(min(1.0, job.progress), text=text)
+    if render_partial is not None and job.result:
+        render_partial(job)
+
+def render_job(kind, render_partial=None):
+    """Show progress for a page's job while it runs (polling); returns the job or None."""
+    job = page_job(kind)
+    if job is not None and not job.finished:
+        st.fragment(job_poller, run_every=JOB_POLL_SECONDS, key=f"job-{kind}")(job.id, render_partial)
+    return job
+
+def pdf_job_download(job, label):
+    st.download_button(label, data=job.result, file_name=job.params.get("file_name", "document.pdf"),
+                       mime="application/pdf")
+
+def apply_finished_explains():
+    # Explanations are saved to chat_history by the worker; mirror them into
+    # this session's context once they finish (a window loaded later reads them from the DB).
+    for job_id in sorted(st.session_state.explain_pending):
+        job = jobs.get(job_id)
+        if job is None or job.status == "failed" or (job.finished and not st.session_state.chat.loaded):
+            st.session_state.explain_pending.discard(job_id)
+        elif job.status == "done":
+            out = job.result_json()
+            st.session_state.chat.append("user", out["prompt"])
+            st.session_state.chat.append("assistant", out["answer"])
+            st.session_state.explain_pending.discard(job_id)
+
+# =========================
+# CHAT ROUTING
+# =========================
+def redirect_to_tool(intent, data):
+    """Answer a tool request from the chat with a hand-off message and open the tool's page."""
+    if intent == "invoice":
+        customer = data.get("customer", "") or st.session_state.invoice_customer
+        amount = data.get("amount", 0.0) or st.session_state.invoice_amount
+        
+        st.session_state.invoice_customer = customer
+        st.session_state.invoice_amount = amount
+        
+        if customer and amount:
+            reply = f"Sure! Taking you to the Invoice Generator for {customer} with amount ₹{amount:,.2f}..."
+        elif customer:
+            reply = f"Understood! Preparing invoice for {customer}. Please enter the amount."
+        elif amount:
+            reply = f"Got it! Preparing invoice for ₹{amount:,.2f}. Please enter customer name."
+        else:
+            reply = "Taking you to the Invoice Generator..."
+        st.session_state.active_tab = "Invoice Generator"
+    else:
+        reply = "Please upload your document in the Document Explainer section and I'll analyze it for you."
+        st.session_state.active_tab = "Explain Document"
+    
+    # Save assistant message to DB and session
+    save_chat_message(st.session_state.logged_in_user.id, "assistant", reply)
+    st.session_state.chat.append("assistant", reply)
+    st.chat_message("assistant").markdown(reply)
+    st.rerun()
+
+# =========================
+# BACKGROUND ANSWERS
+# =========================
+def apply_finished_generation():
+    """Mirror this session's background answer into the chat once it has finished.
+
+    The worker already saved it to chat_history; a window loaded after that
+    reads it from the DB instead.
+    """
+    gen = generation.manager.get(st.session_state.generation)
+    if gen is not None and not gen.finished:
+        return
+    st.session_state.generation = None
+    if gen is None:
+        return
+    st.session_state.last_intent = gen.intent
+    if gen.status == generation.REDIRECTED:
+        redirect_to_tool(gen.intent, gen.data)
+    elif gen.content and st.session_state.chat.loaded:
+        st.session_state.chat.append("assistant", gen.content)
+    elif gen.status == generation.FAILED:
+        st.session_state.chat_notice = f"Could not get an answer: {gen.error}"
+
+def render_generation():
+    """Follow this session's background answer until it ends; Stop cancels it upstream."""
+    gen = generation.manager.get(st.session_state.generation)
+    if gen is None:
+        return
+    if st.button("⏹ Stop", key=f"stop-{gen.key[1]}"):
+        gen.stop()
+    with st.chat_message("assistant"):
+        response_container = st.empty()
+        with st.spinner("Thinking..."):
+            # A click elsewhere ends this run, not the answer: the next run attaches again
+            while not gen.wait(STREAM_REFRESH_SECONDS):
+                if gen.text:
+                    response_container.markdown(gen.text + "▌")
+    apply_finished_generation()
+    # Redraw with the answer in the history and the chat input enabled again
+    st.rerun()
+
 # =========================
 # NAVIGATION
 # =========================
 if st.session_state.logged_in_user:
     nav_labels = ["Overview", "Chat Assistant", "Invoice Generator", "Explain Document", "Legal Doc Generator"]
+    if st.session_state.logged_in_user.username in ADMIN_USERS:
+        nav_labels.append("Usage Admin")
     option = st.sidebar.radio("Navigate", nav_labels, index=nav_labels.index(st.session_state.active_tab))
+    if st.session_state.explain_pending:
+        apply_finished_explains()
+    if st.session_state.generation is not None:
+        apply_finished_generation()
 
     if st.sidebar.button("🧹 Clear Chat"):
-        clear_chat_history(st.session_state.logged_in_user[0])
-        st.session_state.messages = [
-            {"role": "system", "content": "You are VyaparGPT, an AI assistant helping Indian MSMEs with business, compliance, invoices, legal, HR, and documents."}
-        ]
+        generation.manager.stop_session(st.session_state.session_id)
+        st.session_state.generation = None
+        clear_chat_history(st.session_state.logged_in_user.id)
+        st.session_state.chat.clear()
         st.rerun()
 
     # =========================
@@ -624,82 +558,98 @@ if st.session_state.logged_in_user:
     # =========================
     elif option == "Chat Assistant":
         st.header("💬 Compliance / Business Chat")
-
-        # Update system message to include user details if available
-        if st.session_state.user_details and len(st.session_state.messages) > 0:
-            user_info = st.session_state.user_details
-            st.session_state.messages[0] = {
-                "role": "system",
-                "content": f"""You are VyaparGPT, an AI assistant helping Indian MSMEs with business, compliance, invoices, legal, HR, and documents.
-                The current user is {user_info['first_name']} {user_info['last_name']}.
-                Contact details - Email: {user_info.get('email', 'not provided')}, Phone: {user_info.get('phone', 'not provided')}."""
-            }
-
-        # Display chat messages (skip system message)
-        for msg in st.session_state.messages[1:]:
-            if msg["role"] == "user":
-                st.chat_message("user").markdown(msg["content"])
-            elif msg["role"] == "assistant":
-                st.chat_message("assistant").markdown(msg["content"])
-
-        user_input = st.chat_input("Ask your question… (e.g., 'Generate invoice for Anil ₹5000')")
+        ensure_history()
+
+        with st.expander("🗄️ Search & export full history"):
+            query = st.text_input("Search all past conversations", key="history_query")
+            if query:
+                hits = retention.search_history(st.session_state.logged_in_user.id, query)
+                if not hits:
+                    st.caption("No matches.")
+                for hit in hits:
+                    label = "archived · " if hit["archived"] else ""
+                    st.markdown(f"**{hit['role']}** · {label}{hit['timestamp']}")
+                    st.text(hit["content"][:500] + ("..." if len(hit["content"]) > 500 else ""))
+            fmt = st.selectbox("Export format", list(export.FORMATS), format_func=str.upper)
+            if st.button("Prepare export"):
+                user_id = st.session_state.logged_in_user.id
+                kind, mime, ext = export.resolve_format(fmt, user_id)
+                # Written to disk incrementally; only small files are handed to
+                # download_button, which keeps the whole file in memory.
+                with tempfile.TemporaryFile() as f:
+                    with st.spinner("Exporting…"):
+                        export.write_export(user_id, kind, f)
+                    size = f.tell()
+                    if size <= UI_EXPORT_LIMIT:
+                        f.seek(0)
+                        st.download_button(f"⬇️ Download history ({ext.upper()}, {size / 2**20:.1f} MB)",
+                                           data=f.read(), file_name=f"vyapargpt_history.{ext}", mime=mime)
+                    else:
+                        st.info(f"Your history is {size / 2**20:.0f} MB, too large to download here. "
+                                f"Use the API: `GET /v1/history/export?format={fmt}` streams it.")
+
+        if st.session_state.chat.more and st.button("⬆️ Load earlier messages"):
+            st.session_state.chat.show_earlier(HISTORY_WINDOW)
+
+        # Earlier turns are read from the DB for this render only; then the window in memory
+        for msg in st.session_state.chat.older():
+            if msg["role"] in ("user", "assistant"):
+                st.chat_message(msg["role"]).markdown(msg["content"])
+        for msg in st.session_state.chat:
+            if msg.role in ("user", "assistant"):
+                st.chat_message(msg.role).markdown(msg.content)
+
+        if st.session_state.chat_notice:
+            st.warning(st.session_state.chat_notice)
+            st.session_state.chat_notice = None
+
+        # One answer at a time; Stop ends the current one early
+        user_input = st.chat_input("Ask your question… (e.g., 'Generate invoice for Anil ₹5000')",
+                                   disabled=st.session_state.generation is not None)
         if user_input:
+            previous = generation.manager.get(st.session_state.generation)
+            if previous is not None:
+                # Sent while an answer was still streaming: end that one first so history stays in order
+                previous.stop()
+                previous.wait()
+                apply_finished_generation()
             # Save user message to DB and session
-            save_chat_message(st.session_state.logged_in_user[0], "user", user_input)
-            st.session_state.messages.append({"role": "user", "content": user_input})
+            save_chat_message(st.session_state.logged_in_user.id, "user", user_input)
+            st.session_state.chat.append("user", user_input)
             st.chat_message("user").markdown(user_input)
 
-            intent, data = detect_intent(user_input)
-            st.session_state.last_intent = intent
+            # Rules first. When they see no tool request but are unsure, a small
+            # model double-checks while the answer streams and can still redirect.
+            intent, data, sure = rule_intent(user_input)
+            if intent != "chat":
+                st.session_state.last_intent = intent
+                metrics.CHAT_REQUESTS.labels(intent=intent).inc()
+                redirect_to_tool(intent, data)
+
+            # For regular chat queries - stream the response in the background
+            response_container = st.empty()
+            # Static prompt and per-user context first, then the conversation (prompts.py)
+            with tracing.span("build_context"):
+                request = prompts.chat_messages(
+                    st.session_state.chat.messages(), first_name=st.session_state.logged_in_user.first_name)
+            try:
+                stream = routed_chat(
+                    request,
+                    user_input,
+                    user_id=st.session_state.logged_in_user.id,
+                    on_wait=lambda eta: response_container.info(queued_message(eta)),
+                    classify=not sure,
+                )
+            except RateLimited as e:
+                metrics.CHAT_REQUESTS.labels(intent="chat").inc()
+                response_container.warning(throttled_message(e))
+            else:
+                response_container.empty()
+                gen = generation.manager.start(
+                    st.session_state.session_id, st.session_state.logged_in_user.id, stream)
+                st.session_state.generation = gen.key
 
-            if intent == "invoice":
-                customer = data.get("customer", "") or st.session_state.invoice_customer
-                amount = data.get("amount", 0.0) or st.session_state.invoice_amount
-                
-                st.session_state.invoice_customer = customer
-                st.session_state.invoice_amount = amount
-                
-                if customer and amount:
-                    reply = f"Sure! Taking you to the Invoice Generator for {customer} with amount ₹{amount:,.2f}..."
-                elif customer:
-                    reply = f"Understood! Preparing invoice for {customer}. Please enter the amount."
-                elif amount:
-                    reply = f"Got it! Preparing invoice for ₹{amount:,.2f}. Please enter customer name."
-                else:
-                    reply = "Taking you to the Invoice Generator..."
-                
-                # Save assistant message to DB and session
-                save_chat_message(st.session_state.logged_in_user[0], "assistant", reply)
-                st.session_state.messages.append({"role": "assistant", "content": reply})
-                st.chat_message("assistant").markdown(reply)
-                
-                st.session_state.active_tab = "Invoice Generator"
-                st.rerun()
-
-            elif intent == "document":
-                reply = "Please upload your document in the Document Explainer section and I'll analyze it for you."
-                # Save assistant message to DB and session
-                save_chat_message(st.session_state.logged_in_user[0], "assistant", reply)
-                st.session_state.messages.append({"role": "assistant", "content": reply})
-                st.chat_message("assistant").markdown(reply)
-                st.session_state.active_tab = "Explain Document"
-                st.rerun()
-
-            # For regular chat queries - stream the response
-            with st.spinner("Thinking..."):
-                response_container = st.empty()
-                full_response = ""
-                
-                # Stream the response
-                for chunk in llm_chat(st.session_state.messages):
-                    if chunk.choices[0].delta.content:
-                        full_response += chunk.choices[0].delta.content
-                        response_container.markdown(full_response + "▌")
-                
-                # Save the complete response
-                save_chat_message(st.session_state.logged_in_user[0], "assistant", full_response)
-                st.session_state.messages.append({"role": "assistant", "content": full_response})
-                response_container.markdown(full_response)
+        render_generation()
 
     # =========================
     # INVOICE GENERATOR
@@ -710,18 +660,17 @@ if st.session_state.logged_in_user:
         customer = st.text_input("Customer Name", value=st.session_state.get("invoice_customer", ""))
         amount = st.number_input("Amount (₹)", min_value=0.0, value=float(st.session_state.get("invoice_amount", 0.0)))
         if st.button("Generate Invoice"):
-            try:
-                pdf_buffer = generate_invoice_pdf(customer, amount)
-                st.success(f"✅ Invoice ready for {customer} — ₹{amount:,.2f}")
-                st.download_button(
-                    "⬇️ Download Invoice PDF",
-                    data=pdf_buffer,
-                    file_name=f"invoice_{customer or 'customer'}.pdf",
-                    mime="application/pdf",
-                )
-            except Exception as e:
-                st.error(f"Could not generate PDF. {e}")
-                st.caption("Tip: Install ReportLab → `pip install reportlab`")
+            submit_job("invoice", {
+                "customer": customer, "amount": amount, "file_name": f"invoice_{customer or 'customer'}.pdf",
+            })
+
+        job = render_job("invoice")
+        if job is not None and job.status == "done":
+            st.success(f"✅ Invoice ready for {job.params['customer']} — ₹{job.params['amount']:,.2f}")
+            pdf_job_download(job, "⬇️ Download Invoice PDF")
+        elif job is not None and job.status == "failed":
+            st.error(f"Could not generate PDF. {job.error}")
+            st.caption("Tip: Install ReportLab → `pip install reportlab`")
 
     # =========================
     # DOCUMENT EXPLAINER
@@ -731,44 +680,52 @@ if st.session_state.logged_in_user:
 
         uploaded_file = st.file_uploader("Upload PDF", type=["pdf"])
         if uploaded_file is not None:
+            # Parsed lazily: the page count and first page now, the chosen pages by the worker.
+            # The uploader's buffer is hashed and parsed in place, not copied (uploads.py).
+            upload = st.session_state.explain_upload
             try:
-                text = read_pdf_text(uploaded_file, max_chars=8000)
-                st.success("✅ File uploaded & parsed.")
-                with st.expander("Preview extracted text (first 1,500 chars)"):
-                    st.text(text[:1500] + ("..." if len(text) > 1500 else ""))
-
-                summary_prompt = (
-                    "You are an MSME compliance assistant. Explain this document in simple language, "
-                    "list key points, deadlines, and required actions.\n\n"
-                    f"Document text:\n{text}"
-                )
-                msgs = st.session_state.messages + [{"role": "user", "content": summary_prompt}]
-                
-                # Stream the document explanation
-                response_container = st.empty()
-                full_response = ""
-                
-                for chunk in llm_chat(msgs):
-                    if chunk.choices[0].delta.content:
-                        full_response += chunk.choices[0].delta.content
-                        response_container.markdown(full_response + "▌")
-                
-                st.subheader("🧠 AI Explanation")
-                response_container.markdown(full_response)
-                
-                # Save to chat history
-                save_chat_message(st.session_state.logged_in_user[0], "user", summary_prompt)
-                save_chat_message(st.session_state.logged_in_user[0], "assistant", full_response)
-                st.session_state.messages.extend([
-                    {"role": "user", "content": summary_prompt},
-                    {"role": "assistant", "content": full_response}
-                ])
-
+                if upload is None or upload[0] != uploaded_file.file_id:
+                    upload = (uploaded_file.file_id, documents.PdfDocument(uploads.from_file(uploaded_file)))
+                    st.session_state.explain_upload = upload
+                doc = upload[1]
+                page_count = doc.page_count
+                first_page = doc.page_text(1) if page_count else ""
+            except uploads.UploadTooLarge as e:
+                st.error(f"This PDF is too large: {e}. Try uploading only the pages you need.")
             except Exception as e:
-                st.error(f"Could not read or analyze the PDF. {e}")
+                st.error(f"Could not read the PDF. {e}")
                 st.caption("Tip: Install PyPDF2 → `pip install PyPDF2`")
-        else:
+            else:
+                st.caption(f"{uploaded_file.name} · {page_count} page{'s' if page_count != 1 else ''}")
+                with st.expander("Preview page 1"):
+                    st.text(first_page[:1500] + ("..." if len(first_page) > 1500 else ""))
+                pages = (1, page_count)
+                if page_count > 1:
+                    pages = st.slider("Pages to explain", 1, page_count, (1, page_count))
+                    st.caption("Only the selected pages are read and sent, up to about 8,000 characters.")
+                if st.button("🧠 Explain", disabled=page_count == 0):
+                    ensure_history()
+                    # The worker reads the conversation from chat_history (chatstore.recent_messages)
+                    job_id = submit_job("explain", {"max_chars": 8000, "pages": f"{pages[0]}-{pages[1]}"},
+                                        doc.upload)
+                    st.session_state.explain_pending.add(job_id)
+
+        def show_partial_explanation(job):
+            st.markdown(json.loads(job.result)["answer"] + "▌")
+
+        job = render_job("explain", show_partial_explanation)
+        if job is None:
             st.info("Drop a PDF above to get started.")
+        elif job.status == "done":
+            out = job.result_json()
+            st.success("✅ File uploaded & parsed.")
+            with st.expander("Preview extracted text (first 1,500 chars)"):
+                st.text(out["preview"] + ("..." if len(out["preview"]) >= 1500 else ""))
+            st.subheader("🧠 AI Explanation")
+            st.markdown(out["answer"])
+        elif job.status == "failed":
+            st.error(f"Could not read or analyze the PDF. {job.error}")
+            st.caption("Tip: Install PyPDF2 → `pip install PyPDF2`")
 
     # =========================
     # LEGAL DOC GENERATOR
@@ -779,18 +736,86 @@ if st.session_state.logged_in_user:
         doc_type = st.selectbox("Choose Document Type", ["Offer Letter", "NDA", "Leave Policy"])
         name = st.text_input("Employee/Party Name")
         if st.button("Generate Document PDF"):
-            try:
-                pdf_buffer = generate_legal_doc_pdf(doc_type, name)
-                st.success(f"✅ {doc_type} generated for {name or '—'}")
-                st.download_button(
-                    "⬇️ Download PDF",
-                    data=pdf_buffer,
-                    file_name=f"{doc_type.replace(' ', '_').lower()}_{name or 'document'}.pdf",
-                    mime="application/pdf",
-                )
-            except Exception as e:
-                st.error(f"Could not generate PDF. {e}")
-                st.caption("Tip: Install ReportLab → `pip install reportlab`")
+            submit_job("legal", {
+                "doc_type": doc_type, "name": name,
+                "file_name": f"{doc_type.replace(' ', '_').lower()}_{name or 'document'}.pdf",
+            })
+
+        job = render_job("legal")
+        if job is not None and job.status == "done":
+            st.success(f"✅ {job.params['doc_type']} generated for {job.params['name'] or '—'}")
+            pdf_job_download(job, "⬇️ Download PDF")
+        elif job is not None and job.status == "failed":
+            st.error(f"Could not generate PDF. {job.error}")
+            st.caption("Tip: Install ReportLab → `pip install reportlab`")
+
+    # =========================
+    # USAGE ADMIN
+    # =========================
+    elif option == "Usage Admin":
+        st.header("📈 LLM Usage")
+
+        days = st.selectbox("Period", [1, 7, 30], index=1, format_func=lambda d: f"Last {d} day(s)")
+        # Usage rows are written in the background; pick up anything still queued.
+        usage.recorder.flush()
+
+        totals = usage.daily_totals(days)
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Requests", f"{sum(t['requests'] for t in totals):,}")
+        col2.metric("Prompt tokens", f"{sum(t['prompt_tokens'] for t in totals):,}")
+        col3.metric("Completion tokens", f"{sum(t['completion_tokens'] for t in totals):,}")
+
+        st.subheader("Top consumers")
+        top = usage.top_consumers(days)
+        if top:
+            st.table(top)
+        else:
+            st.info("No LLM usage recorded in this period.")
+
+        if totals:
+            st.subheader("Daily totals")
+            st.table(totals)
+
+# =========================
+# DEBUG PANEL
+# =========================
+def render_debug_panel():
+    st.sidebar.markdown("---")
+    st.sidebar.checkbox("🐞 Debug timings", key="debug")
+    if not st.session_state.debug:
+        return
+
+    tracer = st.session_state.tracer
+    run = tracer.last_with_spans()
+    with st.sidebar.expander("⏱️ Stage timings", expanded=True):
+        st.caption(f"Last intent: {st.session_state.last_intent}")
+        if run is None:
+            st.caption("No timings yet. Use the app to record some.")
+            return
+
+        # Waterfall of the most recent rerun that did any work
+        total = max(run.duration, 1e-6)
+        rows = []
+        for s in run.spans:
+            left = (s.start - run.started) / total * 100
+            width = max(s.duration / total * 100, 0.5)
+            extra = " ".join(f"{k}={v}" for k, v in s.attrs.items() if v is not None)
+            rows.append(
+                f'<div class="wf-row"><span style="padding-left:{s.depth * 8}px">{s.name}</span> '
+                f'<span class="wf-ms">{s.duration * 1000:.1f} ms {extra}</span>'
+                f'<div class="wf-track"><div class="wf-bar" style="margin-left:{left:.1f}%;width:{width:.1f}%"></div></div></div>'
+            )
+        st.markdown("".join(rows), unsafe_allow_html=True)
+        st.caption(f"Rerun total: {run.duration * 1000:.1f} ms")
+
+        st.caption("Session totals")
+        st.table([
+            {"stage": name, "calls": count, "total ms": round(total_s * 1000, 1),
+             "mean ms": round(total_s / count * 1000, 1), "max ms": round(max_s * 1000, 1)}
+            for name, (count, total_s, max_s) in sorted(tracer.totals.items(), key=lambda kv: -kv[1][1])
+        ])
+
+render_debug_panel()
 
 # Handle password reset token from URL
 # if not st.session_state.get("reset_token") and "token" in st.experimental_get_query_params():
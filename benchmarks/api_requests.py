@@ -0,0 +1,104 @@
+"""Check how the API (api.py) answers malformed and oversized request heads.
+
+Starts the headless API in-process against a temporary users.db and sends
+raw requests over a socket:
+
+    content_length_not_a_number   Content-Length: abc            -> 400
+    content_length_negative       Content-Length: -5 (+ body)    -> 400, without reading to EOF
+    content_length_too_large      over api.MAX_BODY              -> 413
+    chunked_body                  Transfer-Encoding: chunked     -> 411
+    well_formed                   a login with a JSON body       -> 201
+
+Each reply must arrive within --timeout seconds. Prints each mismatch and
+exits 1 if there is any, so it can gate a build.
+
+    python -m benchmarks.api_requests
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+
+import api
+import db
+from api import ApiServer, VyaparAPI
+
+
+def raw_request(headers, body=b""):
+    head = ["POST /v1/auth/token HTTP/1.1", "Host: localhost", "Content-Type: application/json"] + headers
+    return ("\r\n".join(head) + "\r\n\r\n").encode() + body
+
+
+async def send(host, port, data, timeout):
+    """Write `data` without closing our side; (status, JSON body) of the reply."""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(data)
+        await writer.drain()
+        status = int((await asyncio.wait_for(reader.readline(), timeout)).split()[1])
+        length = 0
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout)
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode().partition(":")
+            if name.strip().lower() == "content-length":
+                length = int(value)
+        body = await asyncio.wait_for(reader.readexactly(length), timeout)
+        return status, json.loads(body or b"{}")
+    finally:
+        writer.close()
+
+
+def cases():
+    login = json.dumps({"username": "checker", "password": "pw"}).encode()
+    return [
+        ("content_length_not_a_number", raw_request(["Content-Length: abc"], login), 400, "bad content-length"),
+        ("content_length_negative", raw_request(["Content-Length: -5"], login), 400, "bad content-length"),
+        ("content_length_too_large", raw_request([f"Content-Length: {api.MAX_BODY + 1}"]), 413, None),
+        ("chunked_body", raw_request(["Transfer-Encoding: chunked"]), 411, None),
+        ("well_formed", raw_request([f"Content-Length: {len(login)}"], login), 201, None),
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="API request parsing checks")
+    parser.add_argument("--timeout", type=float, default=5.0, help="seconds to wait for each reply")
+    args = parser.parse_args(argv)
+
+    tmpdir = tempfile.TemporaryDirectory(prefix="vyapar-api-requests-")
+    db.DB_PATH = os.path.join(tmpdir.name, "users.db")
+    db.init_db()
+    db.register_user("checker", "pw", "Check", "Er")
+    server = ApiServer(VyaparAPI(pdf_workers=0), port=0).start_in_thread()
+
+    async def run():
+        errors = []
+        for name, data, status, error in cases():
+            try:
+                got, body = await send(server.host, server.port, data, args.timeout)
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError, IndexError) as e:
+                errors.append(f"{name}: no reply ({type(e).__name__}: {e})")
+                continue
+            if got != status or (error is not None and body.get("error") != error):
+                errors.append(f"{name}: expected {status} {error or ''}, got {got} {body}")
+        return errors
+
+    try:
+        errors = asyncio.run(run())
+    finally:
+        server.stop()
+        tmpdir.cleanup()
+    for error in errors:
+        print(error)
+    if errors:
+        print(f"FAIL: {len(errors)} of {len(cases())} request checks")
+        return 1
+    print(f"ok: {len(cases())} request checks")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,176 @@
+"""Concurrent SSE chat streams per API process.
+
+Starts the headless API (api.py) and the mock LLM in-process against a
+temporary users.db, then opens N simultaneous /v1/chat streams for each
+concurrency level and reports TTFT, stream duration and stream throughput.
+
+    python -m benchmarks.api_streams --levels 10 50 100 200 --out api_streams.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+from openai import OpenAI
+
+import db
+import llm
+import ratelimit
+import usage
+from api import ApiServer, VyaparAPI
+from benchmarks.loadtest import current_rss_mb, git_commit, percentile
+from mock_llm_server import MockConfig, MockLLMServer
+
+
+async def http_request(host, port, method, path, body=None, token=None):
+    reader, writer = await asyncio.open_connection(host, port)
+    payload = json.dumps(body or {}).encode()
+    headers = [
+        f"{method} {path} HTTP/1.1",
+        f"Host: {host}",
+        "Content-Type: application/json",
+        f"Content-Length: {len(payload)}",
+        "Connection: close",
+    ]
+    if token:
+        headers.append(f"Authorization: Bearer {token}")
+    writer.write(("\r\n".join(headers) + "\r\n\r\n").encode() + payload)
+    await writer.drain()
+    return reader, writer
+
+
+async def read_head(reader):
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            return status, headers
+        name, _, value = line.decode().partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+
+async def one_stream(host, port, token, question):
+    start = time.perf_counter()
+    reader, writer = await http_request(host, port, "POST", "/v1/chat", {"message": question}, token)
+    try:
+        status, headers = await read_head(reader)
+        if status != 200 or not headers.get("content-type", "").startswith("text/event-stream"):
+            return {"ok": False, "status": status}
+        ttft = None
+        events = 0
+        buffer = b""
+        while True:
+            size = int((await reader.readline()).strip(), 16)
+            if size == 0:
+                break
+            buffer += await reader.readexactly(size)
+            await reader.readexactly(2)
+            while b"\n\n" in buffer:
+                raw, buffer = buffer.split(b"\n\n", 1)
+                event = raw.split(b"\n", 1)[0].removeprefix(b"event: ")
+                if event == b"delta" and ttft is None:
+                    ttft = time.perf_counter() - start
+                if event == b"error":
+                    return {"ok": False, "status": 200}
+                events += 1
+        return {"ok": True, "ttft": ttft, "total": time.perf_counter() - start, "events": events}
+    finally:
+        writer.close()
+
+
+async def run_level(host, port, tokens, concurrency):
+    start = time.perf_counter()
+    results = await asyncio.gather(*[
+        one_stream(host, port, tokens[i % len(tokens)], f"Who can opt for the GST composition scheme? ref {concurrency}-{i}")
+        for i in range(concurrency)
+    ])
+    wall = time.perf_counter() - start
+    ok = [r for r in results if r["ok"]]
+    ttfts = sorted(r["ttft"] for r in ok if r["ttft"] is not None)
+    totals = sorted(r["total"] for r in ok)
+    ms = lambda v: round(v * 1000, 1) if v is not None else None
+    return {
+        "concurrency": concurrency,
+        "ok": len(ok),
+        "failed": len(results) - len(ok),
+        "wall_s": round(wall, 3),
+        "streams_per_s": round(len(ok) / wall, 2),
+        "ttft_p50_ms": ms(percentile(ttfts, 50)),
+        "ttft_p95_ms": ms(percentile(ttfts, 95)),
+        "total_p50_ms": ms(percentile(totals, 50)),
+        "total_p95_ms": ms(percentile(totals, 95)),
+        "rss_mb": round(current_rss_mb(), 1),
+    }
+
+
+async def create_tokens(host, port, users):
+    tokens = []
+    for i in range(users):
+        db.register_user(f"api_bench_{i}", "bench-pass", "Bench", str(i))
+        reader, writer = await http_request(
+            host, port, "POST", "/v1/auth/token", {"username": f"api_bench_{i}", "password": "bench-pass"})
+        status, headers = await read_head(reader)
+        body = await reader.readexactly(int(headers["content-length"]))
+        writer.close()
+        if status != 201:
+            raise RuntimeError(f"token request failed: {status} {body!r}")
+        tokens.append(json.loads(body)["token"])
+    return tokens
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent API chat streams per process")
+    parser.add_argument("--levels", type=int, nargs="+", default=[10, 50, 100, 200])
+    parser.add_argument("--users", type=int, default=20, help="distinct API users (tokens)")
+    parser.add_argument("--ttft", type=float, default=0.2)
+    parser.add_argument("--inter-token-delay", type=float, default=0.01)
+    parser.add_argument("--completion-tokens", type=int, default=100)
+    parser.add_argument("--out", default="api_streams.json")
+    args = parser.parse_args(argv)
+
+    tmpdir = tempfile.TemporaryDirectory(prefix="vyapar-api-bench-")
+    db.DB_PATH = os.path.join(tmpdir.name, "users.db")
+    db.init_db()
+    ratelimit.controller = ratelimit.AdmissionController(default_tier="unlimited", global_tpm=0, persist=False)
+
+    mock = MockLLMServer(MockConfig(
+        ttft=args.ttft, inter_token_delay=args.inter_token_delay, completion_tokens=args.completion_tokens,
+    )).start()
+    llm.client = OpenAI(api_key="mock", base_url=mock.base_url)
+    server = ApiServer(VyaparAPI(pdf_workers=0), port=0).start_in_thread()
+
+    async def run():
+        tokens = await create_tokens(server.host, server.port, args.users)
+        levels = []
+        for level in args.levels:
+            result = await run_level(server.host, server.port, tokens, level)
+            levels.append(result)
+            print(f"{level:>5} streams: ok={result['ok']:<5} fail={result['failed']:<4} "
+                  f"{result['streams_per_s']:>7} streams/s  ttft p95={result['ttft_p95_ms']} ms  "
+                  f"total p95={result['total_p95_ms']} ms  rss={result['rss_mb']} MB")
+        return levels
+
+    try:
+        levels = asyncio.run(run())
+    finally:
+        server.stop()
+        mock.stop()
+        usage.recorder.flush()
+        tmpdir.cleanup()
+
+    report = {
+        "meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "git_commit": git_commit(), "args": vars(args)},
+        "levels": levels,
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"report written to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+"""DB size with and without the chat_history blob store.
+
+Replays the same synthetic workload into two fresh databases: one with the
+blob store disabled (every message inline) and one with the configured
+threshold. Users repeatedly explain documents drawn from a shared pool (the
+same GST notice arrives for many MSMEs), with ordinary chat turns in between.
+
+    python -m benchmarks.blob_store --users 200 --docs 30 --explains 8 --out blob_store.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import db
+import documents
+from benchmarks.loadtest import git_commit, percentile
+
+WORDS = (
+    "gst notice section assessee return filing tax invoice credit input period demand interest penalty "
+    "reply days order officer jurisdiction registration mismatch gstr reconciliation amount payable "
+    "proceedings hearing compliance authority rule refund turnover supplier recipient ledger"
+).split()
+
+
+def synthetic_document(rng, chars=8000):
+    words = []
+    size = 0
+    while size < chars:
+        word = rng.choice(WORDS)
+        if rng.random() < 0.08:
+            word = f"{rng.randint(1, 99999):05d}"
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words)[:chars]
+
+
+def synthetic_answer(rng, chars=1500):
+    return synthetic_document(rng, chars)
+
+
+def run_workload(path, threshold, args):
+    db.DB_PATH = path
+    db.BLOB_THRESHOLD = threshold
+    db.init_db()
+    rng = random.Random(args.seed)
+    docs = [synthetic_document(rng) for _ in range(args.docs)]
+    # Skewed popularity: a few notices reach most users
+    weights = [1 / (i + 1) for i in range(args.docs)]
+    start = time.perf_counter()
+    for u in range(args.users):
+        db.register_user(f"blob_user_{u}", "pw", "Blob", str(u))
+        user_id = u + 1
+        for _ in range(args.explains):
+            doc = rng.choices(docs, weights)[0]
+            db.save_chat_message(user_id, "user", documents.document_summary_prompt(doc))
+            db.save_chat_message(user_id, "assistant", synthetic_answer(rng))
+            for _ in range(args.chats):
+                db.save_chat_message(user_id, "user", f"What is the due date for GSTR-{rng.randint(1, 9)}?")
+                db.save_chat_message(user_id, "assistant", synthetic_answer(rng, rng.randint(200, 900)))
+    write_s = time.perf_counter() - start
+
+    load_ms = []
+    for u in rng.sample(range(args.users), min(50, args.users)):
+        t = time.perf_counter()
+        db.load_chat_history(u + 1)
+        load_ms.append((time.perf_counter() - t) * 1000)
+    load_ms.sort()
+
+    conn = db.get_connection()
+    conn.execute("VACUUM")
+    conn.close()
+    return {
+        "threshold": threshold,
+        "db_bytes": os.path.getsize(path),
+        "write_s": round(write_s, 2),
+        "load_history_p50_ms": round(percentile(load_ms, 50), 2),
+        "load_history_p95_ms": round(percentile(load_ms, 95), 2),
+        **db.blob_stats(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="chat_history blob store size benchmark")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--docs", type=int, default=30, help="distinct documents in the shared pool")
+    parser.add_argument("--explains", type=int, default=8, help="Explain Document runs per user")
+    parser.add_argument("--chats", type=int, default=3, help="chat turns after each explain")
+    parser.add_argument("--threshold", type=int, default=db.BLOB_THRESHOLD)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--out", default="blob_store.json")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="vyapar-blob-bench-") as tmp:
+        inline = run_workload(os.path.join(tmp, "inline.db"), 10**12, args)
+        blobs = run_workload(os.path.join(tmp, "blobs.db"), args.threshold, args)
+
+    reduction = 1 - blobs["db_bytes"] / inline["db_bytes"]
+    for name, r in (("inline", inline), ("blob store", blobs)):
+        print(f"{name:>10}: {r['db_bytes'] / 2**20:8.2f} MB  write {r['write_s']:6.2f}s  "
+              f"load_chat_history p50 {r['load_history_p50_ms']} ms p95 {r['load_history_p95_ms']} ms  "
+              f"blobs={r['blobs']} refs={r['references']}")
+    print(f"size reduction: {reduction:.1%}")
+
+    report = {
+        "meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "git_commit": git_commit(), "args": vars(args)},
+        "inline": inline,
+        "blob_store": blobs,
+        "size_reduction": round(reduction, 4),
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"report written to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,266 @@
+"""Hit ratios and latency of the two-level caches (cache.py) across worker processes.
+
+Starts --workers child processes at once, the way several Streamlit / API
+workers share a host, and has each serve the same skewed request mix:
+
+    pdf   read_pdf_text on --documents generated multi-page PDFs
+    llm   llm_chat(cache=True) on --questions distinct single-turn FAQ prompts
+          (no user context), against an embedded mock_llm_server (upstream
+          calls are counted by the mock)
+
+Each workload runs in three modes, each on a fresh cache file:
+
+    off      caching disabled (TTL 0)
+    memory   per-process memory tier only (VYAPAR_CACHE_PATH empty)
+    tiered   memory, then the shared disk tier
+
+and reports upstream work (extractions, LLM streams), hit ratios per tier
+and per-request latency. A few disk tier checks (size limit, LRU order,
+expiry, the trigger-maintained size total) run first.
+
+    python -m benchmarks.cache_tiers --workers 4 --requests 200 --out cache_tiers.json
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import cache
+from benchmarks.loadtest import git_commit, percentile
+
+TOPICS = ["GSTR-1", "GSTR-3B", "GSTR-9", "TDS return", "advance tax", "Udyam registration",
+          "e-invoice", "e-way bill", "PF challan", "ESI challan", "ITC reconciliation", "composition scheme"]
+ASPECTS = ["due date", "late fee", "documents needed", "penalty for missing", "how to file"]
+
+
+def questions(n):
+    return [f"What is the {ASPECTS[i % len(ASPECTS)]} for {TOPICS[i // len(ASPECTS) % len(TOPICS)]}? (variant {i})"
+            for i in range(n)]
+
+
+def skewed_picks(rng, n_items, count):
+    # Zipf-like: a few notices and questions account for most traffic
+    weights = [1.0 / (i + 1) for i in range(n_items)]
+    return rng.choices(range(n_items), weights=weights, k=count)
+
+
+def make_pdfs(directory, count, pages, rng):
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+
+    words = "notice gstin demand interest penalty section reply hearing officer invoice credit".split()
+    paths = []
+    for n in range(count):
+        path = os.path.join(directory, f"notice_{n}.pdf")
+        pdf = canvas.Canvas(path, pagesize=A4)
+        for page in range(pages):
+            pdf.setFont("Helvetica", 9)
+            for line in range(60):
+                pdf.drawString(40, 800 - line * 12, f"{n}.{page}.{line} " + " ".join(rng.choices(words, k=14)))
+            pdf.showPage()
+        pdf.save()
+        paths.append(path)
+    return paths
+
+
+# =========================
+# DISK TIER CHECKS
+# =========================
+def disk_checks(directory):
+    results = []
+
+    def check(name, ok, detail=""):
+        results.append({"check": name, "ok": bool(ok), "detail": detail})
+
+    disk = cache.DiskCache(os.path.join(directory, "checks.db"), max_bytes=256 * 1024)
+    resolution, cache.ACCESS_RESOLUTION = cache.ACCESS_RESOLUTION, 0.0
+    try:
+        disk.put("t", "keep", b"k" * 4096, ttl=60)
+        for i in range(200):
+            disk.put("t", f"k{i}", bytes([i % 251]) * 4096, ttl=60)
+            time.sleep(0.001)
+            disk.get("t", "keep")  # most recently used throughout
+        stats = disk.stats()
+        with disk.pool.connection() as conn:
+            actual = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache_entries").fetchone()[0]
+        check("size_limit", stats["total_bytes"] <= disk.max_bytes, f"{stats['total_bytes']} <= {disk.max_bytes}")
+        check("size_total_matches", stats["total_bytes"] == actual, f"meta {stats['total_bytes']} vs rows {actual}")
+        check("lru_keeps_recent", disk.get("t", "keep") is not None and disk.get("t", "k199") is not None)
+        check("lru_evicts_oldest", disk.get("t", "k0") is None)
+        disk.put("t", "k199", b"x" * 10, ttl=60)
+        check("overwrite", disk.get("t", "k199") == b"x" * 10)
+        disk.put("t", "short", b"s", ttl=0.05)
+        time.sleep(0.1)
+        check("expiry", disk.get("t", "short") is None)
+        disk.put("t", "huge", b"h" * disk.max_bytes, ttl=60)
+        check("oversize_rejected", disk.get("t", "huge") is None)
+    finally:
+        cache.ACCESS_RESOLUTION = resolution
+        disk.close()
+    return results
+
+
+# =========================
+# WORKER PROCESS
+# =========================
+def child(args):
+    """One worker process; cache configuration comes from the environment."""
+    import db
+    import documents
+    import llm
+    from metrics import PDF_EXTRACT_SECONDS
+
+    db.DB_PATH = args.db
+    rng = random.Random(args.seed)
+    latencies = []
+    if args.workload == "pdf":
+        with open(args.docs) as f:
+            files = [open(path, "rb").read() for path in json.load(f)]
+        from io import BytesIO
+        for i in skewed_picks(rng, len(files), args.requests):
+            start = time.perf_counter()
+            documents.read_pdf_text(BytesIO(files[i]), max_chars=8000)
+            latencies.append(time.perf_counter() - start)
+        stats = cache.pdf_text.stats()
+        work = PDF_EXTRACT_SECONDS._default().count
+    else:
+        prompts = questions(args.questions)
+        for i in skewed_picks(rng, len(prompts), args.requests):
+            start = time.perf_counter()
+            stream = llm.llm_chat([{"role": "user", "content": prompts[i]}], max_tokens=64, cache=True)
+            for _ in stream:
+                pass
+            latencies.append(time.perf_counter() - start)
+        stats = cache.llm_answers.stats()
+        work = None  # counted by the mock server
+    latencies.sort()
+    print(json.dumps({
+        "requests": len(latencies),
+        "work": work,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2),
+        "stats": stats,
+    }))
+
+
+def run_mode(args, tmp, workload, mode, docs_file, base_url):
+    env = dict(os.environ,
+               VYAPAR_CACHE_PATH="" if mode == "memory" else os.path.join(tmp, f"cache_{workload}_{mode}.db"),
+               VYAPAR_PDF_CACHE_TTL="0" if mode == "off" else "3600",
+               VYAPAR_LLM_CACHE_TTL="0" if mode == "off" else "3600",
+               VYAPAR_GLOBAL_TPM="0",
+               VYAPAR_LLM_BASE_URL=base_url or "http://127.0.0.1:9/v1",
+               VYAPAR_METRICS_PORT="", VYAPAR_METRICS_FILE="")
+    start = time.perf_counter()
+    procs = [subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.cache_tiers", "--child", "--workload", workload,
+         "--db", os.path.join(tmp, "users.db"), "--docs", docs_file,
+         "--requests", str(args.requests), "--questions", str(args.questions), "--seed", str(args.seed + w)],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, env=env) for w in range(args.workers)]
+    workers = []
+    cache_errors = 0
+    for proc in procs:
+        out, err = proc.communicate()
+        if proc.returncode:
+            raise RuntimeError(f"{workload}/{mode} worker failed:\n{err}")
+        lines = out.strip().splitlines()
+        cache_errors += sum(1 for line in lines if line.startswith("cache:"))
+        workers.append(json.loads(lines[-1]))
+    wall = time.perf_counter() - start
+
+    def total(tier, key):
+        return sum(w["stats"][tier][key] for w in workers)
+
+    requests = sum(w["requests"] for w in workers)
+    memory_hits, disk_hits, disk_misses = total("memory", "hits"), total("disk", "hits"), total("disk", "misses")
+    return {
+        "workload": workload,
+        "mode": mode,
+        "workers": args.workers,
+        "requests": requests,
+        "work": sum(w["work"] for w in workers) if workload == "pdf" else None,
+        "memory_hit_ratio": round(memory_hits / requests, 4),
+        # Of the lookups that reached the disk tier
+        "disk_hit_ratio": round(disk_hits / (disk_hits + disk_misses), 4) if disk_hits + disk_misses else None,
+        "overall_hit_ratio": round((memory_hits + disk_hits) / requests, 4),
+        "p50_ms": round(sum(w["p50_ms"] for w in workers) / len(workers), 2),
+        "p95_ms": max(w["p95_ms"] for w in workers),
+        "mean_ms": round(sum(w["mean_ms"] * w["requests"] for w in workers) / requests, 2),
+        "wall_seconds": round(wall, 2),
+        "cache_errors": cache_errors,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Two-level cache hit ratios across processes")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=200, help="requests per worker and workload")
+    parser.add_argument("--documents", type=int, default=30)
+    parser.add_argument("--pages", type=int, default=8)
+    parser.add_argument("--questions", type=int, default=60)
+    parser.add_argument("--ttft", type=float, default=0.05, help="mock LLM time to first token")
+    parser.add_argument("--workloads", default="pdf,llm")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--out", default="cache_tiers.json")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--workload", help=argparse.SUPPRESS)
+    parser.add_argument("--db", help=argparse.SUPPRESS)
+    parser.add_argument("--docs", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        child(args)
+        return 0
+
+    import db
+    from mock_llm_server import MockConfig, MockLLMServer
+
+    rng = random.Random(args.seed)
+    results = []
+    with tempfile.TemporaryDirectory(prefix="vyapar-cache-bench-") as tmp:
+        checks = disk_checks(tmp)
+        for c in checks:
+            print(f"{'ok  ' if c['ok'] else 'FAIL'} {c['check']} {c['detail']}")
+
+        db.DB_PATH = os.path.join(tmp, "users.db")
+        db.init_db()
+        docs_file = os.path.join(tmp, "docs.json")
+        with open(docs_file, "w") as f:
+            json.dump(make_pdfs(tmp, args.documents, args.pages, rng), f)
+
+        for workload in args.workloads.split(","):
+            for mode in ("off", "memory", "tiered"):
+                server = None
+                if workload == "llm":
+                    server = MockLLMServer(MockConfig(ttft=args.ttft, inter_token_delay=0.002,
+                                                      completion_tokens=64)).start()
+                try:
+                    result = run_mode(args, tmp, workload, mode, docs_file, server.base_url if server else None)
+                    if server is not None:
+                        result["work"] = server.snapshot_stats().get("streams", 0)
+                finally:
+                    if server is not None:
+                        server.stop()
+                results.append(result)
+                print(f"{workload:>4} {mode:>7}: upstream {result['work']:>5}/{result['requests']}  "
+                      f"hit memory {result['memory_hit_ratio']:.2f} disk {result['disk_hit_ratio'] or 0:.2f} "
+                      f"overall {result['overall_hit_ratio']:.2f}  p50 {result['p50_ms']}ms "
+                      f"p95 {result['p95_ms']}ms  mean {result['mean_ms']}ms")
+
+    report = {
+        "meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "git_commit": git_commit(), "args": vars(args)},
+        "checks": checks,
+        "results": results,
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"report written to {args.out}")
+    return 0 if all(c["ok"] for c in checks) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,197 @@
+"""Token reduction from document text preprocessing (doctext.py) on a generated corpus.
+
+Renders --docs government-style notices (GST show cause notices, income tax
+intimations, EPF demand letters) of 2 to --max-pages pages as PDFs, with
+what makes real ones noisy: a letterhead and notice number on every page,
+"Page i of n" footers, a "system generated" disclaimer, tax tables drawn
+with dashed rules and padded columns, and dot-leader form fields. Each is
+extracted with PdfDocument.text, raw and prepared, and compared on:
+
+    whole document   characters and estimated tokens of every page
+    8,000-char budget  share of the notice's own paragraphs that reach the
+                     prompt, and share of the planted facts (GSTIN, dates,
+                     amounts, sections) found in it
+
+Tokens are estimated two ways: characters / 4 (ratelimit.estimate_tokens)
+and word pieces (runs of letters/digits and single punctuation marks),
+which, like a BPE tokenizer, do not charge for runs of spaces.
+
+    python -m benchmarks.doc_preprocess --docs 30 --out doc_preprocess.json
+"""
+import argparse
+import json
+import random
+import re
+import sys
+import tempfile
+import time
+
+import cache
+import doctext
+import documents
+from benchmarks.loadtest import git_commit
+
+WORDS = ("the taxpayer has not paid tax on outward supplies declared in the return and the input tax credit "
+         "availed appears excess when compared with the auto populated statement you are required to explain "
+         "the difference with documents within the time allowed failing which the demand will be confirmed").split()
+OFFICES = ["OFFICE OF THE ASSISTANT COMMISSIONER OF STATE TAX, WARD 14, MUMBAI",
+           "INCOME TAX DEPARTMENT - CENTRALIZED PROCESSING CENTRE, BENGALURU",
+           "EMPLOYEES' PROVIDENT FUND ORGANISATION, REGIONAL OFFICE, PUNE"]
+MONTHS = ["January", "February", "March", "April", "May", "June", "July", "August", "September", "October",
+          "November", "December"]
+
+
+def make_facts(rng):
+    letters = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    gstin = (f"{rng.randint(1, 37):02d}" + "".join(rng.choices(letters, k=5)) + f"{rng.randint(0, 9999):04d}"
+             + rng.choice(letters) + str(rng.randint(1, 9)) + "Z" + rng.choice(letters))
+    issued = f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/2024"
+    due = f"{rng.randint(1, 28)} {rng.choice(MONTHS)} 2025"
+    amounts = [f"{rng.randint(1, 99)},{rng.randint(10, 99)},{rng.randint(100, 999)}" for _ in range(3)]
+    sections = [f"Section {rng.choice([73, 74, 122, 125, 50])}({rng.randint(1, 5)})",
+                f"Rule {rng.choice([142, 86, 36])}({rng.randint(1, 4)})"]
+    return {"gstin": gstin, "issued": issued, "due": due, "amounts": amounts, "sections": sections}
+
+
+def make_notice(path, pages, facts, rng):
+    """Render a notice; returns the text of its own paragraphs (the content that should reach the LLM)."""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+
+    office = rng.choice(OFFICES)
+    number = f"ZD{rng.randint(10**11, 10**12 - 1)}"
+    paragraphs = []
+    pdf = canvas.Canvas(path, pagesize=A4)
+    for page in range(1, pages + 1):
+        y = 810
+
+        def line(text, size=9, gap=12):
+            nonlocal y
+            pdf.setFont("Helvetica", size)
+            pdf.drawString(36, y, text)
+            y -= gap
+
+        line("GOVERNMENT OF INDIA", 11)
+        line(office, 10)
+        line(f"Reference No. {number}          Date: {facts['issued']}")
+        line("-" * 110)
+        if page == 1:
+            line(f"GSTIN / Registration ........................ {facts['gstin']}")
+            line("Name of the taxpayer ........................ M/s " + " ".join(rng.choices(WORDS, k=2)).title())
+            line(f"Subject: Notice under {facts['sections'][0]} read with {facts['sections'][1]}")
+        for n in range(rng.randint(5, 7)):
+            words = rng.choices(WORDS, k=rng.randint(30, 45))
+            if n == 1 and page == 1:
+                words += ["payable", "Rs.", facts["amounts"][0] + "/-", "by", facts["due"]]
+            text = f"{page}.{n + 1} " + " ".join(words)
+            paragraphs.append(text)
+            for start in range(0, len(text), 100):
+                line(text[start:start + 100])
+            y -= 4
+        if page == 1:
+            line("-" * 110)
+            line("Head          Tax                 Interest             Penalty              Total")
+            line("-" * 110)
+            for head, amount in zip(("IGST", "CGST", "SGST"), facts["amounts"]):
+                line(f"{head}          {amount}          0.00          0.00          {amount}")
+            line("-" * 110)
+        line("This is a system generated notice and does not require signature.", 8)
+        line(f"Page {page} of {pages}", 8)
+        pdf.showPage()
+    pdf.save()
+    return paragraphs
+
+
+def word_pieces(text):
+    return len(re.findall(r"\w+|[^\w\s]", text))
+
+
+def chars_tokens(text):
+    return {"chars": len(text), "tokens_chars4": len(text) // 4, "tokens_pieces": word_pieces(text)}
+
+
+def coverage(text, paragraphs):
+    flat = " ".join(text.split())
+    # A paragraph counts when its first 60 characters made it into the prompt
+    return sum(1 for p in paragraphs if p[:60] in flat) / len(paragraphs)
+
+
+def fact_recall(text, facts):
+    wanted = [facts["gstin"], facts["issued"], facts["due"], *facts["amounts"], *facts["sections"]]
+    flat = " ".join(text.split())
+    return sum(1 for w in wanted if w in flat) / len(wanted)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Document text preprocessing: token reduction")
+    parser.add_argument("--docs", type=int, default=30)
+    parser.add_argument("--max-pages", type=int, default=6)
+    parser.add_argument("--max-chars", type=int, default=8000)
+    parser.add_argument("--seed", type=int, default=21)
+    parser.add_argument("--out", default="doc_preprocess.json")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    documents.pdf_pages = cache.TieredCache("pdf_pages", 3600, disk=None)
+    totals = {"raw": [], "prepared": []}
+    budget = {"raw": [], "prepared": []}
+    per_doc = []
+    start = time.perf_counter()
+    try:
+        with tempfile.TemporaryDirectory(prefix="vyapar-doctext-bench-") as tmp:
+            for n in range(args.docs):
+                facts = make_facts(rng)
+                path = f"{tmp}/notice_{n}.pdf"
+                paragraphs = make_notice(path, rng.randint(2, args.max_pages), facts, rng)
+                with open(path, "rb") as f:
+                    doc = documents.PdfDocument(f.read())
+                row = {"pages": doc.page_count}
+                for stage, prepare in (("raw", False), ("prepared", True)):
+                    whole = doc.text(None, 10**9, prepare=prepare)
+                    sent = doc.text(None, args.max_chars, prepare=prepare)
+                    totals[stage].append(chars_tokens(whole))
+                    budget[stage].append({"coverage": coverage(sent, paragraphs), "facts": fact_recall(sent, facts)})
+                    row[stage] = {**chars_tokens(whole), "budget_coverage": round(budget[stage][-1]["coverage"], 3),
+                                  "budget_fact_recall": round(budget[stage][-1]["facts"], 3)}
+                per_doc.append(row)
+    finally:
+        documents.pdf_pages = cache.pdf_pages
+    seconds = time.perf_counter() - start
+
+    def total(stage, field):
+        return sum(t[field] for t in totals[stage])
+
+    def mean(stage, field):
+        return round(sum(b[field] for b in budget[stage]) / len(budget[stage]), 3)
+
+    summary = {
+        stage: {"chars": total(stage, "chars"), "tokens_chars4": total(stage, "tokens_chars4"),
+                "tokens_pieces": total(stage, "tokens_pieces"),
+                "budget_coverage": mean(stage, "coverage"), "budget_fact_recall": mean(stage, "facts")}
+        for stage in totals
+    }
+    summary["reduction"] = {field: round(1 - total("prepared", field) / total("raw", field), 3)
+                            for field in ("chars", "tokens_chars4", "tokens_pieces")}
+    for stage in ("raw", "prepared"):
+        s = summary[stage]
+        print(f"{stage:>9}: {s['chars']:>8,} chars  ~{s['tokens_chars4']:>7,} tokens (chars/4)  "
+              f"{s['tokens_pieces']:>7,} word pieces  | {args.max_chars}-char prompt: "
+              f"{s['budget_coverage']:.0%} of paragraphs, {s['budget_fact_recall']:.0%} of key facts")
+    r = summary["reduction"]
+    print(f"reduction: {r['chars']:.1%} chars, {r['tokens_chars4']:.1%} tokens (chars/4), "
+          f"{r['tokens_pieces']:.1%} word pieces over {args.docs} notices")
+
+    report = {
+        "meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "git_commit": git_commit(), "args": vars(args),
+                 "doctext_version": doctext.VERSION, "seconds": round(seconds, 2)},
+        "summary": summary,
+        "documents": per_doc,
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"report written to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,157 @@
+"""Peak memory of history export for a user with a million messages.
+
+Builds a temporary users.db with one very long conversation (part of it
+moved into archive segments), then runs each export format in a fresh child
+process and records its peak RSS, time and output size. A "materialize"
+row shows the non-streaming approach for comparison: the whole history
+collected into a list and serialized with one json.dumps.
+
+    python -m benchmarks.export_memory --messages 1000000 --out export_memory.json
+
+PDF rendering is far slower than JSONL/CSV, so it runs on a separate user
+with --pdf-messages turns (still several zip volumes).
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import db
+import export
+import retention
+
+TURN_WORDS = "gst invoice return filing credit msme udyam loan subsidy payroll tds notice due date penalty".split()
+
+
+def build_user(user_id, messages, archived_fraction, rng):
+    conn = db.get_connection()
+    c = conn.cursor()
+    c.execute("INSERT INTO users (id, username, password, first_name, last_name) VALUES (?, ?, 'x', 'Export', ?)",
+              (user_id, f"export_user_{user_id}", str(user_id)))
+    batch = []
+    for i in range(messages):
+        words = rng.randint(8, 80)
+        content = " ".join(rng.choice(TURN_WORDS) for _ in range(words))
+        batch.append((user_id, "user" if i % 2 == 0 else "assistant", content))
+        if len(batch) == 50000:
+            c.executemany("INSERT INTO chat_history (user_id, role, content) VALUES (?, ?, ?)", batch)
+            batch = []
+    if batch:
+        c.executemany("INSERT INTO chat_history (user_id, role, content) VALUES (?, ?, ?)", batch)
+    conn.commit()
+    conn.close()
+    keep_hot = int(messages * (1 - archived_fraction))
+    while retention.archive_slice(hot_days=36500, hot_messages=keep_hot, max_rows=5000, user_id=user_id):
+        pass
+
+
+def child(args):
+    """Runs in a fresh process so the high-water mark only covers one export."""
+    db.DB_PATH = args.db
+    baseline_mb = _status_mb("VmRSS")
+    start = time.perf_counter()
+    with open(os.devnull, "wb") as sink:
+        counting = _Counting(sink)
+        if args.format == "materialize":
+            messages = list(retention.iter_history(args.user))
+            counting.write(json.dumps(messages).encode())
+            count = len(messages)
+        else:
+            fmt, _, _ = export.resolve_format(args.format, args.user)
+            count = export.write_export(args.user, fmt, counting)
+    print(json.dumps({
+        "format": args.format,
+        "messages": count,
+        "output_mb": round(counting.bytes / 2**20, 1),
+        "seconds": round(time.perf_counter() - start, 2),
+        "baseline_rss_mb": round(baseline_mb, 1),
+        "peak_rss_mb": round(_status_mb("VmHWM"), 1),
+    }))
+
+
+def _status_mb(field):
+    # VmHWM starts over at exec; ru_maxrss would carry the parent's peak across fork+exec
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+class _Counting:
+    def __init__(self, f):
+        self.f = f
+        self.bytes = 0
+
+    def write(self, data):
+        self.bytes += len(data)
+        return self.f.write(data)
+
+    def flush(self):
+        pass
+
+
+def run_child(db_path, user_id, fmt):
+    out = subprocess.run(
+        [sys.executable, "-m", "benchmarks.export_memory", "--child", "--db", db_path,
+         "--user", str(user_id), "--format", fmt],
+        capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="History export peak memory")
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--pdf-messages", type=int, default=20_000)
+    parser.add_argument("--archived-fraction", type=float, default=0.5)
+    parser.add_argument("--skip-materialize", action="store_true")
+    parser.add_argument("--seed", type=int, default=11)
+    parser.add_argument("--out", default="export_memory.json")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--db", help=argparse.SUPPRESS)
+    parser.add_argument("--user", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--format", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        child(args)
+        return 0
+
+    from benchmarks.loadtest import git_commit
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory(prefix="vyapar-export-bench-") as tmp:
+        db.DB_PATH = os.path.join(tmp, "users.db")
+        db.init_db()
+        start = time.perf_counter()
+        build_user(1, args.messages, args.archived_fraction, rng)
+        build_user(2, args.pdf_messages, args.archived_fraction, rng)
+        print(f"built {args.messages:,} + {args.pdf_messages:,} messages in {time.perf_counter() - start:.1f}s "
+              f"({os.path.getsize(db.DB_PATH) / 2**20:.0f} MB db)")
+
+        runs = [(1, "jsonl"), (1, "csv"), (2, "pdf")]
+        if not args.skip_materialize:
+            runs.append((1, "materialize"))
+        results = []
+        for user_id, fmt in runs:
+            result = run_child(db.DB_PATH, user_id, fmt)
+            results.append(result)
+            print(f"{fmt:>12}: {result['messages']:>9,} msgs  {result['output_mb']:>8} MB out  "
+                  f"{result['seconds']:>7}s  peak RSS {result['peak_rss_mb']} MB "
+                  f"(+{result['peak_rss_mb'] - result['baseline_rss_mb']:.1f} MB over imports)")
+
+    report = {
+        "meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "git_commit": git_commit(), "args": vars(args)},
+        "results": results,
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"report written to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,191 @@
+"""Intent routing (llm.rule_intent / routed_chat): accuracy and the latency it costs.
+
+A labeled set of chat-box messages (tool requests in and outside
+detect_intent's phrases, plain questions, and questions that only mention
+invoices or notices) is routed three ways against the mock server, whose
+keyword classifier stands in for the small model:
+
+    rules       detect_intent alone (before this change)
+    sequential  classify first, then stream the answer if it is chat
+    concurrent  rule_intent, then routed_chat: the classifier runs alongside the answer
+
+and reports accuracy, time to first answer token for messages that end up as
+chat, time to the routing decision for messages that end up at a tool, and
+how many upstream answers were started and cancelled.
+
+    python -m benchmarks.intent_routing --rounds 5 --out intent_routing.json
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import db
+import llm
+import ratelimit
+import usage
+from benchmarks.loadtest import git_commit, percentile
+
+MESSAGES = [
+    # detect_intent's own phrases
+    ("create invoice for Ramesh for ₹4500", "invoice"),
+    ("generate bill for Sharma Traders rs 12000", "invoice"),
+    ("upload pdf of my GST notice", "document"),
+    ("explain document I got from the tax office", "document"),
+    # tool requests the phrases miss
+    ("please bill Ramesh 4500", "invoice"),
+    ("charge Mehta 2,500 for the repair work", "invoice"),
+    ("bill to Kumar Stores ₹18000 for 30 cartons", "invoice"),
+    ("Invoice Anita 7500 for the catering order", "invoice"),
+    ("I got a notice, can you read this pdf", "document"),
+    ("sending you my appointment letter, check it", "document"),
+    ("review the document I attached", "document"),
+    ("go through this notice and tell me what to do", "document"),
+    # plain chat
+    ("When is GSTR-3B due this month?", "chat"),
+    ("How do I register for Udyam?", "chat"),
+    ("What is the PF contribution rate for employees?", "chat"),
+    ("Suggest marketing ideas for a small bakery", "chat"),
+    ("Can I claim ITC on office furniture?", "chat"),
+    ("thanks, that helped", "chat"),
+    # chat that mentions tool words
+    ("What should an invoice contain to be GST compliant?", "chat"),
+    ("How long should I keep old bills and receipts?", "chat"),
+    ("Is a digital signature valid on a PDF invoice?", "chat"),
+    ("What is the penalty if I reply late to a GST notice of 25000?", "chat"),
+    ("Do I need to charge GST on exports?", "chat"),
+    ("Which documents are needed for a current account?", "chat"),
+]
+
+
+def first_token(stream, start):
+    """Iterate a chat stream to the end; seconds from `start` to its first content."""
+    first = None
+    for chunk in stream:
+        if chunk.choices[0].delta.content and first is None:
+            first = time.perf_counter() - start
+    return first
+
+
+# Each route returns (intent, seconds to the first answer token or None,
+# seconds to a tool decision or None), timed from the message arriving.
+def route_rules(text, messages):
+    start = time.perf_counter()
+    intent, _ = llm.detect_intent(text)
+    if intent != "chat":
+        return intent, None, time.perf_counter() - start
+    return "chat", first_token(llm.llm_chat(messages, cache=False), start), None
+
+
+def route_sequential(text, messages):
+    start = time.perf_counter()
+    intent, _ = llm.detect_intent(text)
+    if intent == "chat":
+        verdict = llm.classify_intent(text)
+        intent = verdict[0] if verdict else "chat"
+    if intent != "chat":
+        return intent, None, time.perf_counter() - start
+    return "chat", first_token(llm.llm_chat(messages, cache=False), start), None
+
+
+def route_concurrent(text, messages):
+    start = time.perf_counter()
+    intent, _, sure = llm.rule_intent(text)
+    if intent != "chat":
+        return intent, None, time.perf_counter() - start
+    stream = llm.routed_chat(messages, text, classify=not sure, cache=False)
+    first = first_token(stream, start)
+    if stream.redirected:
+        return stream.intent, None, time.perf_counter() - start
+    return "chat", first, None
+
+
+ROUTES = {"rules": route_rules, "sequential": route_sequential, "concurrent": route_concurrent}
+
+
+def run(name, rounds):
+    route = ROUTES[name]
+    correct = 0
+    ttft, decisions = [], []
+    confusion = {}
+    for _ in range(rounds):
+        for text, expected in MESSAGES:
+            intent, first, decided = route(text, [{"role": "user", "content": text}])
+            correct += intent == expected
+            confusion[f"{expected}->{intent}"] = confusion.get(f"{expected}->{intent}", 0) + 1
+            if first is not None:
+                ttft.append(first)
+            if decided is not None:
+                decisions.append(decided)
+    ttft.sort()
+    decisions.sort()
+
+    def ms(values, q):
+        return round(percentile(values, q) * 1000, 1) if values else None
+
+    return {
+        "route": name,
+        "accuracy": round(correct / (rounds * len(MESSAGES)), 3),
+        "confusion": dict(sorted(confusion.items())),
+        "chat_ttft_p50_ms": ms(ttft, 50),
+        "chat_ttft_p95_ms": ms(ttft, 95),
+        "tool_decision_p50_ms": ms(decisions, 50),
+        "tool_decision_p95_ms": ms(decisions, 95),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Intent routing accuracy and latency")
+    parser.add_argument("--rounds", type=int, default=5, help="passes over the labeled messages")
+    parser.add_argument("--ttft", type=float, default=0.3, help="mock time to first token of an answer")
+    parser.add_argument("--classify-latency", type=float, default=0.15, help="mock intent classification time")
+    parser.add_argument("--max-tokens", type=int, default=80)
+    parser.add_argument("--out", default="intent_routing.json")
+    args = parser.parse_args(argv)
+
+    from openai import OpenAI
+    from mock_llm_server import MockConfig, MockLLMServer
+
+    tmpdir = tempfile.TemporaryDirectory(prefix="vyapar-intent-bench-")
+    db.DB_PATH = os.path.join(tmpdir.name, "users.db")
+    db.init_db()
+    ratelimit.controller = ratelimit.AdmissionController(default_tier="unlimited", global_tpm=0, persist=False)
+    results = []
+    for name in ROUTES:
+        server = MockLLMServer(MockConfig(ttft=args.ttft, inter_token_delay=0.005,
+                                          completion_tokens=args.max_tokens,
+                                          classify_latency=args.classify_latency)).start()
+        llm.client = OpenAI(api_key="mock", base_url=server.base_url)
+        try:
+            result = run(name, args.rounds)
+            # Let cancelled streams reach the mock before reading its counters
+            time.sleep(0.2)
+            stats = server.snapshot_stats()
+        finally:
+            server.stop()
+        result.update(classifications=stats.get("classifications", 0), streams=stats.get("streams", 0),
+                      cancelled_streams=stats.get("cancelled", 0))
+        results.append(result)
+        print(f"{name:>10}: accuracy {result['accuracy']:.0%}  chat TTFT p50 {result['chat_ttft_p50_ms']}ms "
+              f"p95 {result['chat_ttft_p95_ms']}ms  tool decision p50 {result['tool_decision_p50_ms']}ms "
+              f"p95 {result['tool_decision_p95_ms']}ms  classifications {result['classifications']} "
+              f"streams {result['streams']} (cancelled {result['cancelled_streams']})")
+
+    usage.recorder.flush()
+    tmpdir.cleanup()
+
+    report = {
+        "meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "git_commit": git_commit(), "args": vars(args),
+                 "messages": len(MESSAGES)},
+        "results": results,
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"report written to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,455 @@
+"""Headless load test simulating concurrent VyaparGPT sessions.
+
+Drives the same helpers the Streamlit pages call (login, history load, chat
+turn, invoice generation, document upload + explanation) from N virtual users
+against a throw-away users.db and the offline mock LLM, then writes a JSON
+report with per-stage p50/p95/p99, throughput, SQLite lock waits and RSS.
+
+    python -m benchmarks.loadtest --users 50 --ramp 10 --duration 60 --out load.json
+    python -m benchmarks.loadtest --users 50 --compare load.json --fail-threshold 20
+
+Each virtual user is a thread, which is how Streamlit serves sessions inside a
+single app.py process.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from io import BytesIO
+
+from openai import OpenAI
+
+import db
+import documents
+import llm
+import ratelimit
+import usage
+from mock_llm_server import MockConfig, MockLLMServer
+from singleflight import coalescer
+
+STAGES = ["login", "load_history", "chat_turn", "llm_ttft", "invoice", "document_upload"]
+
+QUESTIONS = [
+    "What is the due date for GSTR-3B this month?",
+    "How do I register my business on Udyam?",
+    "Which loans are available for MSMEs under CGTMSE?",
+    "Explain input tax credit reconciliation with GSTR-2B.",
+    "How can I sell to government buyers on GeM?",
+    "What documents do I need for a trademark application?",
+]
+
+NOTICE_LINES = [
+    "GOVERNMENT OF INDIA - GOODS AND SERVICES TAX DEPARTMENT",
+    "Notice under Section 73 of the CGST Act, 2017",
+    "GSTIN: 27AAPFU0939F1ZV",
+    "Discrepancy noticed between GSTR-1 and GSTR-3B for the period April 2024 to March 2025.",
+    "Tax amount of Rs. 1,24,500 along with interest under Section 50 is proposed to be demanded.",
+    "You are required to furnish a reply in Form GST DRC-06 within 30 days of this notice.",
+    "Failing which the matter will be decided ex parte on the basis of available records.",
+]
+
+
+# =========================
+# MEASUREMENT
+# =========================
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.error_messages = defaultdict(set)
+        self.iterations = 0
+        self.lock_waits = 0
+        self.lock_wait_total = 0.0
+        self.lock_wait_max = 0.0
+        self.lock_timeouts = 0
+
+    def sample(self, stage, seconds):
+        with self._lock:
+            self.samples[stage].append(seconds)
+
+    def error(self, stage, exc):
+        with self._lock:
+            self.errors[stage] += 1
+            if len(self.error_messages[stage]) < 5:
+                self.error_messages[stage].add(f"{type(exc).__name__}: {exc}")
+
+    def lock_wait(self, seconds, timed_out=False):
+        with self._lock:
+            self.lock_waits += 1
+            self.lock_wait_total += seconds
+            self.lock_wait_max = max(self.lock_wait_max, seconds)
+            if timed_out:
+                self.lock_timeouts += 1
+
+    def timed(self, stage, fn, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            self.error(stage, e)
+            raise
+        self.sample(stage, time.perf_counter() - start)
+        return result
+
+
+def instrument_db_locks(recorder, busy_timeout=5.0):
+    """Route db.get_connection through connections that count lock waits.
+
+    sqlite3 hides its busy handler, so connections are opened with timeout=0
+    and "database is locked" errors are retried here with the same overall
+    budget as the default 5s timeout, timing how long each wait took.
+    """
+    def retry(op):
+        start = None
+        delay = 0.001
+        while True:
+            try:
+                result = op()
+            except sqlite3.OperationalError as e:
+                if "locked" not in str(e) and "busy" not in str(e):
+                    raise
+                now = time.perf_counter()
+                start = start or now
+                if now - start > busy_timeout:
+                    recorder.lock_wait(now - start, timed_out=True)
+                    raise
+                time.sleep(delay)
+                delay = min(delay * 2, 0.05)
+                continue
+            if start is not None:
+                recorder.lock_wait(time.perf_counter() - start)
+            return result
+
+    class Cursor(sqlite3.Cursor):
+        def execute(self, *args):
+            return retry(lambda: super(Cursor, self).execute(*args))
+
+        def executemany(self, *args):
+            return retry(lambda: super(Cursor, self).executemany(*args))
+
+    class Connection(sqlite3.Connection):
+        def cursor(self, factory=Cursor):
+            return super().cursor(factory)
+
+        def execute(self, *args):
+            return self.cursor().execute(*args)
+
+        def commit(self):
+            return retry(super().commit)
+
+    db.get_connection = lambda: sqlite3.connect(db.DB_PATH, timeout=0, factory=Connection)
+
+
+def current_rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        # Peak is the best portable approximation (KiB on Linux, bytes on macOS).
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+class RssSampler(threading.Thread):
+    def __init__(self, interval=0.5):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.start_mb = current_rss_mb()
+        self.peak_mb = self.start_mb
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.peak_mb = max(self.peak_mb, current_rss_mb())
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self.peak_mb = max(self.peak_mb, current_rss_mb())
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    k = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+
+# =========================
+# SESSION FLOWS
+# =========================
+def make_notice_pdf(pages=5) -> bytes:
+    if documents.canvas is None:
+        return b""
+    buffer = BytesIO()
+    pdf = documents.canvas.Canvas(buffer, pagesize=documents.A4)
+    _, height = documents.A4
+    for page in range(pages):
+        y = height - 72
+        for line in NOTICE_LINES * 4:
+            pdf.drawString(40, y, line)
+            y -= 16
+        pdf.drawString(40, 40, f"Page {page + 1} of {pages}")
+        pdf.showPage()
+    pdf.save()
+    return buffer.getvalue()
+
+
+def consume_stream(stream, recorder):
+    start = time.perf_counter()
+    first = None
+    text = ""
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            if first is None:
+                first = time.perf_counter()
+                recorder.sample("llm_ttft", first - start)
+            text += chunk.choices[0].delta.content
+    return text
+
+
+def virtual_user(vu_id, args, recorder, deadline, pdf_bytes):
+    rng = random.Random(args.seed + vu_id)
+    username, password = f"loadtest_vu{vu_id}", "loadtest-pass"
+    db.register_user(username, password, "Load", f"User{vu_id}", f"vu{vu_id}@example.com", "")
+
+    iteration = 0
+    while time.time() < deadline and (not args.iterations or iteration < args.iterations):
+        iteration += 1
+        try:
+            user = recorder.timed("login", db.authenticate_user, username, password)
+            messages = recorder.timed("load_history", db.load_chat_history, user.id)
+
+            def chat_turn():
+                question = rng.choice(QUESTIONS)
+                if not args.shared_prompts:
+                    question += f" (ref {vu_id}-{iteration})"
+                db.save_chat_message(user.id, "user", question)
+                messages.append({"role": "user", "content": question})
+                intent, _ = llm.detect_intent(question)
+                answer = consume_stream(llm.llm_chat(messages, user_id=user.id), recorder)
+                db.save_chat_message(user.id, "assistant", answer)
+                messages.append({"role": "assistant", "content": answer})
+                return intent
+            recorder.timed("chat_turn", chat_turn)
+
+            if pdf_bytes:
+                def invoice():
+                    amount = rng.randint(500, 250000)
+                    intent, data = llm.detect_intent(f"generate invoice for Ramesh Traders for ₹{amount}")
+                    return documents.generate_invoice_pdf(data.get("customer", ""), data.get("amount", 0.0))
+                recorder.timed("invoice", invoice)
+
+                if rng.random() < args.document_ratio:
+                    def document_upload():
+                        text = documents.read_pdf_text(BytesIO(pdf_bytes), max_chars=8000)
+                        summary_prompt = documents.document_summary_prompt(text)
+                        answer = consume_stream(llm.llm_chat(messages + [{"role": "user", "content": summary_prompt}], user_id=user.id), recorder)
+                        db.save_chat_message(user.id, "user", summary_prompt)
+                        db.save_chat_message(user.id, "assistant", answer)
+                    recorder.timed("document_upload", document_upload)
+        except Exception:
+            # Already counted against the failing stage; keep the user going.
+            pass
+        with recorder._lock:
+            recorder.iterations += 1
+        if args.think_time:
+            time.sleep(rng.uniform(0, args.think_time))
+
+
+# =========================
+# REPORTING
+# =========================
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def build_report(args, recorder, elapsed, rss, mock_stats):
+    stages = {}
+    for stage in STAGES:
+        values = sorted(recorder.samples.get(stage, []))
+        if not values and not recorder.errors.get(stage):
+            continue
+        ms = lambda v: round(v * 1000, 3) if v is not None else None
+        stages[stage] = {
+            "count": len(values),
+            "errors": recorder.errors.get(stage, 0),
+            "error_samples": sorted(recorder.error_messages.get(stage, [])),
+            "throughput_per_s": round(len(values) / elapsed, 3) if elapsed else None,
+            "mean_ms": ms(sum(values) / len(values)) if values else None,
+            "p50_ms": ms(percentile(values, 50)),
+            "p95_ms": ms(percentile(values, 95)),
+            "p99_ms": ms(percentile(values, 99)),
+            "max_ms": ms(values[-1]) if values else None,
+        }
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "summary": {
+            "elapsed_s": round(elapsed, 3),
+            "virtual_users": args.users,
+            "iterations": recorder.iterations,
+            "iterations_per_s": round(recorder.iterations / elapsed, 3) if elapsed else None,
+            "errors": sum(recorder.errors.values()),
+        },
+        "stages": stages,
+        "db": {
+            "lock_waits": recorder.lock_waits,
+            "lock_wait_total_ms": round(recorder.lock_wait_total * 1000, 3),
+            "lock_wait_max_ms": round(recorder.lock_wait_max * 1000, 3),
+            "lock_timeouts": recorder.lock_timeouts,
+        },
+        "rate_limit": {
+            "throttled": ratelimit.controller.throttled,
+            "queued": ratelimit.controller.queued,
+        },
+        "rss_mb": {
+            "start": round(rss.start_mb, 1),
+            "peak": round(rss.peak_mb, 1),
+            "end": round(current_rss_mb(), 1),
+        },
+        "llm": {
+            "coalesced_leaders": coalescer.leaders,
+            "coalesced_followers": coalescer.followers,
+            "mock_server": mock_stats,
+        },
+    }
+
+
+def compare(report, baseline, threshold_pct):
+    """Print p95 deltas against a previous report; return the regressed stages."""
+    regressed = []
+    print(f"\n{'stage':<18}{'base p95':>12}{'new p95':>12}{'delta':>10}")
+    for stage, cur in report["stages"].items():
+        base = baseline.get("stages", {}).get(stage)
+        if not base or not base.get("p95_ms") or cur.get("p95_ms") is None:
+            continue
+        delta = (cur["p95_ms"] - base["p95_ms"]) / base["p95_ms"] * 100
+        flag = " !" if delta > threshold_pct else ""
+        print(f"{stage:<18}{base['p95_ms']:>12.1f}{cur['p95_ms']:>12.1f}{delta:>9.1f}%{flag}")
+        if delta > threshold_pct:
+            regressed.append(stage)
+    return regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless VyaparGPT load test")
+    parser.add_argument("--users", type=int, default=20, help="number of virtual users")
+    parser.add_argument("--ramp", type=float, default=5.0, help="seconds to start all users")
+    parser.add_argument("--duration", type=float, default=30.0, help="total test duration in seconds")
+    parser.add_argument("--iterations", type=int, default=0, help="stop each user after N iterations (0 = duration only)")
+    parser.add_argument("--think-time", type=float, default=0.5, help="max random pause between iterations")
+    parser.add_argument("--document-ratio", type=float, default=0.3, help="fraction of iterations that upload a document")
+    parser.add_argument("--shared-prompts", action="store_true", help="let users ask identical questions (exercises coalescing)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--ttft", type=float, default=0.2)
+    parser.add_argument("--inter-token-delay", type=float, default=0.005)
+    parser.add_argument("--completion-tokens", type=int, default=120)
+    parser.add_argument("--tier", default="unlimited", help="rate-limit tier for virtual users")
+    parser.add_argument("--global-tpm", type=float, default=0, help="shared upstream tokens/minute (0 = unlimited)")
+    parser.add_argument("--llm-base-url", help="use an already running OpenAI-compatible server instead of the embedded mock")
+    parser.add_argument("--db", help="database path (default: a temporary file)")
+    parser.add_argument("--out", default="loadtest_report.json")
+    parser.add_argument("--compare", help="previous report to compare p95 latencies against")
+    parser.add_argument("--fail-threshold", type=float, default=20.0, help="p95 regression (%%) that fails --compare")
+    args = parser.parse_args(argv)
+
+    tmpdir = None
+    if args.db:
+        db.DB_PATH = args.db
+    else:
+        tmpdir = tempfile.TemporaryDirectory(prefix="vyapar-load-")
+        db.DB_PATH = os.path.join(tmpdir.name, "users.db")
+    db.init_db()
+
+    recorder = Recorder()
+    instrument_db_locks(recorder)
+    ratelimit.controller = ratelimit.AdmissionController(default_tier=args.tier, global_tpm=args.global_tpm)
+
+    server = None
+    if args.llm_base_url:
+        base_url = args.llm_base_url
+    else:
+        server = MockLLMServer(MockConfig(
+            ttft=args.ttft,
+            inter_token_delay=args.inter_token_delay,
+            completion_tokens=args.completion_tokens,
+            seed=args.seed,
+        )).start()
+        base_url = server.base_url
+    llm.client = OpenAI(api_key=os.environ.get("GROQ_API_KEY", "mock"), base_url=base_url)
+
+    pdf_bytes = make_notice_pdf()
+    if not pdf_bytes:
+        print("reportlab not installed: skipping invoice and document stages")
+
+    rss = RssSampler()
+    rss.start()
+    start = time.time()
+    deadline = start + args.duration
+    threads = []
+    for vu_id in range(args.users):
+        delay = start + (args.ramp * vu_id / max(1, args.users)) - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        t = threading.Thread(target=virtual_user, args=(vu_id, args, recorder, deadline, pdf_bytes), daemon=True)
+        t.start()
+        threads.append(t)
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+    rss.stop()
+    # Drain background usage accounting while the database still exists
+    usage.recorder.flush()
+
+    mock_stats = server.snapshot_stats() if server else None
+    if server:
+        server.stop()
+    report = build_report(args, recorder, elapsed, rss, mock_stats)
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{'stage':<18}{'count':>8}{'err':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for stage, s in report["stages"].items():
+        fmt = lambda v: f"{v:>10.1f}" if v is not None else f"{'-':>10}"
+        print(f"{stage:<18}{s['count']:>8}{s['errors']:>6}{fmt(s['p50_ms'])}{fmt(s['p95_ms'])}{fmt(s['p99_ms'])}")
+    print(f"iterations/s: {report['summary']['iterations_per_s']}  "
+          f"lock waits: {report['db']['lock_waits']} ({report['db']['lock_wait_total_ms']} ms)  "
+          f"peak RSS: {report['rss_mb']['peak']} MB")
+    print(f"report written to {args.out}")
+
+    if tmpdir is not None:
+        tmpdir.cleanup()
+    if args.compare:
+        with open(args.compare) as f:
+            regressed = compare(report, json.load(f), args.fail_threshold)
+        if regressed:
+            print(f"p95 regressions above {args.fail_threshold}%: {', '.join(regressed)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+"""Check the Prometheus text exposition of metrics.REGISTRY.
+
+Registers a counter, a labelled counter and a histogram on REGISTRY, bumps
+them, renders the registry and checks the lines a scraper depends on:
+
+    # HELP / # TYPE      one pair per metric, before its samples
+    labels               backslash, double quote and newline escaped in values
+    histogram            cumulative _bucket{le="..."} lines ending in le="+Inf",
+                         then _sum and _count
+    app metrics          every metric defined in metrics.py is rendered
+
+Prints each mismatch and exits 1 if there is any, so it can gate a build.
+
+    python -m benchmarks.metrics_exposition
+"""
+import sys
+
+import metrics
+from metrics import REGISTRY, Counter, Histogram
+
+PREFIX = "vyapar_exposition_check"
+
+
+def expected_lines():
+    counter = Counter(f"{PREFIX}_total", "Plain counter.", registry=REGISTRY)
+    labelled = Counter(f"{PREFIX}_labelled_total", "Labelled counter.", ["path", "outcome"], registry=REGISTRY)
+    histogram = Histogram(f"{PREFIX}_seconds", "Histogram.", registry=REGISTRY, buckets=(0.1, 1.0, 5.0))
+
+    counter.inc()
+    counter.inc(2)
+    labelled.labels('C:\\tmp\\"a"\nb', "ok").inc()
+    labelled.labels(path="/v1/chat", outcome="error").inc(3)
+    for value in (0.05, 0.5, 0.5, 3.0, 60.0):
+        histogram.observe(value)
+
+    return [
+        f"# HELP {PREFIX}_total Plain counter.",
+        f"# TYPE {PREFIX}_total counter",
+        f"{PREFIX}_total 3",
+        f"# HELP {PREFIX}_labelled_total Labelled counter.",
+        f"# TYPE {PREFIX}_labelled_total counter",
+        f'{PREFIX}_labelled_total{{path="/v1/chat",outcome="error"}} 3',
+        f'{PREFIX}_labelled_total{{path="C:\\\\tmp\\\\\\"a\\"\\nb",outcome="ok"}} 1',
+        f"# HELP {PREFIX}_seconds Histogram.",
+        f"# TYPE {PREFIX}_seconds histogram",
+        f'{PREFIX}_seconds_bucket{{le="0.1"}} 1',
+        f'{PREFIX}_seconds_bucket{{le="1"}} 3',
+        f'{PREFIX}_seconds_bucket{{le="5"}} 4',
+        f'{PREFIX}_seconds_bucket{{le="+Inf"}} 5',
+        f"{PREFIX}_seconds_sum 64.05",
+        f"{PREFIX}_seconds_count 5",
+    ]
+
+
+def check(text, expected):
+    errors = []
+    if not text.endswith("\n"):
+        errors.append("exposition does not end with a newline")
+    lines = text.splitlines()
+    ours = [line for line in lines if line.startswith(f"# HELP {PREFIX}") or line.startswith(f"# TYPE {PREFIX}")
+            or line.startswith(PREFIX)]
+    for n, (got, want) in enumerate(zip(ours, expected)):
+        if got != want:
+            errors.append(f"line {n}: expected {want!r}, got {got!r}")
+    if len(ours) != len(expected):
+        errors.append(f"expected {len(expected)} check lines, got {len(ours)}")
+
+    for line in lines:
+        if "\r" in line:
+            errors.append(f"carriage return in {line!r}")
+    for metric in vars(metrics).values():
+        if isinstance(metric, metrics._Metric):
+            for kind in ("HELP", "TYPE"):
+                if f"# {kind} {metric.name} " not in text:
+                    errors.append(f"no # {kind} line for {metric.name}")
+    return errors
+
+
+def main():
+    expected = expected_lines()
+    errors = check(REGISTRY.render(), expected)
+    for error in errors:
+        print(error)
+    if errors:
+        print(f"FAIL: {len(errors)} mismatch(es) in the exposition")
+        return 1
+    print(f"ok: {len(expected)} check lines and every app metric render as expected")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
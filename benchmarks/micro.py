@@ -0,0 +1,441 @@
+"""Micro-benchmarks for the helpers behind the Streamlit pages, with a stored baseline.
+
+Times, without starting Streamlit, each helper across input sizes:
+
+    detect_intent            chat / invoice / document messages, 10 to 2,000 words
+    read_pdf_text            1, 5 and 20 page notices, caches off (every call parses)
+    generate_invoice_pdf     customer names of 10 to 1,000 characters
+    generate_legal_doc_pdf   each document type
+    save_chat_message        100 B, 2 KB (blob store) and 32 KB messages
+    load_chat_history        10, 100 and 1,000 message histories
+    validate_reset_token     valid and unknown tokens among 100 and 10,000 issued
+
+against a throw-away users.db. Each case is calibrated like timeit (enough
+calls for --min-time per round) and run --repeat rounds. The fastest
+round's time per call is what gets compared: as with timeit, slower rounds
+measure other load on the machine more than the code.
+
+One pass is still noisy. The VM the baseline is recorded on changes speed
+for minutes at a time, and the same code measured in separate processes
+moved by -30% to +25% against a single-pass baseline. So cases run in
+child processes, and results are medians over --runs passes:
+
+    against a revision (--against REV)
+        the cases run against the modules at REV (extracted with git
+        archive) and those in the working tree, in two child processes side
+        by side, alternating case by case (and which side goes first), so
+        both see the same machine speed.
+        A case's delta is the median of its new/old ratios. This is the
+        comparison to trust for a change.
+    against the stored baseline (default)
+        --runs passes, each in a fresh child, and the median of a case's
+        passes is compared with benchmarks/micro_baseline.json. Each result
+        carries the time of a fixed pure-Python reference workload, and
+        the comparison is scaled by it to allow for machine speed.
+
+A baseline is recorded from BASELINE_RUNS passes. It keeps, per case, how
+far the passes spread ("noise_pct", the median distance of a pass from the
+median), and the largest spread as meta.noise_floor_pct. In both modes a
+case regresses when it is slower by more than --fail-threshold percent, or
+by NOISE_FACTOR times its noise if that is more. Against the baseline, a
+regressed case is measured once more and reported only if it is still
+slower. Any regression gives exit status 1.
+
+    python -m benchmarks.micro --against HEAD~1       this change against the previous commit
+    python -m benchmarks.micro                        compare against the stored baseline
+    python -m benchmarks.micro --update-baseline      re-record it (same machine, quiet system)
+    python -m benchmarks.micro --filter pdf           only cases whose name contains "pdf"
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from io import BytesIO
+
+import cache
+import db
+import documents
+import llm
+from benchmarks.loadtest import git_commit, make_notice_pdf
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "micro_baseline.json")
+BASELINE_RUNS = 5   # passes a baseline is the median of
+NOISE_FACTOR = 3.0  # a case's threshold is at least this many times its baseline noise
+
+CHAT_WORDS = "what is the due date for gstr-3b and how much late fee applies to a small shop in pune".split()
+
+
+def _user(username):
+    db.register_user(username, "secret", "Micro", "Bench")
+    return db.get_user_by_username(username).id
+
+
+def _message(words, prefix=""):
+    return (prefix + " " + " ".join(itertools.islice(itertools.cycle(CHAT_WORDS), words))).strip()
+
+
+# =========================
+# CASES
+# =========================
+def cases():
+    """(name, size, zero-argument callable) for every case; fixtures are built here."""
+    out = []
+
+    for words in (10, 100, 2000):
+        for kind, prefix in (("chat", ""), ("invoice", "create invoice for Ramesh Traders for ₹4500"),
+                             ("document", "please explain this gst notice pdf")):
+            text = _message(words, prefix)
+            out.append((f"detect_intent[{kind}]", words, lambda text=text: llm.detect_intent(text)))
+
+    for pages in (1, 5, 20):
+        pdf = make_notice_pdf(pages)
+        out.append(("read_pdf_text", pages, lambda pdf=pdf: documents.read_pdf_text(BytesIO(pdf))))
+
+    for length in (10, 100, 1000):
+        customer = ("Sharma Traders " * 70)[:length]
+        out.append(("generate_invoice_pdf", length,
+                    lambda customer=customer: documents.generate_invoice_pdf(customer, 125000.0)))
+    for doc_type in ("Offer Letter", "NDA", "Leave Policy"):
+        out.append((f"generate_legal_doc_pdf[{doc_type}]", 1,
+                    lambda doc_type=doc_type: documents.generate_legal_doc_pdf(doc_type, "Asha Rao")))
+
+    writer = _user("micro_writer")
+    counter = itertools.count()
+    for size in (100, 2048, 32768):
+        body = ("gst invoice filing credit " * (size // 25 + 1))[:size]
+        # A different message every call: the blob store would otherwise only bump a refcount
+        out.append(("save_chat_message", size,
+                    lambda body=body: db.save_chat_message(writer, "user", f"{next(counter)} {body}")))
+
+    for messages in (10, 100, 1000):
+        user_id = _user(f"micro_reader_{messages}")
+        conn = db.get_connection()
+        conn.executemany("INSERT INTO chat_history (user_id, role, content) VALUES (?, ?, ?)",
+                         [(user_id, "user" if i % 2 == 0 else "assistant", _message(40)) for i in range(messages)])
+        conn.commit()
+        conn.close()
+        out.append(("load_chat_history", messages, lambda user_id=user_id: db.load_chat_history(user_id)))
+
+    for issued in (100, 10000):
+        user_id = _user(f"micro_reset_{issued}")
+        valid = db.create_password_reset_token(user_id)
+        conn = db.get_connection()
+        conn.executemany("INSERT INTO password_reset_tokens (user_id, token, expires_at) VALUES (?, ?, ?)",
+                         [(user_id, str(uuid.uuid4()), time.time() + 3600) for _ in range(issued - 1)])
+        conn.commit()
+        conn.close()
+        out.append(("validate_reset_token[valid]", issued, lambda valid=valid: db.validate_reset_token(valid)))
+        out.append(("validate_reset_token[unknown]", issued,
+                    lambda: db.validate_reset_token("00000000-0000-4000-8000-000000000000")))
+    return out
+
+
+# =========================
+# TIMING
+# =========================
+def reference():
+    """A fixed pure-Python workload; its time tracks how fast the machine is running right now."""
+    squares = {}
+    for i in range(2000):
+        squares[str(i)] = i * i
+    return sum(squares.values())
+
+
+def measure(fn, repeat, min_time):
+    """Per-call seconds for `repeat` rounds of `number` calls, `number` sized so a round takes min_time."""
+    fn()  # warm up (imports, first connections, font loading)
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 10**6:
+            break
+        number *= 2 if elapsed <= 0 else max(2, min(10, int(min_time / elapsed) + 1))
+    rounds = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        rounds.append((time.perf_counter() - start) / number)
+    return number, rounds
+
+
+def run_case(name, size, fn, repeat, min_time):
+    number, rounds = measure(fn, repeat, min_time)
+    us = [r * 1e6 for r in rounds]
+    return {"key": f"{name}/{size}", "name": name, "size": size, "calls_per_round": number, "rounds": repeat,
+            "median_us": round(statistics.median(us), 2), "min_us": round(min(us), 2), "max_us": round(max(us), 2)}
+
+
+def reference_us(repeat, min_time):
+    return min(measure(reference, repeat, min_time)[1]) * 1e6
+
+
+def slowdown(result, base):
+    """Percent slower than the baseline, after scaling both by their reference time."""
+    return (result["min_us"] / result["reference_us"]) / (base["min_us"] / base["reference_us"]) * 100 - 100
+
+
+def spread(values):
+    """Median distance of `values` from their median, in percent (None for a single value)."""
+    if len(values) < 2:
+        return None
+    mid = statistics.median(values)
+    return round(statistics.median(abs(v / mid - 1) for v in values) * 100, 1)
+
+
+def threshold(noise_pct, threshold_pct):
+    """The slowdown (%) that counts as a regression, widened by the measured noise."""
+    return max(threshold_pct, NOISE_FACTOR * (noise_pct or 0.0))
+
+
+def combine(passes):
+    """One result from a case's passes: the medians of their best rounds and of their reference times."""
+    result = dict(passes[0])
+    result.update(
+        runs=len(passes),
+        min_us=round(statistics.median(p["min_us"] for p in passes), 2),
+        median_us=round(statistics.median(p["median_us"] for p in passes), 2),
+        max_us=max(p["max_us"] for p in passes),
+        reference_us=round(statistics.median(p["reference_us"] for p in passes), 2),
+        noise_pct=spread([p["min_us"] for p in passes]))
+    return result
+
+
+# =========================
+# CHILD PROCESSES
+# =========================
+REFERENCE = "reference"
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def child(args):
+    """Time cases for the parent: one case key per stdin line, one JSON result per stdout line."""
+    tmpdir = tempfile.TemporaryDirectory(prefix="vyapar-micro-")
+    db.DB_PATH = os.path.join(tmpdir.name, "users.db")
+    db.init_db()
+    # Every read_pdf_text call parses the PDF: no memory or disk cache hits
+    documents.pdf_text = cache.TieredCache("pdf_text", 0, disk=None)
+    documents.pdf_pages = cache.TieredCache("pdf_pages", 0, disk=None)
+    try:
+        table = {f"{name}/{size}": (name, size, fn) for name, size, fn in cases()}
+        print(json.dumps(list(table)), flush=True)
+        for line in sys.stdin:
+            key = line.strip()
+            if key == REFERENCE:
+                result = {"key": key, "min_us": round(reference_us(args.repeat, args.min_time), 2)}
+            else:
+                result = run_case(*table[key], args.repeat, args.min_time)
+            print(json.dumps(result), flush=True)
+    finally:
+        tmpdir.cleanup()
+
+
+class Child:
+    """A child process timing these cases against the modules of the source tree at `tree`."""
+
+    def __init__(self, tree, args, repeat=None):
+        self.proc = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--child",
+             "--repeat", str(repeat or args.repeat), "--min-time", str(args.min_time)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, cwd=tree,
+            env=dict(os.environ, PYTHONPATH=tree, VYAPAR_CACHE_PATH="", VYAPAR_METRICS_PORT="",
+                     VYAPAR_METRICS_FILE=""))
+        self.keys = json.loads(self._read())
+
+    def _read(self):
+        line = self.proc.stdout.readline()
+        if not line:
+            raise RuntimeError(f"benchmark child in {self.proc.args} exited with status {self.proc.wait()}")
+        return line
+
+    def run(self, key):
+        self.proc.stdin.write(key + "\n")
+        self.proc.stdin.flush()
+        return json.loads(self._read())
+
+    def close(self):
+        self.proc.stdin.close()
+        self.proc.wait()
+
+
+def selected(keys, pattern):
+    return [key for key in keys if pattern in key.rsplit("/", 1)[0]]
+
+
+def run_pass(args, keys=None, repeat=None):
+    """One pass in a fresh child process over `keys` (default: the cases --filter selects): {key: result}."""
+    worker = Child(ROOT, args, repeat)
+    try:
+        ref = worker.run(REFERENCE)["min_us"]
+        results = {}
+        for key in keys or selected(worker.keys, args.filter):
+            results[key] = dict(worker.run(key), reference_us=ref)
+        return results
+    finally:
+        worker.close()
+
+
+# =========================
+# COMPARISONS
+# =========================
+def against_baseline(args, base):
+    """--runs passes, each in a fresh child; cases slower than `base` (by key) are measured once more.
+
+    Returns the combined results and the keys of the cases that regressed.
+    """
+    passes = {}
+    for _ in range(args.runs):
+        for key, result in run_pass(args).items():
+            passes.setdefault(key, []).append(result)
+    results = {key: combine(runs) for key, runs in passes.items()}
+
+    def regressed(key):
+        b = base.get(key)
+        return bool(b and b.get("min_us")) and slowdown(results[key], b) > threshold(b.get("noise_pct"),
+                                                                                    args.fail_threshold)
+
+    slow = [key for key in results if regressed(key)]
+    if slow:
+        # A slow stretch of the machine during one pass is the usual cause: measure those cases again
+        for key, result in run_pass(args, slow, repeat=args.repeat * 2).items():
+            passes[key].append(result)
+            results[key] = dict(combine(passes[key]), remeasured=True)
+
+    for r in results.values():
+        print(f"{r['key']:<44}{r['min_us']:>12.1f} us  (median {r['median_us']:.1f}, max {r['max_us']:.1f}, "
+              f"{r['calls_per_round']} calls x {r['rounds']} rounds x {r['runs']} runs, noise {r['noise_pct']}%"
+              f"{', remeasured' if r.get('remeasured') else ''})")
+    if base:
+        print(f"\n{'case':<44}{'base us':>12}{'new us':>12}{'delta':>10}{'limit':>9}  "
+              f"(delta adjusted for machine speed)")
+        for r in results.values():
+            b = base.get(r["key"])
+            if not b or not b.get("min_us"):
+                print(f"{r['key']:<44}{'-':>12}{r['min_us']:>12.1f}{'new':>10}")
+                continue
+            delta, limit = slowdown(r, b), threshold(b.get("noise_pct"), args.fail_threshold)
+            print(f"{r['key']:<44}{b['min_us']:>12.1f}{r['min_us']:>12.1f}{delta:>9.1f}%{limit:>8.0f}%"
+                  f"{' !' if delta > limit else ''}")
+    return list(results.values()), [key for key in results if regressed(key)]
+
+
+def against_revision(args, tree):
+    """Interleaved runs of these cases against the modules at `tree` (old) and in the working tree (new).
+
+    Returns a result per case and the keys of the cases that regressed.
+    """
+    old, new = Child(tree, args), Child(ROOT, args)
+    try:
+        keys = selected(new.keys, args.filter)
+        ratios = {key: [] for key in keys if key in old.keys}
+        times = {key: ([], []) for key in ratios}
+        for n in range(args.runs):
+            for i, key in enumerate(ratios):
+                # Alternate which side goes first, so a change of machine speed within a pair evens out
+                first, second = (old, new) if (n + i) % 2 == 0 else (new, old)
+                a, b = first.run(key)["min_us"], second.run(key)["min_us"]
+                old_us, new_us = (a, b) if first is old else (b, a)
+                ratios[key].append(new_us / old_us)
+                times[key][0].append(old_us)
+                times[key][1].append(new_us)
+    finally:
+        old.close()
+        new.close()
+
+    results, regressed = [], []
+    print(f"\n{'case':<44}{'old us':>12}{'new us':>12}{'delta':>10}{'noise':>8}{'limit':>8}  "
+          f"(median of {args.runs} interleaved pairs)")
+    for key in keys:
+        if key not in ratios:
+            print(f"{key:<44}{'-':>12}{'':>12}{'new':>10}")
+            continue
+        delta = (statistics.median(ratios[key]) - 1) * 100
+        noise = spread(ratios[key])
+        limit = threshold(noise, args.fail_threshold)
+        old_us, new_us = statistics.median(times[key][0]), statistics.median(times[key][1])
+        print(f"{key:<44}{old_us:>12.1f}{new_us:>12.1f}{delta:>9.1f}%{noise or 0:>7.1f}%{limit:>7.0f}%"
+              f"{' !' if delta > limit else ''}")
+        results.append({"key": key, "old_us": round(old_us, 2), "new_us": round(new_us, 2),
+                        "delta_pct": round(delta, 1), "noise_pct": noise,
+                        "ratios": [round(r, 4) for r in ratios[key]]})
+        if delta > limit:
+            regressed.append(key)
+    return results, regressed
+
+
+def extract_revision(rev, dest):
+    """Unpack the tree at git revision `rev` into `dest`."""
+    archive = subprocess.run(["git", "archive", "--format=tar", rev], cwd=ROOT, capture_output=True, check=True)
+    subprocess.run(["tar", "-x", "-C", dest], input=archive.stdout, check=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the app's helper functions")
+    parser.add_argument("--repeat", type=int, default=7, help="timed rounds per case")
+    parser.add_argument("--min-time", type=float, default=0.05, help="seconds per round (calls are batched up to it)")
+    parser.add_argument("--runs", type=int, default=None,
+                        help=f"passes, or interleaved pairs, per case (default 3; {BASELINE_RUNS} with --update-baseline)")
+    parser.add_argument("--filter", default="", help="only cases whose name contains this")
+    parser.add_argument("--out", default="micro_results.json")
+    parser.add_argument("--against", metavar="REV", help="compare with git revision REV, interleaved")
+    parser.add_argument("--baseline", default=BASELINE, help="report to compare against ('' = none)")
+    parser.add_argument("--fail-threshold", type=float, default=25.0,
+                        help="slowdown of a case's best round (%%) that counts as a regression")
+    parser.add_argument("--update-baseline", action="store_true", help="write the results to --baseline")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        child(args)
+        return 0
+    if args.runs is None:
+        args.runs = BASELINE_RUNS if args.update_baseline else 3
+
+    meta = {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "git_commit": git_commit(),
+            "python": platform.python_version(), "platform": platform.platform(),
+            "args": {**vars(args), "baseline": os.path.relpath(args.baseline) if args.baseline else ""}}
+
+    if args.against:
+        with tempfile.TemporaryDirectory(prefix="vyapar-micro-rev-") as tree:
+            extract_revision(args.against, tree)
+            results, regressed = against_revision(args, tree)
+    else:
+        base = {}
+        if args.baseline and os.path.exists(args.baseline) and not args.update_baseline:
+            with open(args.baseline) as f:
+                base = {r["key"]: r for r in json.load(f).get("results", [])}
+        results, regressed = against_baseline(args, base)
+        noise = [r["noise_pct"] for r in results if r["noise_pct"] is not None]
+        if noise:
+            meta["noise_floor_pct"] = max(noise)
+            print(f"\nnoise floor: passes are up to {max(noise)}% from a case's median "
+                  f"(median case {statistics.median(noise):.1f}%)")
+
+    report = {"meta": meta, "results": results}
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"report written to {args.out}")
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        print(f"baseline written to {args.baseline}")
+        return 0
+    if regressed:
+        print(f"regressions above the limit against {args.against or 'the baseline'}: {', '.join(regressed)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
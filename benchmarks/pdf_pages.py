@@ -0,0 +1,148 @@
+"""Lazy, page-aware PDF reading (documents.PdfDocument) against the old whole-file path.
+
+On a generated --pages page notice, timed over --repeat runs each:
+
+    preview   what the Explain Document page shows before anything is sent:
+              old: extract up to 8,000 chars, show the first 1,500
+              new: page count + page 1 only
+    range     text for an explanation of --range (e.g. the last pages):
+              old: no page choice, the first 8,000 chars are sent whatever the user needs
+              new: only the chosen pages are parsed and sent
+    warm      the new preview and range again with the page cache filled
+              (another user or a rerun on the same file)
+
+and reports latency, pages parsed and characters that would go to the LLM.
+
+    python -m benchmarks.pdf_pages --pages 60 --range 55-58 --out pdf_pages.json
+"""
+import argparse
+import json
+import random
+import re
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+import cache
+import documents
+from benchmarks.loadtest import git_commit, percentile
+
+
+def make_notice(path, pages, lines, rng):
+    """A multi-page notice with `lines` lines of text per page (25 is about 2,800 chars)."""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+
+    words = "notice gstin demand interest penalty section reply hearing officer invoice credit".split()
+    pdf = canvas.Canvas(path, pagesize=A4)
+    for page in range(pages):
+        pdf.setFont("Helvetica", 9)
+        for line in range(lines):
+            pdf.drawString(40, 800 - line * 12, f"p{page + 1}.{line} " + " ".join(rng.choices(words, k=14)))
+        pdf.showPage()
+    pdf.save()
+
+
+def legacy_text(data, max_chars):
+    """The pre-PdfDocument extraction: pages in order until max_chars. Returns (text, pages parsed)."""
+    reader = documents.PyPDF2.PdfReader(BytesIO(data))
+    text_chunks = []
+    for page in reader.pages:
+        text_chunks.append(page.extract_text() or "")
+        if sum(len(t) for t in text_chunks) > max_chars:
+            break
+    return "\n".join(text_chunks)[:max_chars].strip(), len(text_chunks)
+
+
+def timed(fn, repeat):
+    samples = []
+    out = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return out, {"p50_ms": round(percentile(samples, 50) * 1000, 2),
+                 "p95_ms": round(percentile(samples, 95) * 1000, 2)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Lazy page-aware PDF reading vs whole-file extraction")
+    parser.add_argument("--pages", type=int, default=60)
+    parser.add_argument("--lines", type=int, default=25, help="text lines per page")
+    parser.add_argument("--range", default=None, help="pages to explain, e.g. 55-58 (default: the last 4)")
+    parser.add_argument("--max-chars", type=int, default=8000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=3)
+    parser.add_argument("--out", default="pdf_pages.json")
+    args = parser.parse_args(argv)
+    pages = documents.parse_page_range(args.range) or (max(1, args.pages - 3), args.pages)
+
+    with tempfile.NamedTemporaryFile(suffix=".pdf") as f:
+        make_notice(f.name, args.pages, args.lines, random.Random(args.seed))
+        data = f.read()
+
+    parsed = {"n": 0}
+    page_text = documents.PdfDocument.page_text
+
+    def counting_page_text(self, number):
+        if documents.pdf_pages.get(f"{self.digest}:{number}") is None:
+            parsed["n"] += 1
+        return page_text(self, number)
+
+    documents.PdfDocument.page_text = counting_page_text
+    results = []
+
+    def record(name, fn, repeat=args.repeat):
+        parsed["n"] = 0
+        (text, n_pages), timing = timed(fn, repeat)
+        # Which pages the text actually comes from (page markers "p<n>." from make_notice)
+        found = sorted({int(m) for m in re.findall(r"\bp(\d+)\.\d+ ", text)})
+        result = {"case": name, **timing, "pages_parsed": n_pages if n_pages is not None else parsed["n"] // repeat,
+                  "chars": len(text), "text_pages": f"{found[0]}-{found[-1]}" if found else ""}
+        results.append(result)
+        print(f"{name:>16}: p50 {result['p50_ms']:>8}ms  p95 {result['p95_ms']:>8}ms  "
+              f"pages parsed {result['pages_parsed']:>3}  chars {result['chars']:>5}  from pages {result['text_pages']}")
+
+    def preview_old():
+        text, n_pages = legacy_text(data, args.max_chars)
+        return text[:1500], n_pages
+
+    def preview_new():
+        doc = documents.PdfDocument(data)
+        doc.page_count
+        return doc.page_text(1)[:1500], None
+
+    def range_new():
+        return documents.PdfDocument(data).text(pages, args.max_chars), None
+
+    try:
+        # Cold: nothing cached (TTL 0 disables the cache)
+        documents.pdf_pages = cache.TieredCache("pdf_pages", 0, disk=None)
+        record("preview old", preview_old)
+        record("preview new", preview_new)
+        record("range old", lambda: legacy_text(data, args.max_chars))
+        record("range new", range_new)
+        # Warm: page cache filled by a first run
+        documents.pdf_pages = cache.TieredCache("pdf_pages", 3600, disk=None)
+        preview_new(), range_new()
+        record("preview new warm", preview_new)
+        record("range new warm", range_new)
+    finally:
+        documents.PdfDocument.page_text = page_text
+        documents.pdf_pages = cache.pdf_pages
+
+    report = {
+        "meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "git_commit": git_commit(), "args": vars(args),
+                 "range": list(pages), "pdf_bytes": len(data)},
+        "results": results,
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"report written to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,254 @@
+"""Prompt prefix stability (prompts.py) and its effect on time to first token.
+
+Checks, on requests built the way the app, API and job worker build them:
+
+    static_prefix   every user's request starts with the same bytes (STATIC_FINGERPRINT)
+    append_only     turn n+1 starts with everything turn n sent
+    no_pii          email, phone and last name never appear in a request
+    window_prefix   long sessions driven through chatstore (a ChatStore's
+                    messages(), and recent_messages over chat_history) past
+                    their window: a request shares the previous request's
+                    prefix except on the few turns where the window is cut
+
+Then replays interleaved long sessions through llm.llm_chat against the mock
+server with prefill cost per uncached prompt token and its provider-style
+prefix cache, in three setups:
+
+    stable         prompts.chat_messages, prefix cache on
+    legacy         the old layout: name, email and phone interpolated into the system prompt
+    stable_nocache prompts.chat_messages, prefix cache off (a provider without one)
+
+and reports TTFT by turn and the share of prompt tokens served from cache.
+Between rounds of turns the replay pauses for --pause seconds, longer than
+the mock keeps an unused prefix (--prefix-cache-ttl). That stands in for
+users who think longer than the provider keeps a prefix (minutes in
+production): when a user comes back their session's prefix is gone, while
+requests from other users keep a shared static prefix warm.
+
+    python -m benchmarks.prompt_prefix --users 6 --turns 30 --out prompt_prefix.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import db
+import llm
+import prompts
+import chatstore
+import ratelimit
+import usage
+from benchmarks.loadtest import git_commit, percentile
+
+QUESTIONS = [
+    "When is GSTR-3B due this month and what is the late fee?",
+    "Do I need an e-way bill for goods worth ₹60,000 sent within the city?",
+    "How do I reconcile my ITC with GSTR-2B?",
+    "What documents do I need for Udyam registration?",
+    "Can I claim ITC on a car used by the company director?",
+    "How is TDS on rent calculated for my shop?",
+    "What is the PF contribution for an employee earning ₹18,000?",
+    "I got a GST notice for mismatch in GSTR-1 and 3B, what should I do?",
+    "Which MSME loan scheme suits a small food processing unit?",
+    "How do I add a new place of business on the GST portal?",
+]
+BUCKETS = [(1, 1), (2, 5), (6, 15), (16, 10**6)]
+
+
+def make_users(n):
+    first = ["Asha", "Ravi", "Meena", "Imran", "Kavya", "Suresh", "Neha", "Arjun", "Farah", "Gopal"]
+    last = ["Rao", "Patel", "Iyer", "Khan", "Das", "Nair", "Gupta", "Singh", "Shaikh", "Menon"]
+    return [{"username": f"prefix_user{i}", "first_name": first[i % 10], "last_name": f"{last[i % 10]}{i}",
+             "email": f"user{i}@shop{i}.in", "phone": f"98{i:08d}"} for i in range(n)]
+
+
+def stable_request(user, history):
+    return prompts.chat_messages(history, first_name=user["first_name"])
+
+
+def legacy_request(user, history):
+    # The layout before prompts.py (same instructions): the system prompt rewritten per user with contact details
+    return [{
+        "role": "system",
+        "content": f"""{prompts.SYSTEM_PROMPT}
+                    The current user is {user['first_name']} {user['last_name']}.
+                    Contact details - Email: {user.get('email', 'not provided')}, Phone: {user.get('phone', 'not provided')}."""
+    }] + history[1:]
+
+
+# =========================
+# FINGERPRINT CHECKS
+# =========================
+def checks(users, turns, rng):
+    results = []
+
+    def check(name, ok, detail=""):
+        results.append({"check": name, "ok": bool(ok), "detail": detail})
+
+    firsts, legacy_firsts = set(), set()
+    append_only = True
+    leaks = []
+    for user in users:
+        history = [prompts.system_message()]
+        previous = None
+        for _ in range(turns):
+            history.append({"role": "user", "content": rng.choice(QUESTIONS)})
+            request = stable_request(user, history)
+            firsts.add(prompts.prefix_fingerprint(request, 1))
+            legacy_firsts.add(prompts.prefix_fingerprint(legacy_request(user, history), 1))
+            if previous is not None:
+                append_only &= prompts.prefix_fingerprint(request, len(previous)) == prompts.prefix_fingerprint(previous)
+            sent = json.dumps(request, ensure_ascii=False)
+            leaks.extend(v for v in (user["email"], user["phone"], user["last_name"]) if v in sent)
+            history.append({"role": "assistant", "content": " ".join(rng.choices(QUESTIONS[0].split(), k=40))})
+            previous = request
+    check("static_prefix", firsts == {prompts.STATIC_FINGERPRINT},
+          f"{len(firsts)} distinct first-message fingerprint(s) across {len(users)} users "
+          f"(legacy layout: {len(legacy_firsts)})")
+    check("append_only", append_only)
+    check("no_pii", not leaks, ", ".join(sorted(set(leaks))[:5]))
+    return results
+
+
+def window_checks(user, turns, rng, max_messages=20):
+    """Prefix breaks in a session `turns` long, its window bounded to `max_messages`."""
+    user_id = db.get_user_by_username(user["username"]).id
+    store = chatstore.ChatStore(user_id, max_messages=max_messages)
+    store.loaded = True
+    breaks = {"store": 0, "recent": 0}
+    previous = {}
+    for _ in range(turns):
+        question = rng.choice(QUESTIONS)
+        db.save_chat_message(user_id, "user", question)
+        store.append("user", question)
+        requests = {
+            "store": prompts.chat_messages(store.messages(), first_name=user["first_name"]),
+            "recent": prompts.chat_messages([prompts.system_message()] + chatstore.recent_messages(
+                user_id, max_messages=max_messages), first_name=user["first_name"]),
+        }
+        for name, request in requests.items():
+            last = previous.get(name)
+            if last is not None and prompts.prefix_fingerprint(request, len(last)) != prompts.prefix_fingerprint(last):
+                breaks[name] += 1
+            previous[name] = request
+        answer = " ".join(rng.choices(QUESTIONS[0].split(), k=40))
+        db.save_chat_message(user_id, "assistant", answer)
+        store.append("assistant", answer)
+    # One cut per half window of new turns, at most
+    allowed = -(-2 * turns // int(max_messages * chatstore.EVICT_TO))
+    return {"check": "window_prefix", "ok": max(breaks.values()) <= allowed,
+            "detail": f"{turns} turns, window {max_messages}: prefix changed on {breaks['store']} (session) and "
+                      f"{breaks['recent']} (recent_messages) turns, allowed {allowed}"}
+
+
+# =========================
+# TTFT ON LONG SESSIONS
+# =========================
+def replay(build, users, turns, rng, max_tokens, pause):
+    """Interleaved sessions, one turn per user in rotation. Returns [(turn, ttft seconds)]."""
+    histories = [[prompts.system_message()] for _ in users]
+    samples = []
+    for turn in range(1, turns + 1):
+        if turn > 1:
+            time.sleep(pause)
+        for user, history in zip(users, histories):
+            history.append({"role": "user", "content": rng.choice(QUESTIONS)})
+            start = time.perf_counter()
+            first = None
+            answer = []
+            for chunk in llm.llm_chat(build(user, history), max_tokens=max_tokens, cache=False):
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    first = first or time.perf_counter()
+                    answer.append(delta)
+            samples.append((turn, first - start))
+            history.append({"role": "assistant", "content": "".join(answer)})
+    return samples
+
+
+def summarize(samples):
+    out = {}
+    for lo, hi in BUCKETS:
+        values = sorted(t for turn, t in samples if lo <= turn <= hi)
+        if values:
+            label = f"turn {lo}" if lo == hi else f"turns {lo}-{hi}" if hi < 10**6 else f"turns {lo}+"
+            out[label] = {"n": len(values), "p50_ms": round(percentile(values, 50) * 1000, 1),
+                          "p95_ms": round(percentile(values, 95) * 1000, 1)}
+    values = sorted(t for _, t in samples)
+    out["all"] = {"n": len(values), "p50_ms": round(percentile(values, 50) * 1000, 1),
+                  "p95_ms": round(percentile(values, 95) * 1000, 1)}
+    return out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prompt prefix stability and TTFT")
+    parser.add_argument("--users", type=int, default=6)
+    parser.add_argument("--turns", type=int, default=30)
+    parser.add_argument("--ttft", type=float, default=0.02, help="mock base time to first token")
+    parser.add_argument("--prefill-per-token", type=float, default=0.0002,
+                        help="mock seconds per uncached prompt token (0.0002 = 5k tokens/s)")
+    parser.add_argument("--prefix-cache-ttl", type=float, default=1.0,
+                        help="mock seconds a prefix stays cached after its last use (0 = forever)")
+    parser.add_argument("--pause", type=float, default=1.2, help="seconds between rounds of turns")
+    parser.add_argument("--max-tokens", type=int, default=60)
+    parser.add_argument("--seed", type=int, default=5)
+    parser.add_argument("--out", default="prompt_prefix.json")
+    args = parser.parse_args(argv)
+
+    from openai import OpenAI
+    from mock_llm_server import MockConfig, MockLLMServer
+
+    users = make_users(args.users)
+    tmpdir = tempfile.TemporaryDirectory(prefix="vyapar-prefix-bench-")
+    db.DB_PATH = os.path.join(tmpdir.name, "users.db")
+    db.init_db()
+    db.register_user(users[0]["username"], "pw", users[0]["first_name"], users[0]["last_name"])
+
+    check_results = checks(users, min(args.turns, 10), random.Random(args.seed))
+    check_results.append(window_checks(users[0], max(args.turns, 60), random.Random(args.seed)))
+    for c in check_results:
+        print(f"{'ok  ' if c['ok'] else 'FAIL'} {c['check']} {c['detail']}")
+
+    ratelimit.controller = ratelimit.AdmissionController(default_tier="unlimited", global_tpm=0, persist=False)
+    results = []
+    for name, build, prefix_cache in (("stable", stable_request, True), ("legacy", legacy_request, True),
+                                      ("stable_nocache", stable_request, False)):
+        server = MockLLMServer(MockConfig(ttft=args.ttft, inter_token_delay=0.0, completion_tokens=args.max_tokens,
+                                          prefill_per_token=args.prefill_per_token,
+                                          prefix_cache=prefix_cache,
+                                          prefix_cache_ttl=args.prefix_cache_ttl)).start()
+        llm.client = OpenAI(api_key="mock", base_url=server.base_url)
+        try:
+            samples = replay(build, users, args.turns, random.Random(args.seed), args.max_tokens, args.pause)
+            stats = server.snapshot_stats()
+        finally:
+            server.stop()
+        result = {"layout": name, "prefix_cache": prefix_cache, "ttft": summarize(samples),
+                  "prompt_tokens": stats.get("prompt_tokens", 0),
+                  "cached_share": round(stats.get("cached_prompt_tokens", 0) / max(1, stats.get("prompt_tokens", 0)), 3)}
+        results.append(result)
+        buckets = "  ".join(f"{k} p50 {v['p50_ms']}ms" for k, v in result["ttft"].items() if k != "all")
+        print(f"{name:>15}: cached {result['cached_share']:.0%} of {result['prompt_tokens']:,} prompt tokens  "
+              f"TTFT p50 {result['ttft']['all']['p50_ms']}ms p95 {result['ttft']['all']['p95_ms']}ms  [{buckets}]")
+
+    # Drain background usage accounting while the database still exists
+    usage.recorder.flush()
+    tmpdir.cleanup()
+
+    report = {
+        "meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "git_commit": git_commit(), "args": vars(args),
+                 "static_fingerprint": prompts.STATIC_FINGERPRINT},
+        "checks": check_results,
+        "results": results,
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"report written to {args.out}")
+    return 0 if all(c["ok"] for c in check_results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
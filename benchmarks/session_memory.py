@@ -0,0 +1,196 @@
+"""Memory of N simulated chat sessions: the bounded ChatStore (chatstore.py) against the old list.
+
+Generates a users.db with benchmarks.synthetic_db (--history messages per
+user on average), then, in a fresh child process per variant, opens
+--sessions sessions the way the chat page does: the newest 50 turns are
+loaded, then --turns question/answer pairs are added, a --doc-fraction of
+them document explanations (an Explain Document prompt of up to 8,000 chars
+and its answer):
+
+    list    st.session_state.messages before: a list of {"role", "content"} dicts
+            that keeps every turn
+    store   chatstore.ChatStore: a bounded window of slotted records, long
+            messages compressed, older turns paged from the DB
+
+and reports the bytes the sessions hold (sizes of the objects reachable from
+them), RSS growth over the child's baseline, and the per-session cost of
+what a Streamlit rerun does with them: rendering every turn and building the
+next prompt (prompts.chat_messages).
+
+    python -m benchmarks.session_memory --sessions 300 --turns 30 --out session_memory.json
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import chatstore
+import db
+import prompts
+from benchmarks import synthetic_db
+
+VARIANTS = ("list", "store")
+WINDOW = 50  # app.HISTORY_WINDOW
+
+
+def make_turns(texts, turns, doc_fraction):
+    out = []
+    for _ in range(turns):
+        if texts.rng.random() < doc_fraction:
+            out += [("user", texts.document_prompt()), ("assistant", texts.answer(1800))]
+        else:
+            out += [("user", texts.question()), ("assistant", texts.answer())]
+    return out
+
+
+def held_bytes(session):
+    if isinstance(session, list):
+        return sys.getsizeof(session) + sum(sys.getsizeof(m) + sys.getsizeof(m["content"]) for m in session)
+    return (sys.getsizeof(session) + sys.getsizeof(session._window)
+            + sum(sys.getsizeof(m) + sys.getsizeof(m._data) for m in session))
+
+
+def open_session(variant, user_id, turns):
+    if variant == "list":
+        messages, _ = db.load_chat_window(user_id, WINDOW)
+        session = [prompts.system_message()] + messages
+        for role, content in turns:
+            session.append({"role": role, "content": content})
+        return session
+    session = chatstore.ChatStore(user_id)
+    session.load(WINDOW)
+    for role, content in turns:
+        session.append(role, content)
+    return session
+
+
+def render(variant, session):
+    if variant == "list":
+        return sum(len(m["content"]) for m in session[1:])
+    return sum(len(m.content) for m in session)
+
+
+def history(variant, session):
+    return session if variant == "list" else session.messages()
+
+
+# =========================
+# CHILD PROCESS
+# =========================
+def child(args):
+    db.DB_PATH = args.db
+    rng = random.Random(args.seed)
+    texts = synthetic_db.TextSource(rng, synthetic_db.make_corpus(rng, 4 * 2**20, 20000))
+    users = rng.sample(range(1, args.users + 1), min(args.sessions, args.users))
+    gc.collect()
+    baseline_mb = _status_mb("VmRSS")
+
+    sessions = []
+    generated = 0
+    start = time.perf_counter()
+    for n in range(args.sessions):
+        turns = make_turns(texts, args.turns, args.doc_fraction)
+        generated += sum(len(content) for _, content in turns)
+        sessions.append(open_session(args.variant, users[n % len(users)], turns))
+    open_seconds = time.perf_counter() - start
+    gc.collect()
+    rss_mb = _status_mb("VmRSS") - baseline_mb
+
+    start = time.perf_counter()
+    for session in sessions:
+        render(args.variant, session)
+    render_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    for session in sessions:
+        prompts.chat_messages(history(args.variant, session), first_name="Asha")
+    prompt_seconds = time.perf_counter() - start
+
+    held = sum(held_bytes(session) for session in sessions)
+    print(json.dumps({
+        "variant": args.variant,
+        "sessions": args.sessions,
+        "messages_in_memory": sum(len(s) for s in sessions) - (len(sessions) if args.variant == "list" else 0),
+        "generated_mb": round(generated / 2**20, 1),
+        "held_mb": round(held / 2**20, 2),
+        "held_kb_per_session": round(held / 1024 / args.sessions, 1),
+        "rss_growth_mb": round(rss_mb, 1),
+        "open_ms_per_session": round(open_seconds * 1000 / args.sessions, 2),
+        "render_ms_per_session": round(render_seconds * 1000 / args.sessions, 3),
+        "prompt_ms_per_session": round(prompt_seconds * 1000 / args.sessions, 3),
+    }))
+
+
+def _status_mb(field):
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def run_child(args, variant, db_path):
+    out = subprocess.run(
+        [sys.executable, "-m", "benchmarks.session_memory", "--child", "--variant", variant, "--db", db_path,
+         "--sessions", str(args.sessions), "--users", str(args.users), "--turns", str(args.turns),
+         "--doc-fraction", str(args.doc_fraction), "--seed", str(args.seed)],
+        capture_output=True, text=True, check=True, env=dict(os.environ, VYAPAR_CACHE_PATH=""))
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Memory of simulated chat sessions")
+    parser.add_argument("--sessions", type=int, default=300)
+    parser.add_argument("--users", type=int, default=2000, help="users in the generated users.db")
+    parser.add_argument("--history", type=float, default=80, help="mean stored messages per user")
+    parser.add_argument("--turns", type=int, default=30, help="question/answer pairs added per session")
+    parser.add_argument("--doc-fraction", type=float, default=0.3, help="share of pairs that explain a document")
+    parser.add_argument("--seed", type=int, default=5)
+    parser.add_argument("--out", default="session_memory.json")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--variant", choices=VARIANTS, help=argparse.SUPPRESS)
+    parser.add_argument("--db", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        child(args)
+        return 0
+
+    from benchmarks.loadtest import git_commit
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="vyapar-session-bench-") as tmp:
+        db_path = os.path.join(tmp, "users.db")
+        synthetic_db.main(["--db", db_path, "--users", str(args.users), "--active", "1",
+                           "--turns-per-user", str(args.history), "--days", "90", "--seed", str(args.seed),
+                           "--out", os.path.join(tmp, "synthetic_db.json")])
+        for variant in VARIANTS:
+            result = run_child(args, variant, db_path)
+            results.append(result)
+            print(f"{variant:>6}: {result['held_mb']:>7} MB held ({result['held_kb_per_session']} KB/session, "
+                  f"{result['messages_in_memory']:,} messages), RSS +{result['rss_growth_mb']} MB; per session "
+                  f"render {result['render_ms_per_session']} ms, prompt {result['prompt_ms_per_session']} ms")
+
+    old, new = results
+    summary = {"held_reduction": round(1 - new["held_mb"] / old["held_mb"], 3),
+               "rss_reduction": round(1 - new["rss_growth_mb"] / old["rss_growth_mb"], 3)
+               if old["rss_growth_mb"] > 0 else None}
+    print(f"store holds {summary['held_reduction']:.0%} less than the list"
+          + (f", RSS growth {summary['rss_reduction']:.0%} less" if summary["rss_reduction"] is not None else ""))
+    report = {
+        "meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "git_commit": git_commit(), "args": vars(args),
+                 "max_messages": chatstore.MAX_MESSAGES, "max_chars": chatstore.MAX_CHARS},
+        "summary": summary,
+        "results": results,
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"report written to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
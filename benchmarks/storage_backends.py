@@ -0,0 +1,303 @@
+"""Conformance checks and throughput for the storage backends (storage.py).
+
+Every backend runs the same conformance checks against the Repository
+interface (users, reset tokens, sessions and API tokens, chat history,
+concurrent group commits), then the same throughput workloads. SQLite
+always runs, on a temporary file. PostgreSQL runs when a server is given;
+a throwaway local one is enough:
+
+    docker run --rm -e POSTGRES_PASSWORD=pw -p 5432:5432 postgres:16
+    python -m benchmarks.storage_backends --pg-url postgresql://postgres:pw@localhost/postgres
+
+Conformance data on PostgreSQL goes under a random username prefix, so a
+shared database is fine. The exit status is 1 if any check fails.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import db
+import storage
+from benchmarks.loadtest import git_commit, percentile
+
+
+# =========================
+# CONFORMANCE
+# =========================
+class Checks:
+    def __init__(self, repo, prefix):
+        self.repo = repo
+        self.prefix = prefix
+        self.results = []
+
+    def user(self, name):
+        username = f"{self.prefix}_{name}"
+        assert self.repo.create_user(username, db.hash_password("pw"), "First", name, f"{name}@x.in", "99")
+        return self.repo.get_user_by_username(username)[0]
+
+    def run(self):
+        for name in [n for n in dir(self) if n.startswith("check_")]:
+            try:
+                getattr(self, name)()
+                self.results.append((name[6:], None))
+            except Exception as e:
+                self.results.append((name[6:], f"{type(e).__name__}: {e}"))
+        return self.results
+
+    def check_users(self):
+        username = f"{self.prefix}_asha"
+        assert self.repo.create_user(username, db.hash_password("pw"), "Asha", "Rao", "a@x.in", "98")
+        assert not self.repo.create_user(username, "x", "", "", "", ""), "duplicate username accepted"
+        row = self.repo.get_user_by_username(username)
+        user = db.UserRecord.from_row(row)
+        assert (user.username, user.first_name, user.email) == (username, "Asha", "a@x.in"), row
+        assert time.strptime(user.created_at, "%Y-%m-%d %H:%M:%S"), user.created_at
+        assert self.repo.get_user(user.id) == row
+        assert self.repo.get_user(-1) is None and self.repo.get_user_by_username(f"{self.prefix}_nobody") is None
+
+    def check_reset_tokens(self):
+        user_id = self.user("reset")
+        now = time.time()
+        self.repo.create_reset_token(user_id, f"{self.prefix}-live", now + 3600)
+        self.repo.create_reset_token(user_id, f"{self.prefix}-expired", now - 1)
+        assert self.repo.reset_token_user_id(f"{self.prefix}-live", now) == user_id
+        assert self.repo.reset_token_user_id(f"{self.prefix}-expired", now) is None
+        assert self.repo.reset_token_user_id(f"{self.prefix}-unknown", now) is None
+        self.repo.add_token("session", f"{self.prefix}-reset-session", user_id, now, now + 60)
+        self.repo.set_password(user_id, db.hash_password("new"))
+        assert self.repo.get_user(user_id)[2] == db.hash_password("new")
+        assert self.repo.reset_token_user_id(f"{self.prefix}-live", now) is None, "token usable after reset"
+        assert self.repo.token_user_id("session", f"{self.prefix}-reset-session", now) is None, "session survived reset"
+
+    def check_tokens(self):
+        user_id = self.user("tokens")
+        now = time.time()
+        for kind in storage.TOKEN_TABLES:
+            live, old = f"{self.prefix}-{kind}-live", f"{self.prefix}-{kind}-old"
+            self.repo.add_token(kind, old, user_id, now - 120, now - 60)
+            self.repo.add_token(kind, live, user_id, now, now + 60)
+            assert self.repo.token_user_id(kind, live, now) == user_id
+            assert self.repo.token_user_id(kind, old, now) is None
+            assert self.repo.token_user_id(kind, live, now + 120) is None, "expired token accepted"
+            self.repo.delete_token(kind, live)
+            assert self.repo.token_user_id(kind, live, now) is None
+
+    def check_chat_history(self):
+        user_id, other = self.user("chat"), self.user("chat_other")
+        big = "नमस्ते GST " * 400  # over the SQLite blob threshold, non-ASCII
+        self.repo.save_chat_message(user_id, "user", "first")
+        self.repo.save_chat_messages([(user_id, "assistant", big), (other, "user", "elsewhere"),
+                                      (user_id, "user", "third")])
+        self.repo.save_chat_message(user_id, "assistant", big)
+        expected = ["first", big, "third", big]
+        history = self.repo.load_chat_history(user_id)
+        assert [m["content"] for m in history] == expected, [m["content"][:10] for m in history]
+        assert [m["role"] for m in history] == ["user", "assistant", "user", "assistant"]
+        assert self.repo.count_chat_messages(user_id) == 4
+        streamed = list(self.repo.iter_chat_history(user_id))
+        assert [m["content"] for m in streamed] == expected
+        assert all(time.strptime(m["timestamp"], "%Y-%m-%d %H:%M:%S") for m in streamed)
+        self.repo.clear_chat_history(user_id)
+        assert self.repo.load_chat_history(user_id) == [] and self.repo.count_chat_messages(user_id) == 0
+        assert [m["content"] for m in self.repo.load_chat_history(other)] == ["elsewhere"]
+
+    def check_history_stream(self):
+        user_id = self.user("stream")
+        turns = storage.ITER_PAGE * 2 + 10
+        self.repo.save_chat_messages([(user_id, "user", f"turn {i}") for i in range(turns)])
+        stream = self.repo.iter_chat_history(user_id)
+        seen = [next(stream)["content"]]
+        # A paused export must not keep a pooled connection checked out
+        assert self.repo.pool._idle.qsize() == self.repo.pool._opened, "stream holds a pool connection"
+        seen += [m["content"] for m in stream]
+        assert seen == [f"turn {i}" for i in range(turns)], (len(seen), seen[-1])
+
+    def check_chat_window(self):
+        user_id = self.user("window")
+        self.repo.save_chat_messages([(user_id, "user", f"turn {i}") for i in range(23)])
+        seen, before = [], None
+        while True:
+            messages, oldest_id = self.repo.load_chat_window(user_id, 10, before)
+            if not messages:
+                assert oldest_id is None
+                break
+            assert len(messages) <= 10
+            seen[:0] = [m["content"] for m in messages]
+            before = oldest_id
+        assert seen == [f"turn {i}" for i in range(23)], seen
+
+    def check_concurrent_group_commit(self):
+        users = [self.user(f"gc{i}") for i in range(8)]
+        errors = []
+
+        def writer(user_id):
+            try:
+                for i in range(40):
+                    self.repo.save_chat_message(user_id, "user", f"{user_id}:{i}")
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=writer, args=(u,)) for u in users]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert not errors, errors
+        for user_id in users:
+            assert [m["content"] for m in self.repo.load_chat_history(user_id)] == [f"{user_id}:{i}" for i in range(40)]
+
+    def check_bad_write_isolated(self):
+        user_id = self.user("isolation")
+        failures = []
+
+        def write(role, content):
+            try:
+                self.repo.save_chat_message(user_id, role, content)
+            except Exception as e:
+                failures.append(e)
+
+        # A NULL role violates NOT NULL; the good writes sharing its commit must still land
+        threads = [threading.Thread(target=write, args=(role, f"m{i}"))
+                   for i, role in enumerate(["user", None, "user", "assistant"] * 5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len(failures) == 5, failures
+        assert self.repo.count_chat_messages(user_id) == 15
+
+    def check_pool_under_contention(self):
+        user_id = self.user("pool")
+        out = []
+        threads = [threading.Thread(target=lambda: out.append(self.repo.get_user(user_id)))
+                   for _ in range(self.repo.pool.size * 4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len(out) == self.repo.pool.size * 4 and all(r[0] == user_id for r in out)
+        assert self.repo.pool._opened <= self.repo.pool.size
+
+
+# =========================
+# THROUGHPUT
+# =========================
+def timed_threads(threads, per_thread, fn):
+    """Run fn(thread_index, i) per_thread times on each of `threads` threads; (ops/s, p50 ms, p95 ms)."""
+    latencies = [[] for _ in range(threads)]
+    barrier = threading.Barrier(threads + 1)
+
+    def run(t):
+        barrier.wait()
+        for i in range(per_thread):
+            start = time.perf_counter()
+            fn(t, i)
+            latencies[t].append((time.perf_counter() - start) * 1000)
+
+    workers = [threading.Thread(target=run, args=(t,)) for t in range(threads)]
+    for w in workers:
+        w.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+    merged = sorted(x for lat in latencies for x in lat)
+    return {"ops_per_s": round(threads * per_thread / elapsed, 1),
+            "p50_ms": round(percentile(merged, 50), 3), "p95_ms": round(percentile(merged, 95), 3)}
+
+
+def throughput(repo, make_repo, args, prefix):
+    users = []
+    for i in range(args.threads):
+        username = f"{prefix}_tp{i}"
+        repo.create_user(username, db.hash_password("pw"), "Load", str(i), "", "")
+        users.append(repo.get_user_by_username(username)[0])
+    text = "What is the due date for GSTR-3B this quarter? " * 4
+    results = {}
+    results["chat_write_group_commit"] = timed_threads(
+        args.threads, args.ops, lambda t, i: repo.save_chat_message(users[t], "user", text))
+    single = make_repo(group_commit=1)
+    results["chat_write_commit_each"] = timed_threads(
+        args.threads, args.ops, lambda t, i: single.save_chat_message(users[t], "user", text))
+    single.close()
+    results["chat_write_batches_of_100"] = timed_threads(
+        1, max(1, args.ops * args.threads // 100),
+        lambda t, i: repo.save_chat_messages([(users[0], "user", text)] * 100))
+    results["chat_write_batches_of_100"]["rows_per_s"] = round(results["chat_write_batches_of_100"]["ops_per_s"] * 100, 1)
+    results["user_lookup"] = timed_threads(
+        args.threads, args.ops, lambda t, i: repo.get_user_by_username(f"{prefix}_tp{t}"))
+    results["history_window_50"] = timed_threads(
+        args.threads, args.ops, lambda t, i: repo.load_chat_window(users[t], 50))
+    if repo.kind == "sqlite":
+        # The pre-pool pattern: a fresh connection for every call
+        def unpooled(t, i):
+            conn = sqlite3.connect(repo.path)
+            conn.execute(f"SELECT {db.USER_COLUMNS} FROM users WHERE username = ?", (f"{prefix}_tp{t}",)).fetchone()
+            conn.close()
+        results["user_lookup_unpooled"] = timed_threads(args.threads, args.ops, unpooled)
+    return results
+
+
+# =========================
+# DRIVER
+# =========================
+def run_backend(name, make_repo, args):
+    repo = make_repo()
+    repo.init_schema()
+    prefix = f"conformance_{uuid.uuid4().hex[:8]}"
+    checks = Checks(repo, prefix).run()
+    failed = [(n, err) for n, err in checks if err]
+    print(f"{name}: {len(checks) - len(failed)}/{len(checks)} conformance checks passed")
+    for n, err in failed:
+        print(f"  FAIL {n}: {err}")
+    results = throughput(repo, make_repo, args, prefix)
+    for workload, r in results.items():
+        print(f"  {workload:>26}: {r['ops_per_s']:>9} ops/s  p50 {r['p50_ms']} ms  p95 {r['p95_ms']} ms")
+    repo.close()
+    return {"conformance": dict((n, err or "ok") for n, err in checks), "throughput": results}, not failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Storage backend conformance and throughput")
+    parser.add_argument("--pg-url", default=os.environ.get("VYAPAR_TEST_PG_URL"),
+                        help="PostgreSQL DSN to include (default $VYAPAR_TEST_PG_URL)")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--ops", type=int, default=200, help="operations per thread per workload")
+    parser.add_argument("--out", default="storage_backends.json")
+    args = parser.parse_args(argv)
+
+    report = {"meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "git_commit": git_commit(),
+                       "args": {k: v for k, v in vars(args).items() if k != "pg_url"}}}
+    ok = True
+    with tempfile.TemporaryDirectory(prefix="vyapar-storage-bench-") as tmp:
+        db.DB_PATH = os.path.join(tmp, "users.db")
+        db.init_db()
+        report["sqlite"], passed = run_backend(
+            "sqlite", lambda group_commit=storage.GROUP_COMMIT_MAX: db.SQLiteRepository(db.DB_PATH, group_commit=group_commit),
+            args)
+        ok = ok and passed
+        db.repository().close()
+    if args.pg_url:
+        report["postgresql"], passed = run_backend(
+            "postgresql",
+            lambda group_commit=storage.GROUP_COMMIT_MAX: storage.PostgresRepository(args.pg_url, group_commit=group_commit),
+            args)
+        ok = ok and passed
+    else:
+        print("postgresql: skipped (no --pg-url / VYAPAR_TEST_PG_URL)")
+
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"report written to {args.out}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
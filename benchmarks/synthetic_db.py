@@ -0,0 +1,385 @@
+"""Seedable synthetic users.db at production scale, for pagination, index and search benchmarks.
+
+Creates a new SQLite database in the current schema (db.init_db) and
+bulk-loads it:
+
+    users          --users accounts, Indian first/last names, email, phone; sign-ups
+                   grow over the --days timeline (more recent than early), all with
+                   the password --password
+    chat_history   an --active share of users chat, --turns-per-user turns on average
+                   with a long tail (log-normal), in sessions of a few question/answer
+                   pairs spread over the days after sign-up. Rows are written in time
+                   order across all users, so ids interleave as they do in production.
+                   Lengths: questions ~70 chars, answers ~700 (log-normal), and a
+                   --doc-fraction of questions are Explain Document prompts of up to
+                   8,000 chars of notice text (documents.document_summary_prompt),
+                   --shared-doc-fraction of those from a pool of --documents common
+                   circulars. Messages of db.BLOB_THRESHOLD bytes or more go to the
+                   blob store, compressed and refcounted, as save_chat_message does.
+    password_reset_tokens  a --reset-fraction of users asked for 1-3 resets; most are
+                   used or expired, the ones issued in the last hour are still valid
+
+Text is cut from a corpus of domain words and generated filler words with
+Zipf-like frequencies, so common and rare search terms both occur. The same
+--seed and --end produce the same database.
+
+Loading runs with journaling off and the secondary indexes dropped; they are
+rebuilt at the end, and the file is left in SQLite's default journal mode.
+A summary (row counts, length percentiles, blob store, time) goes to --out.
+
+    python -m benchmarks.synthetic_db --users 1000000 --db synthetic_users.db
+    python -m benchmarks.synthetic_db --users 20000 --turns-per-user 200 --seed 7 --end 2025-06-30
+"""
+import argparse
+import calendar
+import json
+import math
+import os
+import random
+import sqlite3
+import sys
+import time
+import uuid
+from array import array
+from hashlib import sha256
+
+import db
+import documents
+from benchmarks.loadtest import git_commit, percentile
+
+FIRST_NAMES = ("Aarav Aditi Akash Ananya Arjun Asha Deepak Divya Farhan Gaurav Geeta Harish Ishaan Kavya Kiran "
+               "Lakshmi Manoj Meera Mohan Neha Nikhil Pooja Priya Rahul Rajesh Ramesh Ravi Rohan Sanjay Shalini "
+               "Sneha Sunil Suresh Tanvi Uma Varun Vikram Vivek Yash Zoya").split()
+LAST_NAMES = ("Agarwal Bhat Chauhan Das Desai Gupta Iyer Jain Joshi Kapoor Khan Kulkarni Kumar Mehta Menon "
+              "Mishra Nair Patel Pillai Rao Reddy Saxena Shah Sharma Singh Sinha Thakur Trivedi Verma Yadav").split()
+DOMAIN_WORDS = ("gst invoice return filing gstr-1 gstr-3b input tax credit itc msme udyam registration loan "
+                "mudra cgtmse subsidy payroll tds tcs pan tan notice penalty interest late fee due date "
+                "quarterly monthly annual audit balance sheet profit turnover e-way bill hsn sac rate refund "
+                "export import lut gem tender trademark fssai shop establishment pf esi gratuity bonus "
+                "salary employee contract vendor customer payment bank account upi cash ledger reconciliation "
+                "composition scheme regular taxpayer demand order appeal section rule form reply within days "
+                "rupees lakh crore amount total outstanding assessment year financial period april march").split()
+STOP_WORDS = "the a an of to and in for is on with by my our this that what how can i we do it be".split()
+NOTICE_HEADS = (
+    "GOVERNMENT OF INDIA - GOODS AND SERVICES TAX DEPARTMENT",
+    "INCOME TAX DEPARTMENT - CENTRALIZED PROCESSING CENTRE",
+    "EMPLOYEES' PROVIDENT FUND ORGANISATION - REGIONAL OFFICE",
+    "OFFICE OF THE ASSISTANT COMMISSIONER OF STATE TAX",
+)
+DOC_MAX_CHARS = 8000  # the Explain Document prompt budget (documents.read_pdf_text)
+DAY = 86400
+
+
+# =========================
+# TEXT
+# =========================
+def make_corpus(rng, chars, vocabulary):
+    """A long string of words: domain and stop words, then `vocabulary` filler words, Zipf-weighted."""
+    syllables = "ka ra ta na ma sa la pa va da ja ga ha ni ri ti mi si li pi vi di ko ro to no mo so".split()
+    filler = set()
+    while len(filler) < vocabulary:
+        filler.add("".join(rng.choices(syllables, k=rng.randint(2, 4))))
+    words = STOP_WORDS + DOMAIN_WORDS + sorted(filler)
+    weights = [1 / (rank + 1) for rank in range(len(words))]
+    out, size = [], 0
+    while size < chars:
+        chunk = " ".join(rng.choices(words, weights, k=10000))
+        out.append(chunk)
+        size += len(chunk) + 1
+    return " ".join(out)
+
+
+class TextSource:
+    """Slices of the corpus at random word boundaries; log-normal lengths around a median."""
+
+    def __init__(self, rng, corpus):
+        self.rng = rng
+        self.corpus = corpus
+
+    def text(self, length):
+        # random() arithmetic: randrange/randint cost several times more, and this runs per message
+        start = self.corpus.find(" ", int(self.rng.random() * (len(self.corpus) - length - 64))) + 1
+        return self.corpus[start:start + length].rstrip()
+
+    def length(self, median, sigma, lo, hi):
+        return max(lo, min(hi, int(self.rng.lognormvariate(math.log(median), sigma))))
+
+    def question(self):
+        text = self.text(self.length(70, 0.8, 3, 4000))
+        return text[:1].upper() + text[1:] + "?"
+
+    def answer(self, median=700):
+        length = self.length(median, 0.7, 20, 12000)
+        paragraphs = []
+        while length > 0:
+            part = self.text(min(length, 150 + int(self.rng.random() * 250)))
+            paragraphs.append(part[:1].upper() + part[1:] + ".")
+            length -= len(part) + 2
+        return "\n\n".join(paragraphs)
+
+    def document_prompt(self):
+        """An Explain Document prompt: notice text of 1 to 20 pages, within the 8,000-char budget."""
+        rng = self.rng
+        page_count = min(20, 1 + int(rng.expovariate(1 / 3)))
+        gstin = (f"{rng.randint(1, 37):02d}{''.join(rng.choices('ABCDEFGHIJKLMNOPQRSTUVWXYZ', k=5))}"
+                 f"{rng.randint(0, 9999):04d}{rng.choice('ABCDEFGHJK')}{rng.randint(1, 9)}Z{rng.choice('ABCDE')}")
+        head = (f"{rng.choice(NOTICE_HEADS)}\nReference No. ZD{rng.randint(10**11, 10**12 - 1)}  "
+                f"Date: {rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/{rng.randint(2022, 2025)}\n"
+                f"GSTIN: {gstin}\nNotice under Section {rng.choice((73, 74, 122, 125, 50))} - "
+                f"amount of Rs. {rng.randint(1, 99)},{rng.randint(10, 99)},{rng.randint(100, 999)} is proposed\n")
+        chars = min(DOC_MAX_CHARS, int(page_count * rng.uniform(1500, 3000)))
+        text = head + self.text(max(0, chars - len(head)))
+        pages = None if page_count == 1 or rng.random() < 0.7 else (1, rng.randint(1, page_count))
+        return documents.document_summary_prompt(text, pages, page_count)
+
+
+# =========================
+# LOADING
+# =========================
+class BlobWriter:
+    """Rows for `blobs`, as db._put_blob would store them (one per distinct content, refcounted)."""
+
+    SQL = ("INSERT INTO blobs (hash, codec, size, data, refcount, created_at) VALUES (?, ?, ?, ?, 1, ?) "
+           "ON CONFLICT (hash) DO UPDATE SET refcount = refcount + 1")
+
+    def __init__(self):
+        self.rows = []
+        self.shared = {}  # content -> (hash, codec, size, data): pool documents are compressed once
+
+    def put(self, content, created_at, shared=False):
+        entry = self.shared.get(content) if shared else None
+        if entry is None:
+            raw = content.encode("utf-8")
+            codec, data = db.compress(raw)
+            entry = (sha256(raw).hexdigest(), codec, len(raw), data)
+            if shared:
+                self.shared[content] = entry
+        self.rows.append((*entry, created_at))
+        return entry[0]
+
+    def flush(self, c):
+        c.executemany(self.SQL, self.rows)
+        self.rows = []
+
+
+def _timestamp(epoch):
+    # The format of SQLite's CURRENT_TIMESTAMP (UTC), the chat_history.timestamp default
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(epoch))
+
+
+def drop_indexes(c, tables):
+    """Drop the secondary indexes of `tables`; returns their CREATE statements."""
+    marks = ",".join("?" * len(tables))
+    rows = c.execute(f"SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL "
+                     f"AND tbl_name IN ({marks})", tables).fetchall()
+    for name, _ in rows:
+        c.execute(f"DROP INDEX {name}")
+    return [sql for _, sql in rows]
+
+
+def load_users(c, args, rng, start):
+    """Insert users 1..N; returns each one's sign-up time (seconds into the timeline)."""
+    password = db.hash_password(args.password)
+    signed_up = array("d")
+    batch = []
+    span = args.days * DAY
+    for user_id in range(1, args.users + 1):
+        # P(signed up before t) = (t/span)^2: the user base grew over the timeline
+        joined = span * math.sqrt(rng.random())
+        signed_up.append(joined)
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        username = f"{first}.{last}{user_id}".lower()
+        batch.append((user_id, username, password, first, last, f"{username}@example.com",
+                      f"+91{rng.randint(6000000000, 9999999999)}", _timestamp(start + joined)))
+        if len(batch) == args.batch:
+            c.executemany("INSERT INTO users (id, username, password, first_name, last_name, email, phone, "
+                          "created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", batch)
+            batch = []
+    c.executemany("INSERT INTO users (id, username, password, first_name, last_name, email, phone, created_at) "
+                  "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", batch)
+    return signed_up
+
+
+def plan_sessions(args, rng, signed_up):
+    """Per day of the timeline: the (user, question/answer pairs) chat sessions that start on it."""
+    days_users = [array("l") for _ in range(args.days)]
+    days_pairs = [array("H") for _ in range(args.days)]
+    mean_pairs = max(args.turns_per_user / 2 / args.active, 0.5)
+    sigma = args.turns_sigma
+    mu = math.log(mean_pairs) - sigma * sigma / 2
+    for user_id in range(1, args.users + 1):
+        if rng.random() >= args.active:
+            continue
+        pairs = max(1, round(rng.lognormvariate(mu, sigma)))
+        first_day = int(signed_up[user_id - 1] // DAY)
+        while pairs > 0:
+            n = min(pairs, 1 + int(rng.expovariate(1 / 2)), 65535)
+            day = rng.randint(first_day, args.days - 1)
+            days_users[day].append(user_id)
+            days_pairs[day].append(n)
+            pairs -= n
+    return days_users, days_pairs
+
+
+def load_chat(c, args, rng, texts, start, days_users, days_pairs, stats):
+    blobs = BlobWriter()
+    pool = [texts.document_prompt() for _ in range(args.documents)]
+    for day in range(args.days):
+        rows = []
+        for user_id, pairs in zip(days_users[day], days_pairs[day]):
+            t = start + day * DAY + rng.randrange(DAY - 600)
+            for _ in range(pairs):
+                if rng.random() < args.doc_fraction:
+                    shared = bool(pool) and rng.random() < args.shared_doc_fraction
+                    question = rng.choice(pool) if shared else texts.document_prompt()
+                    answer = texts.answer(1800)
+                    stats["document_prompts"] += 1
+                else:
+                    shared, question, answer = False, texts.question(), texts.answer()
+                rows.append((t, user_id, "user", question, shared))
+                t += rng.uniform(5, 40)
+                rows.append((t, user_id, "assistant", answer, False))
+                t += rng.uniform(30, 600)
+        rows.sort(key=lambda row: row[0])
+        inserts = []
+        for n, (t, user_id, role, content, shared) in enumerate(rows):
+            if n % 100 == 0:
+                stats["lengths"].append(len(content))
+            blob_hash = None
+            if len(content) >= db.BLOB_THRESHOLD:
+                blob_hash = blobs.put(content, t, shared)
+                content = ""
+            inserts.append((user_id, role, content, _timestamp(t), blob_hash))
+        blobs.flush(c)
+        for i in range(0, len(inserts), args.batch):
+            c.executemany("INSERT INTO chat_history (user_id, role, content, timestamp, blob_hash) "
+                          "VALUES (?, ?, ?, ?, ?)", inserts[i:i + args.batch])
+        stats["messages"] += len(inserts)
+        if day % 30 == 29 or day == args.days - 1:
+            print(f"  day {day + 1}/{args.days}: {stats['messages']:,} messages", flush=True)
+
+
+def load_reset_tokens(c, args, rng, start, signed_up):
+    end = start + args.days * DAY
+    tokens = []
+    for user_id in range(1, args.users + 1):
+        if rng.random() >= args.reset_fraction:
+            continue
+        for _ in range(rng.randint(1, 3)):
+            issued = rng.uniform(start + signed_up[user_id - 1], end)
+            expires_at = issued + 3600
+            used = expires_at < end and rng.random() < 0.7
+            tokens.append((issued, user_id, str(uuid.UUID(int=rng.getrandbits(128), version=4)), expires_at, used))
+    tokens.sort()
+    c.executemany("INSERT INTO password_reset_tokens (user_id, token, expires_at, used) VALUES (?, ?, ?, ?)",
+                  [row[1:] for row in tokens])
+    return len(tokens)
+
+
+# =========================
+# MAIN
+# =========================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a large synthetic users.db")
+    parser.add_argument("--db", default="synthetic_users.db", help="database file to create")
+    parser.add_argument("--force", action="store_true", help="replace --db if it exists")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--active", type=float, default=0.7, help="share of users with chat history")
+    parser.add_argument("--turns-per-user", type=float, default=20, help="mean chat messages per user")
+    parser.add_argument("--turns-sigma", type=float, default=1.3, help="log-normal spread of messages per user")
+    parser.add_argument("--doc-fraction", type=float, default=0.03, help="share of questions that explain a document")
+    parser.add_argument("--shared-doc-fraction", type=float, default=0.2,
+                        help="share of document prompts drawn from the common pool")
+    parser.add_argument("--documents", type=int, default=200, help="common documents in the pool")
+    parser.add_argument("--reset-fraction", type=float, default=0.05, help="share of users with reset tokens")
+    parser.add_argument("--days", type=int, default=365, help="length of the timeline")
+    parser.add_argument("--end", default="", help="last day of the timeline, YYYY-MM-DD (default: now)")
+    parser.add_argument("--password", default="synthetic", help="password of every generated user")
+    parser.add_argument("--vocabulary", type=int, default=20000, help="filler words besides the domain words")
+    parser.add_argument("--batch", type=int, default=50000, help="rows per executemany")
+    parser.add_argument("--out", default="synthetic_db.json")
+    args = parser.parse_args(argv)
+    if os.environ.get("VYAPAR_DATABASE_URL"):
+        parser.error("VYAPAR_DATABASE_URL is set; this generator only writes SQLite files")
+    if not 0 < args.active <= 1 or args.days < 1 or args.users < 1:
+        parser.error("--users and --days must be positive and --active in (0, 1]")
+    if os.path.exists(args.db):
+        if not args.force:
+            parser.error(f"{args.db} exists (use --force to replace it)")
+        for suffix in ("", "-journal", "-wal", "-shm"):
+            if os.path.exists(args.db + suffix):
+                os.remove(args.db + suffix)
+
+    end = calendar.timegm(time.strptime(args.end, "%Y-%m-%d")) + DAY if args.end else int(time.time())
+    start = end - args.days * DAY
+    rng = random.Random(args.seed)
+    began = time.perf_counter()
+
+    db.DB_PATH = args.db
+    db.init_db()
+    conn = sqlite3.connect(args.db)
+    c = conn.cursor()
+    c.execute("PRAGMA journal_mode = OFF")
+    c.execute("PRAGMA synchronous = OFF")
+    c.execute("PRAGMA cache_size = -262144")
+    indexes = drop_indexes(c, ("chat_history", "password_reset_tokens"))
+
+    stats = {"messages": 0, "document_prompts": 0, "lengths": []}
+    seconds = {}
+    step = time.perf_counter()
+    signed_up = load_users(c, args, rng, start)
+    conn.commit()
+    seconds["users"] = time.perf_counter() - step
+    print(f"{args.users:,} users", flush=True)
+
+    step = time.perf_counter()
+    texts = TextSource(rng, make_corpus(rng, 4 * 2**20, args.vocabulary))
+    days_users, days_pairs = plan_sessions(args, rng, signed_up)
+    load_chat(c, args, rng, texts, start, days_users, days_pairs, stats)
+    conn.commit()
+    seconds["chat_history"] = time.perf_counter() - step
+
+    step = time.perf_counter()
+    reset_tokens = load_reset_tokens(c, args, rng, start, signed_up)
+    conn.commit()
+    seconds["reset_tokens"] = time.perf_counter() - step
+
+    step = time.perf_counter()
+    for sql in indexes:
+        c.execute(sql)
+    conn.commit()
+    c.execute("PRAGMA journal_mode = DELETE")
+    seconds["indexes"] = time.perf_counter() - step
+    conn.close()
+    total = time.perf_counter() - began
+
+    lengths = sorted(stats["lengths"])
+    summary = {
+        "users": args.users,
+        "messages": stats["messages"],
+        "document_prompts": stats["document_prompts"],
+        "reset_tokens": reset_tokens,
+        "message_chars_sampled": {f"p{p}": percentile(lengths, p) for p in (50, 90, 99)},
+        "blobs": db.blob_stats(),
+        "timeline": [_timestamp(start), _timestamp(end)],
+        "db_mb": round(os.path.getsize(args.db) / 2**20, 1),
+        "seconds": {**{k: round(v, 1) for k, v in seconds.items()}, "total": round(total, 1)},
+        "rows_per_second": round((args.users + stats["messages"] + reset_tokens) / total),
+    }
+    print(f"{args.db}: {args.users:,} users, {stats['messages']:,} messages "
+          f"({stats['document_prompts']:,} document prompts, {summary['blobs']['blobs']:,} blobs), "
+          f"{reset_tokens:,} reset tokens, {summary['db_mb']} MB in {total:.0f}s "
+          f"({summary['rows_per_second']:,} rows/s)")
+
+    report = {"meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "git_commit": git_commit(),
+                       "args": vars(args)},
+              "summary": summary}
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"report written to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,206 @@
+"""Peak memory of one large PDF upload (uploads.py) against the old in-memory path.
+
+Generates a scanned-looking notice (a text line plus a full-page noise image
+per page, --mb megabytes in all) and follows it through both entry points,
+each in a fresh child process so the high-water mark covers one upload:
+
+    app   an UploadedFile (already in memory) -> page count and page 1 for the
+          preview -> an explain job with the file as input -> the worker reads
+          the input back and extracts the chosen pages
+          old: getvalue(), BytesIO readers, job input bound and selected as one bytes value
+          new: uploads.from_file in place, job input written and read as a blob
+               in chunks, the worker parses a spool file through mmap
+    api   a request body read from a socket (a file here) -> text extraction
+          old: the whole body read into bytes, a BytesIO reader
+          new: uploads.from_stream spools it in chunks, an mmap reader
+
+and reports peak RSS over the child's baseline (the UploadedFile counts in
+the app baseline: Streamlit holds it either way) and time. Pages of a
+mapped spool file count towards RSS while PyPDF2 reads them, but they are
+page cache the kernel can drop, not private memory: the anonymous/file
+split at the end of the run shows which is which.
+
+    python -m benchmarks.upload_rss --mb 40 --out upload_rss.json
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+import db
+import documents
+import jobs
+import uploads
+
+SCENARIOS = ("app_old", "app_new", "api_old", "api_new")
+
+
+def make_scan(path, mb, rng):
+    """A PDF of noise images (incompressible, like a scan) of about `mb` megabytes."""
+    from PIL import Image
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.utils import ImageReader
+    from reportlab.pdfgen import canvas
+
+    side = 900  # 900x900 RGB is about 2.9 MB a page once ASCII85-encoded
+    pdf = canvas.Canvas(path, pagesize=A4)
+    for page in range(max(1, round(mb * 2**20 / (side * side * 3 * 1.25)))):
+        image = Image.frombytes("RGB", (side, side), rng.randbytes(side * side * 3))
+        pdf.setFont("Helvetica", 9)
+        pdf.drawString(40, 810, f"page {page + 1} demand notice under section 73 gstin 27AAAAA0000A1Z5")
+        pdf.drawImage(ImageReader(image), 40, 60, width=515, height=515)
+        pdf.showPage()
+    pdf.save()
+
+
+def legacy_text(data, pages, max_chars=8000):
+    """The extraction before PdfDocument: a BytesIO reader over a private copy."""
+    reader = documents.PyPDF2.PdfReader(BytesIO(data))
+    first, last = pages
+    text = "\n".join(reader.pages[n - 1].extract_text() or "" for n in range(first, last + 1))
+    return len(reader.pages), text[:max_chars]
+
+
+# =========================
+# SCENARIOS (child process)
+# =========================
+def app_old(path):
+    with open(path, "rb") as f:
+        uploaded_file = BytesIO(f.read())
+    yield
+    data = uploaded_file.getvalue()
+    legacy_text(data, (1, 1))
+    job_id = _legacy_enqueue(data)
+    del data
+    conn = db.get_connection()
+    (job_input,) = conn.execute("SELECT input FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    conn.close()
+    legacy_text(job_input, (1, 2))
+
+
+def _legacy_enqueue(data):
+    conn = db.get_connection()
+    c = conn.execute("INSERT INTO jobs (user_id, kind, params, input, max_attempts, run_after, created_at, updated_at)"
+                     " VALUES (1, 'explain', '{}', ?, 3, 0, 0, 0)", (data,))
+    conn.commit()
+    conn.close()
+    return c.lastrowid
+
+
+def app_new(path):
+    with open(path, "rb") as f:
+        uploaded_file = BytesIO(f.read())
+    yield
+    doc = documents.PdfDocument(uploads.from_file(uploaded_file))
+    doc.page_count
+    doc.page_text(1)
+    job = jobs.get(jobs.enqueue(1, "explain", {"pages": "1-2"}, doc.upload))
+    with jobs.open_input(job) as upload:
+        documents.read_pdf_text(upload, pages=(1, 2))
+        documents.PdfDocument(upload).page_count
+
+
+def api_old(path):
+    with open(path, "rb") as sock:
+        yield
+        body = sock.read()
+    legacy_text(body, (1, 2))
+
+
+def api_new(path):
+    with open(path, "rb") as sock:
+        yield
+        upload = uploads.from_stream(sock)
+    with upload:
+        documents.PdfDocument(upload).text((1, 2), 8000)
+
+
+def child(args):
+    db.DB_PATH = args.db
+    steps = globals()[args.scenario](args.pdf)
+    next(steps)
+    baseline_mb = _status_mb("VmHWM")
+    start = time.perf_counter()
+    for _ in steps:
+        pass
+    print(json.dumps({
+        "scenario": args.scenario,
+        "seconds": round(time.perf_counter() - start, 2),
+        "baseline_rss_mb": round(baseline_mb, 1),
+        "peak_rss_mb": round(_status_mb("VmHWM"), 1),
+        # At the end: mmap'd spool pages are file-backed (page cache), not private memory
+        "anon_rss_mb": round(_status_mb("RssAnon"), 1),
+        "file_rss_mb": round(_status_mb("RssFile"), 1),
+        "spool_files": len([f for f in os.listdir(uploads.UPLOAD_DIR or tempfile.gettempdir())
+                            if f.startswith("vyapar-upload-")]),
+    }))
+
+
+def _status_mb(field):
+    # VmHWM starts over at exec; ru_maxrss would carry the parent's peak across fork+exec
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def run_child(scenario, pdf, db_path):
+    env = dict(os.environ, VYAPAR_CACHE_PATH="")
+    out = subprocess.run(
+        [sys.executable, "-m", "benchmarks.upload_rss", "--child", "--scenario", scenario,
+         "--pdf", pdf, "--db", db_path],
+        capture_output=True, text=True, check=True, env=env)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Peak RSS of a large PDF upload")
+    parser.add_argument("--mb", type=float, default=40, help="size of the generated PDF")
+    parser.add_argument("--seed", type=int, default=17)
+    parser.add_argument("--out", default="upload_rss.json")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--scenario", choices=SCENARIOS, help=argparse.SUPPRESS)
+    parser.add_argument("--pdf", help=argparse.SUPPRESS)
+    parser.add_argument("--db", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        child(args)
+        return 0
+
+    from benchmarks.loadtest import git_commit
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="vyapar-upload-bench-") as tmp:
+        pdf = os.path.join(tmp, "scan.pdf")
+        make_scan(pdf, args.mb, random.Random(args.seed))
+        size_mb = os.path.getsize(pdf) / 2**20
+        print(f"generated {size_mb:.1f} MB scanned PDF")
+        db.DB_PATH = os.path.join(tmp, "users.db")
+        db.init_db()
+        for scenario in SCENARIOS:
+            result = run_child(scenario, pdf, db.DB_PATH)
+            result["peak_over_baseline_mb"] = round(result["peak_rss_mb"] - result["baseline_rss_mb"], 1)
+            results.append(result)
+            print(f"{scenario:>8}: +{result['peak_over_baseline_mb']:>6} MB peak RSS over baseline "
+                  f"({result['baseline_rss_mb']} -> {result['peak_rss_mb']} MB; at the end anon {result['anon_rss_mb']} "
+                  f"file {result['file_rss_mb']})  {result['seconds']}s")
+
+    report = {
+        "meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "git_commit": git_commit(), "args": vars(args),
+                 "pdf_mb": round(size_mb, 1), "spool_mb": uploads.SPOOL_BYTES / 2**20},
+        "results": results,
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"report written to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,361 @@
+"""Two-level caches: per-process memory in front of a shared on-disk tier.
+
+Several Streamlit, API and job worker processes run side by side on a host,
+so answers computed by one should be reusable by the others. `DiskCache` is
+a SQLite file (WAL mode, so readers never block the writer) shared by every
+process on the host:
+
+* each write is one UPSERT statement, so readers see either the old value or
+  the new one, never a torn entry, and a crashed writer leaves nothing behind;
+* the total size is tracked by triggers in `cache_meta`, and a write that
+  takes it over `max_bytes` evicts least recently used entries (down to
+  EVICT_TO of the limit) in one BEGIN IMMEDIATE transaction;
+* entries expire after their namespace's TTL; expired rows are dropped on
+  read and during eviction.
+
+`TieredCache` looks in a bounded in-process LRU (`MemoryCache`) first, then
+on disk, and promotes disk hits into memory. Lookups are counted per tier in
+vyapar_cache_lookups_total{cache,tier,result}; `stats()` gives hit ratios.
+The cache is best-effort: a locked or unreadable file counts as a miss.
+
+Caches built on it:
+
+    llm_answers    complete chat answers by singleflight.request_key plus user id (llm.py);
+                   only with VYAPAR_LLM_CHAT_CACHE=1, since a chat request carries the
+                   user's name, date and conversation
+    pdf_text       extracted PDF text by file sha256 + max_chars + page range (documents.py)
+    pdf_pages      per-page text and page counts by file sha256 (documents.PdfDocument)
+
+Configuration (environment):
+
+    VYAPAR_CACHE_PATH          shared cache file (default vyapar_cache.db; empty = memory only)
+    VYAPAR_CACHE_MAX_MB        disk tier size limit (default 256)
+    VYAPAR_CACHE_MEMORY_ITEMS  entries per cache in each process (default 512)
+    VYAPAR_LLM_CHAT_CACHE      1 reuses a user's finished chat answers (default 0: off)
+    VYAPAR_LLM_CACHE_TTL       seconds an LLM answer is reused; 0 disables (default 21600)
+    VYAPAR_PDF_CACHE_TTL       seconds extracted PDF text is kept; 0 disables (default 604800)
+    VYAPAR_PDF_PAGE_CACHE_ITEMS  PDF pages kept in each process (default 256)
+
+    python cache.py [--clear [NAMESPACE]]     print (or first drop) disk tier contents
+"""
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import storage
+from metrics import CACHE_LOOKUPS
+
+CACHE_PATH = os.environ.get("VYAPAR_CACHE_PATH", "vyapar_cache.db")
+CACHE_MAX_BYTES = int(float(os.environ.get("VYAPAR_CACHE_MAX_MB", "256")) * 2**20)
+MEMORY_ITEMS = int(os.environ.get("VYAPAR_CACHE_MEMORY_ITEMS", "512"))
+LLM_CHAT_CACHE = os.environ.get("VYAPAR_LLM_CHAT_CACHE", "0") != "0"
+LLM_CACHE_TTL = float(os.environ.get("VYAPAR_LLM_CACHE_TTL", "21600"))
+PDF_CACHE_TTL = float(os.environ.get("VYAPAR_PDF_CACHE_TTL", "604800"))
+PDF_PAGE_CACHE_ITEMS = int(os.environ.get("VYAPAR_PDF_PAGE_CACHE_ITEMS", "256"))
+EVICT_TO = 0.9           # eviction stops at this fraction of max_bytes
+ACCESS_RESOLUTION = 30.0  # seconds; a hit only rewrites last_access when it is older
+BUSY_TIMEOUT_MS = 2000
+
+_MISS = object()
+
+
+# =========================
+# MEMORY TIER
+# =========================
+class MemoryCache:
+    """Bounded LRU of values expiring after `ttl` seconds."""
+
+    def __init__(self, max_entries=MEMORY_ITEMS, ttl=3600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+        return _MISS
+
+    def put(self, key, value, ttl=None):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# =========================
+# DISK TIER
+# =========================
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache_entries (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    last_access REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_cache_entries_lru ON cache_entries(last_access);
+CREATE TABLE IF NOT EXISTS cache_meta (id INTEGER PRIMARY KEY CHECK (id = 1), total_bytes INTEGER NOT NULL);
+INSERT OR IGNORE INTO cache_meta (id, total_bytes) VALUES (1, 0);
+CREATE TRIGGER IF NOT EXISTS cache_entries_ins AFTER INSERT ON cache_entries BEGIN
+    UPDATE cache_meta SET total_bytes = total_bytes + NEW.size WHERE id = 1;
+END;
+CREATE TRIGGER IF NOT EXISTS cache_entries_upd AFTER UPDATE OF size ON cache_entries BEGIN
+    UPDATE cache_meta SET total_bytes = total_bytes + NEW.size - OLD.size WHERE id = 1;
+END;
+CREATE TRIGGER IF NOT EXISTS cache_entries_del AFTER DELETE ON cache_entries BEGIN
+    UPDATE cache_meta SET total_bytes = total_bytes - OLD.size WHERE id = 1;
+END;
+"""
+
+
+class DiskCache:
+    """Byte values in a SQLite file shared by every process on the host, LRU-evicted past `max_bytes`."""
+
+    def __init__(self, path=CACHE_PATH, max_bytes=CACHE_MAX_BYTES, pool_size=4):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.pid = os.getpid()
+        self.pool = storage.ConnectionPool(self._connect, pool_size)
+        with self.pool.connection() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    def _connect(self):
+        # Autocommit: every statement is its own transaction unless BEGIN says otherwise
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None,
+                               timeout=BUSY_TIMEOUT_MS / 1000)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def get(self, namespace, key):
+        """The stored bytes, or None when absent or expired."""
+        now = time.time()
+        with self.pool.connection() as conn:
+            row = conn.execute(
+                "SELECT value, expires_at, last_access FROM cache_entries WHERE namespace = ? AND key = ?",
+                (namespace, key)).fetchone()
+            if row is None:
+                return None
+            value, expires_at, last_access = row
+            if expires_at <= now:
+                conn.execute("DELETE FROM cache_entries WHERE namespace = ? AND key = ? AND expires_at <= ?",
+                             (namespace, key, now))
+                return None
+            if last_access < now - ACCESS_RESOLUTION:
+                # Coarse LRU: hot keys don't turn every read into a write
+                conn.execute("UPDATE cache_entries SET last_access = ? WHERE namespace = ? AND key = ?",
+                             (now, namespace, key))
+        return bytes(value)
+
+    def put(self, namespace, key, value: bytes, ttl):
+        if len(value) > self.max_bytes * (1 - EVICT_TO):
+            return  # one entry would flush a large part of the cache
+        now = time.time()
+        with self.pool.connection() as conn:
+            conn.execute("""
+                INSERT INTO cache_entries (namespace, key, value, size, expires_at, last_access)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (namespace, key) DO UPDATE SET
+                    value = excluded.value, size = excluded.size,
+                    expires_at = excluded.expires_at, last_access = excluded.last_access
+            """, (namespace, key, value, len(value), now + ttl, now))
+            if self._total(conn) > self.max_bytes:
+                self._evict(conn, now)
+
+    def _total(self, conn):
+        return conn.execute("SELECT total_bytes FROM cache_meta WHERE id = 1").fetchone()[0]
+
+    def _evict(self, conn, now):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM cache_entries WHERE expires_at <= ?", (now,))
+            excess = self._total(conn) - int(self.max_bytes * EVICT_TO)
+            while excess > 0:
+                rows = conn.execute(
+                    "SELECT namespace, key, size FROM cache_entries ORDER BY last_access LIMIT 256").fetchall()
+                if not rows:
+                    break
+                victims = []
+                for namespace, key, size in rows:
+                    victims.append((namespace, key))
+                    excess -= size
+                    if excess <= 0:
+                        break
+                conn.executemany("DELETE FROM cache_entries WHERE namespace = ? AND key = ?", victims)
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+
+    def delete(self, namespace, key):
+        with self.pool.connection() as conn:
+            conn.execute("DELETE FROM cache_entries WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def clear(self, namespace=None):
+        with self.pool.connection() as conn:
+            if namespace is None:
+                conn.execute("DELETE FROM cache_entries")
+            else:
+                conn.execute("DELETE FROM cache_entries WHERE namespace = ?", (namespace,))
+
+    def stats(self):
+        with self.pool.connection() as conn:
+            per_namespace = {
+                ns: {"entries": n, "bytes": size}
+                for ns, n, size in conn.execute(
+                    "SELECT namespace, COUNT(*), SUM(size) FROM cache_entries GROUP BY namespace")
+            }
+            return {"path": self.path, "max_bytes": self.max_bytes, "total_bytes": self._total(conn),
+                    "namespaces": per_namespace}
+
+    def close(self):
+        self.pool.close()
+
+
+_disk = None
+_disk_lock = threading.Lock()
+
+
+def shared_disk():
+    """The host-wide DiskCache at CACHE_PATH (None if unset); reopened after a fork or a changed path."""
+    global _disk
+    if not CACHE_PATH:
+        return None
+    with _disk_lock:
+        if _disk is None or _disk.path != CACHE_PATH or _disk.pid != os.getpid():
+            _disk = DiskCache(CACHE_PATH)
+        return _disk
+
+
+# =========================
+# TIERED CACHE
+# =========================
+class TieredCache:
+    """JSON-serializable values by string key: memory first, then the shared disk tier.
+
+    `ttl <= 0` disables the cache (every get misses, puts are dropped); a
+    `disk` of None (or returning None) keeps it memory-only.
+    """
+
+    def __init__(self, name, ttl, memory_items=MEMORY_ITEMS, disk=shared_disk):
+        self.name = name
+        self.ttl = ttl
+        self.memory = MemoryCache(memory_items, ttl)
+        self._disk = disk  # DiskCache, None, or a callable returning either
+        self._counts = {("memory", "hit"): 0, ("memory", "miss"): 0, ("disk", "hit"): 0, ("disk", "miss"): 0}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def disk(self):
+        return self._disk() if callable(self._disk) else self._disk
+
+    def _count(self, tier, result):
+        with self._lock:
+            self._counts[(tier, result)] += 1
+        CACHE_LOOKUPS.labels(cache=self.name, tier=tier, result=result).inc()
+
+    def get(self, key, default=None):
+        if not self.enabled:
+            return default
+        value = self.memory.get(key)
+        if value is not _MISS:
+            self._count("memory", "hit")
+            return value
+        self._count("memory", "miss")
+        disk = self.disk()
+        if disk is None:
+            return default
+        try:
+            raw = disk.get(self.name, key)
+        except (sqlite3.Error, TimeoutError) as e:
+            print(f"cache: {self.name} disk read failed: {e}")
+            raw = None
+        if raw is None:
+            self._count("disk", "miss")
+            return default
+        self._count("disk", "hit")
+        value = json.loads(raw)
+        self.memory.put(key, value)
+        return value
+
+    def put(self, key, value):
+        if not self.enabled:
+            return
+        self.memory.put(key, value)
+        disk = self.disk()
+        if disk is None:
+            return
+        try:
+            disk.put(self.name, key, json.dumps(value, ensure_ascii=False).encode("utf-8"), self.ttl)
+        except (sqlite3.Error, TimeoutError) as e:
+            print(f"cache: {self.name} disk write failed: {e}")
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk() is not None:
+            self.disk().clear(self.name)
+
+    def stats(self):
+        """Lookups and hit ratio per tier in this process (disk lookups are memory misses)."""
+        with self._lock:
+            counts = dict(self._counts)
+        out = {}
+        for tier in ("memory", "disk"):
+            hits, misses = counts[(tier, "hit")], counts[(tier, "miss")]
+            out[tier] = {"hits": hits, "misses": misses,
+                         "hit_ratio": round(hits / (hits + misses), 4) if hits + misses else None}
+        total = counts[("memory", "hit")] + counts[("memory", "miss")]
+        hits = counts[("memory", "hit")] + counts[("disk", "hit")]
+        out["overall_hit_ratio"] = round(hits / total, 4) if total else None
+        out["memory_entries"] = len(self.memory)
+        return out
+
+
+# Module-level so every Streamlit session, API request and worker thread in a
+# process shares the memory tier; the disk tier is shared across processes.
+llm_answers = TieredCache("llm", LLM_CACHE_TTL)
+pdf_text = TieredCache("pdf_text", PDF_CACHE_TTL)
+pdf_pages = TieredCache("pdf_pages", PDF_CACHE_TTL, memory_items=PDF_PAGE_CACHE_ITEMS)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Shared on-disk cache")
+    parser.add_argument("--clear", nargs="?", const="", metavar="NAMESPACE",
+                        help="drop every entry, or only those of NAMESPACE (llm, pdf_text, pdf_pages)")
+    args = parser.parse_args(argv)
+    disk = shared_disk()
+    if disk is None:
+        parser.error("VYAPAR_CACHE_PATH is empty; there is no disk tier")
+    if args.clear is not None:
+        disk.clear(args.clear or None)
+    print(json.dumps(disk.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""Bounded chat history for one Streamlit session (st.session_state.chat).
+
+The chat page used to keep every turn of a session in
+st.session_state.messages, a list of dicts that only grew: each document
+explanation added ~16 KB, for every open session of the app process. A
+ChatStore holds only a recent window, as compact slotted records:
+
+    window    the newest turns, at most MAX_MESSAGES of them and MAX_CHARS
+              characters (the latest question and answer are always kept).
+              The window is the conversation the LLM sees. When it is full,
+              the oldest turns are dropped in one go, down to half of each
+              limit: the window then starts at the same turn for many turns,
+              so the prompt prefix a provider caches (prompts.py) survives
+              until the next cut instead of changing on every turn.
+    compact   a message of COMPRESS_CHARS or more is held zlib-compressed and
+              decompressed when it is read (rendering, building a prompt)
+    paging    turns before the window stay in chat_history; "Load earlier
+              messages" asks for more of them, and they are read from the DB
+              on each render instead of being kept
+
+Prompts built outside a session (the API, background explain jobs) use
+`recent_messages`, a window read straight from chat_history whose start
+moves by half a window at a time in the same way.
+
+Turns are saved to chat_history before they are appended (save_chat_message,
+the answer and explain workers), so the window mirrors the newest rows.
+
+    VYAPAR_SESSION_MAX_MESSAGES   turns kept in memory per session (default 50)
+    VYAPAR_SESSION_MAX_CHARS      characters kept in memory per session (default 48000)
+
+    python -m benchmarks.session_memory     memory of N simulated sessions
+"""
+import os
+import sys
+import zlib
+from collections import deque
+
+import db
+import prompts
+
+MAX_MESSAGES = int(os.environ.get("VYAPAR_SESSION_MAX_MESSAGES", "50"))
+MAX_CHARS = int(os.environ.get("VYAPAR_SESSION_MAX_CHARS", "48000"))
+COMPRESS_CHARS = 1024
+MIN_MESSAGES = 2  # the latest question and its answer stay, however long
+EVICT_TO = 0.5    # a full window is cut down to this fraction of its limits
+
+
+class Message:
+    """One chat turn; `content` is stored compressed when it is long."""
+
+    __slots__ = ("role", "size", "_data")
+
+    def __init__(self, role, content):
+        self.role = sys.intern(role)
+        self.size = len(content)
+        self._data = content
+        if self.size >= COMPRESS_CHARS:
+            data = zlib.compress(content.encode("utf-8"), 1)
+            if len(data) < self.size:
+                self._data = data
+
+    @property
+    def content(self) -> str:
+        data = self._data
+        return data if isinstance(data, str) else zlib.decompress(data).decode("utf-8")
+
+    def as_dict(self):
+        return {"role": self.role, "content": self.content}
+
+
+class ChatStore:
+    """The recent window of one user's chat, plus paging into chat_history for older turns."""
+
+    def __init__(self, user_id, max_messages=MAX_MESSAGES, max_chars=MAX_CHARS):
+        self.user_id = user_id
+        self.max_messages = max_messages
+        self.max_chars = max_chars
+        self.loaded = False  # nothing read from the DB yet (the window fills when a page needs history)
+        self.more = False    # chat_history has turns before the window and the pages shown
+        self.earlier = 0     # turns before the window the user asked to see
+        self._window = deque()
+        self._chars = 0
+        self._boundary = None  # chat_history id of the oldest turn in the window, None if not known
+
+    def __iter__(self):
+        return iter(self._window)
+
+    def __len__(self):
+        return len(self._window)
+
+    def load(self, limit):
+        """Fill the window with the newest `limit` turns, once per store."""
+        if self.loaded:
+            return
+        messages, oldest_id = db.load_chat_window(self.user_id, limit)
+        self._window.clear()
+        self._chars = 0
+        self.loaded = True
+        self.more = len(messages) == limit
+        for message in messages:
+            self._push(Message(message["role"], message["content"]))
+        if len(self._window) == len(messages):
+            self._boundary = oldest_id
+
+    def append(self, role, content):
+        self._push(Message(role, content))
+
+    def _push(self, message):
+        self._window.append(message)
+        self._chars += message.size
+        if len(self._window) <= self.max_messages and self._chars <= self.max_chars:
+            return
+        # Cut in one chunk, so the window's first turn (and the prompt prefix) stays put until the next cut
+        keep_messages, keep_chars = int(self.max_messages * EVICT_TO), int(self.max_chars * EVICT_TO)
+        while len(self._window) > MIN_MESSAGES and (
+                len(self._window) > keep_messages or self._chars > keep_chars):
+            self._chars -= self._window.popleft().size
+        self._boundary = None
+        self.more = True
+
+    def clear(self):
+        """Forget every turn (after chat_history was cleared)."""
+        self._window.clear()
+        self._chars = 0
+        self._boundary = None
+        self.loaded = True
+        self.more = False
+        self.earlier = 0
+
+    def messages(self):
+        """The conversation for a prompt: the system message, then the window as dicts."""
+        return [prompts.system_message()] + [message.as_dict() for message in self._window]
+
+    def show_earlier(self, count):
+        self.earlier += count
+
+    def older(self):
+        """The `earlier` turns before the window, oldest first, read from chat_history (not kept)."""
+        if not self.earlier or not self._window:
+            return []
+        if self._boundary is None:
+            # Turns appended in this session carry no id: the window is the newest rows
+            self._boundary = db.load_chat_window(self.user_id, len(self._window))[1]
+            if self._boundary is None:
+                return []
+        messages, _ = db.load_chat_window(self.user_id, self.earlier, before_id=self._boundary)
+        self.more = len(messages) == self.earlier
+        return messages
+
+
+def recent_messages(user_id, max_messages=MAX_MESSAGES, max_chars=MAX_CHARS):
+    """The newest turns within a session window's bounds, oldest first, as {"role", "content"} dicts.
+
+    The window starts at a multiple of half a window into the stored history,
+    so consecutive requests share their first turns like a session's do.
+    """
+    messages, _ = db.load_chat_window(user_id, max_messages)
+    step = max(1, int(max_messages * EVICT_TO))
+    total = db.repository().count_chat_messages(user_id)
+    # Turns stored before the window; the window starts at the next multiple of `step`
+    start = -(total - len(messages)) % step if total > len(messages) else 0
+    chars = sum(len(message["content"]) for message in messages[start:])
+    while len(messages) - start > MIN_MESSAGES and chars > max_chars:
+        end = min(start + step, len(messages) - MIN_MESSAGES)
+        chars -= sum(len(message["content"]) for message in messages[start:end])
+        start = end
+    return messages[start:]
@@ -0,0 +1,691 @@
+"""SQLite persistence, and the storage entry point for users, auth tokens and chat history.
+
+Users, password reset tokens, web sessions, API tokens and chat history go
+through `repository()`: SQLiteRepository (below) by default, or PostgreSQL
+when VYAPAR_DATABASE_URL is set (see storage.py). Everything else here
+(jobs, usage, rate limits, the chat archive) is always the local SQLite file.
+"""
+import hmac
+import os
+import secrets
+import sqlite3
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from hashlib import sha256
+import time
+import uuid
+import zlib
+
+import prompts
+import storage
+from metrics import DB_WRITE_SECONDS, USER_CACHE_LOOKUPS
+from tracing import traced
+
+# Optional zstd for chat blobs (zlib otherwise)
+try:
+    import zstandard
+except Exception:
+    zstandard = None
+
+# =========================
+# DATABASE SETUP
+# =========================
+DB_PATH = os.environ.get("VYAPAR_DB_PATH", "users.db")
+# Chat messages at least this many bytes are stored once per distinct content
+# in `blobs` (compressed) and referenced from chat_history by hash.
+BLOB_THRESHOLD = int(os.environ.get("VYAPAR_BLOB_THRESHOLD", "1024"))
+
+def get_connection():
+    return sqlite3.connect(DB_PATH)
+
+_repository = None
+_repository_lock = threading.Lock()
+
+def repository():
+    """The storage backend for users, auth tokens and chat history.
+
+    SQLite at DB_PATH unless VYAPAR_DATABASE_URL names a PostgreSQL server;
+    a changed DB_PATH (tests, benchmarks) gets a fresh SQLite repository.
+    """
+    global _repository
+    url = os.environ.get("VYAPAR_DATABASE_URL", "")
+    repo = _repository
+    if repo is not None and (url or repo.path == DB_PATH):
+        return repo
+    with _repository_lock:
+        if _repository is None or (not url and _repository.path != DB_PATH):
+            old = _repository
+            if url.startswith(("postgres://", "postgresql://")):
+                _repository = storage.PostgresRepository(url)
+            elif url:
+                raise ValueError(f"unsupported VYAPAR_DATABASE_URL {url!r} (expected postgresql://...)")
+            else:
+                _repository = SQLiteRepository(DB_PATH)
+            if old is not None:
+                old.close()
+        return _repository
+
+def init_db():
+    conn = get_connection()
+    c = conn.cursor()
+    
+    # New databases reclaim free pages incrementally (see retention.py); this
+    # only takes effect before the first table is created.
+    if c.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchone() is None:
+        c.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    
+    # Create chat archive table (compressed segments of old turns, see retention.py)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS chat_archive (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        first_ts TEXT NOT NULL,
+        last_ts TEXT NOT NULL,
+        message_count INTEGER NOT NULL,
+        raw_size INTEGER NOT NULL,
+        codec TEXT NOT NULL,
+        data BLOB NOT NULL,
+        created_at REAL NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_chat_archive_user ON chat_archive (user_id, id)")
+    
+    # Create LLM usage tables (raw rows + incrementally maintained daily rollup)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS llm_usage (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL DEFAULT 0,
+        model TEXT NOT NULL,
+        prompt_tokens INTEGER NOT NULL,
+        completion_tokens INTEGER NOT NULL,
+        latency_ms REAL,
+        ttft_ms REAL,
+        estimated BOOLEAN DEFAULT FALSE,
+        shared BOOLEAN DEFAULT FALSE,
+        created_at REAL NOT NULL
+    )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_llm_usage_user_created ON llm_usage (user_id, created_at)")
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS llm_usage_daily (
+        user_id INTEGER NOT NULL,
+        day TEXT NOT NULL,
+        model TEXT NOT NULL,
+        requests INTEGER NOT NULL DEFAULT 0,
+        prompt_tokens INTEGER NOT NULL DEFAULT 0,
+        completion_tokens INTEGER NOT NULL DEFAULT 0,
+        latency_ms_total REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, day, model)
+    )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_llm_usage_daily_day ON llm_usage_daily (day)")
+    
+    # Create rate limit table (token bucket level and tier per user)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+        user_id INTEGER PRIMARY KEY,
+        tier TEXT NOT NULL DEFAULT 'free',
+        tokens REAL NOT NULL,
+        updated_at REAL NOT NULL
+    )
+    """)
+    
+    # Create jobs table (background document/PDF work, see jobs.py)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        params TEXT NOT NULL DEFAULT '{}',
+        input BLOB,
+        status TEXT NOT NULL DEFAULT 'queued',
+        progress REAL NOT NULL DEFAULT 0,
+        message TEXT,
+        result BLOB,
+        result_type TEXT,
+        error TEXT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        max_attempts INTEGER NOT NULL DEFAULT 3,
+        lease_owner TEXT,
+        lease_expires REAL,
+        run_after REAL NOT NULL,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_run_after ON jobs (status, run_after)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_jobs_user_kind ON jobs (user_id, kind, id)")
+    # Job uploads, in their own table: a zeroblob in a row's last column is
+    # not materialized, so jobs.enqueue can stream a large PDF in (jobs.input
+    # only holds inputs queued before this table existed)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS job_inputs (
+        job_id INTEGER PRIMARY KEY,
+        data BLOB NOT NULL
+    )
+    """)
+    
+    conn.commit()
+    conn.close()
+    
+    # Users, auth tokens and chat history live in the configured backend
+    repository().init_schema()
+
+
+def hash_password(password: str) -> str:
+    return sha256(password.encode()).hexdigest()
+
+# =========================
+# USER RECORDS & CACHE
+# =========================
+USER_COLUMNS = "id, username, password, first_name, last_name, email, phone, created_at"
+USER_CACHE_SIZE = int(os.environ.get("VYAPAR_USER_CACHE_SIZE", "10000"))
+# Bounds how long another process (API server, second app replica) can see a
+# record from before a password change; writes in this process invalidate at once.
+USER_CACHE_TTL = float(os.environ.get("VYAPAR_USER_CACHE_TTL", "60"))
+# Unknown usernames are remembered briefly (a registration elsewhere shows up after this)
+USER_CACHE_NEGATIVE_TTL = 5.0
+
+@dataclass(frozen=True, slots=True)
+class UserRecord:
+    id: int
+    username: str
+    password: str = field(repr=False)  # sha256 hex digest
+    first_name: str
+    last_name: str
+    email: str
+    phone: str
+    created_at: str
+
+    @classmethod
+    def from_row(cls, row):
+        return None if row is None else cls(*row)
+
+_MISS = object()
+
+class UserCache:
+    """Bounded LRU of UserRecords keyed by id and by username, entries expiring after `ttl`.
+
+    Unknown usernames are cached as None for `negative_ttl`, so bursts of
+    failed logins and reset requests stay off SQLite too; register_user drops
+    that entry.
+    """
+
+    def __init__(self, max_entries=USER_CACHE_SIZE, ttl=USER_CACHE_TTL, negative_ttl=USER_CACHE_NEGATIVE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = min(negative_ttl, ttl)
+        self._entries = OrderedDict()  # ("id", 1) / ("username", "asha") -> (expires, record or None)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                USER_CACHE_LOOKUPS.labels(result="hit").inc()
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+        USER_CACHE_LOOKUPS.labels(result="miss").inc()
+        return _MISS
+
+    def put(self, user, username=None):
+        if self.max_entries <= 0 or self.ttl <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if user is None:
+                self._entries[("username", username)] = (now + self.negative_ttl, None)
+                self._entries.move_to_end(("username", username))
+            else:
+                for key in (("id", user.id), ("username", user.username)):
+                    self._entries[key] = (now + self.ttl, user)
+                    self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id=None, username=None):
+        with self._lock:
+            entry = self._entries.pop(("id", user_id), None) if user_id is not None else None
+            if entry is not None and entry[1] is not None:
+                self._entries.pop(("username", entry[1].username), None)
+            if username is not None:
+                entry = self._entries.pop(("username", username), None)
+                if entry is not None and entry[1] is not None:
+                    self._entries.pop(("id", entry[1].id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+user_cache = UserCache()
+
+@traced("db.get_user")
+def get_user(user_id):
+    user = user_cache.get(("id", user_id))
+    if user is _MISS:
+        user = UserRecord.from_row(repository().get_user(user_id))
+        if user is not None:
+            user_cache.put(user)
+    return user
+
+@traced("db.register_user")
+@DB_WRITE_SECONDS.labels(op="register_user").time()
+def register_user(username, password, first_name, last_name, email="", phone=""):
+    try:
+        created = repository().create_user(username, hash_password(password), first_name, last_name, email, phone)
+    finally:
+        user_cache.invalidate(username=username)
+    if created:
+        return True, "Registration successful!"
+    return False, "Username already exists."
+
+@traced("db.authenticate_user")
+def authenticate_user(username, password):
+    password_hash = hash_password(password)
+    user = get_user_by_username(username)
+    if user is not None and not hmac.compare_digest(user.password, password_hash):
+        # The cached record may predate a password change made by another process
+        user_cache.invalidate(username=username)
+        user = get_user_by_username(username)
+    if user is None or not hmac.compare_digest(user.password, password_hash):
+        return None
+    return user
+
+@traced("db.get_user_by_username")
+def get_user_by_username(username):
+    user = user_cache.get(("username", username))
+    if user is _MISS:
+        user = UserRecord.from_row(repository().get_user_by_username(username))
+        user_cache.put(user, username)
+    return user
+
+@traced("db.create_password_reset_token")
+@DB_WRITE_SECONDS.labels(op="create_password_reset_token").time()
+def create_password_reset_token(user_id):
+    token = str(uuid.uuid4())
+    expires_at = time.time() + 3600  # 1 hour from now
+    repository().create_reset_token(user_id, token, expires_at)
+    return token
+
+@traced("db.validate_reset_token")
+def validate_reset_token(token):
+    # The token itself is always checked in the database (expiry, single use); the user comes from the cache
+    user_id = repository().reset_token_user_id(token, time.time())
+    return get_user(user_id) if user_id is not None else None
+
+@traced("db.update_password")
+@DB_WRITE_SECONDS.labels(op="update_password").time()
+def update_password(user_id, new_password):
+    # Also ends the user's web sessions: signed-in browsers must log in again
+    repository().set_password(user_id, hash_password(new_password))
+    user_cache.invalidate(user_id=user_id)
+
+# =========================
+# CHAT HISTORY
+# =========================
+@traced("db.save_chat_message")
+@DB_WRITE_SECONDS.labels(op="save_chat_message").time()
+def save_chat_message(user_id, role, content):
+    repository().save_chat_message(user_id, role, content)
+
+@traced("db.load_chat_history")
+def load_chat_history(user_id):
+    messages = repository().load_chat_history(user_id)
+    
+    # Ensure system message is always first
+    if not messages or messages[0]["role"] != "system":
+        messages.insert(0, prompts.system_message())
+    return messages
+
+@traced("db.load_chat_window")
+def load_chat_window(user_id, limit, before_id=None):
+    """Up to `limit` most recent turns older than `before_id`, oldest first.
+
+    Returns (messages, oldest_id); oldest_id is None when nothing is left.
+    Walks the (user_id, id) index backwards, so the cost is the window, not the history.
+    """
+    return repository().load_chat_window(user_id, limit, before_id)
+
+@traced("db.clear_chat_history")
+@DB_WRITE_SECONDS.labels(op="clear_chat_history").time()
+def clear_chat_history(user_id):
+    repository().clear_chat_history(user_id)
+
+# =========================
+# API TOKENS & SESSIONS
+# =========================
+def _token_hash(token):
+    return sha256(token.encode()).hexdigest()
+
+@traced("db.create_api_token")
+@DB_WRITE_SECONDS.labels(op="create_api_token").time()
+def create_api_token(user_id, ttl=30 * 24 * 3600):
+    token = secrets.token_urlsafe(32)
+    now = time.time()
+    repository().add_token("api", _token_hash(token), user_id, now, now + ttl)
+    return token, now + ttl
+
+@traced("db.get_user_by_api_token")
+def get_user_by_api_token(token):
+    user_id = repository().token_user_id("api", _token_hash(token), time.time())
+    return get_user(user_id) if user_id is not None else None
+
+@traced("db.revoke_api_token")
+@DB_WRITE_SECONDS.labels(op="revoke_api_token").time()
+def revoke_api_token(token):
+    repository().delete_token("api", _token_hash(token))
+
+@traced("db.create_session")
+@DB_WRITE_SECONDS.labels(op="create_session").time()
+def create_session(user_id, ttl=7 * 24 * 3600):
+    """New opaque browser session id for `user_id`; expired sessions are dropped on the way."""
+    token = secrets.token_urlsafe(32)
+    now = time.time()
+    repository().add_token("session", _token_hash(token), user_id, now, now + ttl)
+    return token
+
+@traced("db.get_user_by_session")
+def get_user_by_session(token):
+    """The user for a live session id, or None (one primary-key lookup; the user record is cached)."""
+    user_id = repository().token_user_id("session", _token_hash(token), time.time())
+    return get_user(user_id) if user_id is not None else None
+
+@traced("db.revoke_session")
+@DB_WRITE_SECONDS.labels(op="revoke_session").time()
+def revoke_session(token):
+    repository().delete_token("session", _token_hash(token))
+
+# =========================
+# BLOB STORE
+# =========================
+def compress(raw: bytes):
+    if zstandard is not None:
+        codec, data = "zstd", zstandard.ZstdCompressor(level=10).compress(raw)
+    else:
+        codec, data = "zlib", zlib.compress(raw, 6)
+    if len(data) >= len(raw):
+        return "raw", raw
+    return codec, data
+
+def decompress(codec, data) -> bytes:
+    if codec == "zlib":
+        return zlib.decompress(data)
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard not installed. Run: pip install zstandard")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+def _put_blob(c, content: str) -> str:
+    """Store `content` once (by sha256) and take a reference; returns the hash."""
+    raw = content.encode("utf-8")
+    digest = sha256(raw).hexdigest()
+    c.execute("UPDATE blobs SET refcount = refcount + 1 WHERE hash = ?", (digest,))
+    if c.rowcount == 0:
+        codec, data = compress(raw)
+        c.execute(
+            "INSERT INTO blobs (hash, codec, size, data, refcount, created_at) VALUES (?, ?, ?, ?, 1, ?)",
+            (digest, codec, len(raw), data, time.time()))
+    return digest
+
+def release_blobs(c, where, args):
+    # Drop chat_history's references for the rows matching `where`.
+    c.execute(f"""
+        UPDATE blobs SET refcount = refcount - (
+            SELECT COUNT(*) FROM chat_history h WHERE h.blob_hash = blobs.hash AND {where})
+        WHERE hash IN (SELECT blob_hash FROM chat_history WHERE blob_hash IS NOT NULL AND {where})
+    """, (*args, *args))
+    c.execute("DELETE FROM blobs WHERE refcount <= 0")
+
+def _move_large_messages_to_blobs(c):
+    rows = c.execute("SELECT id, content FROM chat_history WHERE length(content) >= ?", (BLOB_THRESHOLD,)).fetchall()
+    for row_id, content in rows:
+        c.execute("UPDATE chat_history SET content = '', blob_hash = ? WHERE id = ?", (_put_blob(c, content), row_id))
+
+def blob_stats():
+    """Counts and byte totals for the blob store (for benchmarks and admin)."""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(length(data)), 0), "
+              "COALESCE(SUM(refcount), 0) FROM blobs")
+    blobs, raw_bytes, stored_bytes, references = c.fetchone()
+    conn.close()
+    return {"blobs": blobs, "raw_bytes": raw_bytes, "stored_bytes": stored_bytes, "references": references}
+
+# =========================
+# SQLITE BACKEND
+# =========================
+class SQLiteRepository(storage.Repository):
+    """The default backend: one SQLite file, large messages in the blob store."""
+    kind = "sqlite"
+
+    def __init__(self, path, pool_size=storage.POOL_SIZE, group_commit=storage.GROUP_COMMIT_MAX):
+        self.path = path
+        self.pool = storage.ConnectionPool(self._connect, pool_size)
+        self.chat_writer = storage.GroupCommit(self.save_chat_messages, max_batch=group_commit)
+
+    def _connect(self):
+        # A pooled connection is used by one thread at a time, but not always the same one
+        return sqlite3.connect(self.path, check_same_thread=False)
+
+    def _one(self, sql, args=()):
+        with self.pool.connection() as conn:
+            return conn.execute(sql, args).fetchone()
+
+    def _write(self, *statements):
+        with self.pool.connection() as conn:
+            for sql, args in statements:
+                conn.execute(sql, args)
+            conn.commit()
+
+    def init_schema(self):
+        with self.pool.connection() as conn:
+            c = conn.cursor()
+            
+            # Create users table
+            c.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT UNIQUE NOT NULL,
+                password TEXT NOT NULL,
+                first_name TEXT,
+                last_name TEXT,
+                email TEXT,
+                phone TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """)
+
+            # Create password_reset_tokens table
+            c.execute("""
+            CREATE TABLE IF NOT EXISTS password_reset_tokens (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                token TEXT NOT NULL,
+                expires_at TIMESTAMP NOT NULL,
+                used BOOLEAN DEFAULT FALSE,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+            """)
+            c.execute("CREATE INDEX IF NOT EXISTS idx_password_reset_tokens_token ON password_reset_tokens (token)")
+
+            # Create chat_history table
+            c.execute("""
+            CREATE TABLE IF NOT EXISTS chat_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                blob_hash TEXT,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+            """)
+
+            # Create blobs table (content-addressed, compressed large chat messages)
+            c.execute("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                hash TEXT PRIMARY KEY,
+                codec TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                data BLOB NOT NULL,
+                refcount INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL
+            )
+            """)
+            if "blob_hash" not in {row[1] for row in c.execute("PRAGMA table_info(chat_history)")}:
+                # Databases created before the blob store
+                c.execute("ALTER TABLE chat_history ADD COLUMN blob_hash TEXT")
+                _move_large_messages_to_blobs(c)
+            c.execute("CREATE INDEX IF NOT EXISTS idx_chat_history_user ON chat_history (user_id, id)")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_chat_history_timestamp ON chat_history (timestamp)")
+
+            # Create API tokens table (only a hash of each bearer token is stored)
+            c.execute("""
+            CREATE TABLE IF NOT EXISTS api_tokens (
+                token_hash TEXT PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+            """)
+            c.execute("CREATE INDEX IF NOT EXISTS idx_api_tokens_expires_at ON api_tokens (expires_at)")
+
+            # Create web sessions table (browser logins; only a hash of each session id is stored)
+            c.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                token_hash TEXT PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+            """)
+            c.execute("CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON sessions (expires_at)")
+            conn.commit()
+
+    def create_user(self, username, password_hash, first_name, last_name, email, phone):
+        try:
+            self._write((
+                "INSERT INTO users (username, password, first_name, last_name, email, phone) VALUES (?, ?, ?, ?, ?, ?)",
+                (username, password_hash, first_name, last_name, email, phone)))
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    def get_user(self, user_id):
+        return self._one(f"SELECT {USER_COLUMNS} FROM users WHERE id = ?", (user_id,))
+
+    def get_user_by_username(self, username):
+        return self._one(f"SELECT {USER_COLUMNS} FROM users WHERE username = ?", (username,))
+
+    def set_password(self, user_id, password_hash):
+        self._write(
+            ("UPDATE users SET password = ? WHERE id = ?", (password_hash, user_id)),
+            ("UPDATE password_reset_tokens SET used = TRUE WHERE user_id = ?", (user_id,)),
+            ("DELETE FROM sessions WHERE user_id = ?", (user_id,)),
+        )
+
+    def create_reset_token(self, user_id, token, expires_at):
+        self._write(("INSERT INTO password_reset_tokens (user_id, token, expires_at) VALUES (?, ?, ?)",
+                     (user_id, token, expires_at)))
+
+    def reset_token_user_id(self, token, now):
+        row = self._one("""
+            SELECT user_id FROM password_reset_tokens
+            WHERE token = ? AND expires_at > ? AND used = FALSE
+        """, (token, now))
+        return row[0] if row else None
+
+    def add_token(self, kind, token_hash, user_id, created_at, expires_at):
+        table = storage.TOKEN_TABLES[kind]
+        self._write(
+            (f"DELETE FROM {table} WHERE expires_at <= ?", (created_at,)),
+            (f"INSERT INTO {table} (token_hash, user_id, created_at, expires_at) VALUES (?, ?, ?, ?)",
+             (token_hash, user_id, created_at, expires_at)),
+        )
+
+    def token_user_id(self, kind, token_hash, now):
+        row = self._one(f"SELECT user_id FROM {storage.TOKEN_TABLES[kind]} WHERE token_hash = ? AND expires_at > ?",
+                        (token_hash, now))
+        return row[0] if row else None
+
+    def delete_token(self, kind, token_hash):
+        self._write((f"DELETE FROM {storage.TOKEN_TABLES[kind]} WHERE token_hash = ?", (token_hash,)))
+
+    def save_chat_messages(self, rows):
+        with self.pool.connection() as conn:
+            c = conn.cursor()
+            inserts = []
+            for user_id, role, content in rows:
+                blob_hash = None
+                if len(content) >= BLOB_THRESHOLD:
+                    blob_hash = _put_blob(c, content)
+                    content = ""
+                inserts.append((user_id, role, content, blob_hash))
+            c.executemany("INSERT INTO chat_history (user_id, role, content, blob_hash) VALUES (?, ?, ?, ?)", inserts)
+            conn.commit()
+
+    def count_chat_messages(self, user_id):
+        return self._one("SELECT COUNT(*) FROM chat_history WHERE user_id = ?", (user_id,))[0]
+
+    def _hydrate(self, rows):
+        # rows: (..., role, content, blob_hash, codec, data); the same document often appears several times
+        hydrated = {}
+        for *_, role, content, blob_hash, codec, data in rows:
+            if blob_hash is not None:
+                if blob_hash not in hydrated:
+                    hydrated[blob_hash] = decompress(codec, data).decode("utf-8")
+                content = hydrated[blob_hash]
+            yield {"role": role, "content": content}
+
+    def load_chat_history(self, user_id):
+        with self.pool.connection() as conn:
+            rows = conn.execute("""
+                SELECT h.role, h.content, h.blob_hash, b.codec, b.data FROM chat_history h
+                LEFT JOIN blobs b ON b.hash = h.blob_hash
+                WHERE h.user_id = ? 
+                ORDER BY h.timestamp ASC, h.id ASC
+            """, (user_id,)).fetchall()
+        return list(self._hydrate(rows))
+
+    def load_chat_window(self, user_id, limit, before_id=None):
+        with self.pool.connection() as conn:
+            rows = conn.execute("""
+                SELECT h.id, h.role, h.content, h.blob_hash, b.codec, b.data FROM chat_history h
+                LEFT JOIN blobs b ON b.hash = h.blob_hash
+                WHERE h.user_id = ? AND h.id < ?
+                ORDER BY h.id DESC LIMIT ?
+            """, (user_id, before_id if before_id is not None else 2**63 - 1, limit)).fetchall()
+        return list(self._hydrate(reversed(rows))), (rows[-1][0] if rows else None)
+
+    def iter_chat_history(self, user_id):
+        # Own connection: a slow export download must not hold a pool slot
+        conn = self._connect()
+        try:
+            cursor = conn.execute("""
+                SELECT h.role, h.content, h.timestamp, b.codec, b.data FROM chat_history h
+                LEFT JOIN blobs b ON b.hash = h.blob_hash
+                WHERE h.user_id = ?
+                ORDER BY h.id
+            """, (user_id,))
+            for role, content, ts, codec, data in cursor:
+                if codec is not None:
+                    content = decompress(codec, data).decode("utf-8")
+                yield {"role": role, "content": content, "timestamp": ts}
+        finally:
+            conn.close()
+
+    def clear_chat_history(self, user_id):
+        with self.pool.connection() as conn:
+            c = conn.cursor()
+            release_blobs(c, "user_id = ?", (user_id,))
+            c.execute("DELETE FROM chat_history WHERE user_id = ?", (user_id,))
+            c.execute("DELETE FROM chat_archive WHERE user_id = ?", (user_id,))
+            conn.commit()
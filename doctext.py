@@ -0,0 +1,186 @@
+"""Token-shrinking cleanup of text extracted from PDFs, before it goes into a prompt.
+
+PyPDF2 text from government notices repeats the letterhead, notice number
+and "Page 3 of 12" footer on every page, pads tables with runs of spaces,
+dots and dashes, and ends pages with the same "system generated, no
+signature required" lines. All of it used to count against Explain
+Document's 8,000-char budget and the user's LLM tokens. `prepare` runs
+between extraction and the prompt (documents.PdfDocument.text):
+
+    repeated lines   a line found on half the pages or more (at least 2) is
+                     kept once; in the top/bottom HEADER_LINES of a page,
+                     lines that differ only in numbers count as the same line
+    page numbers     "Page 3 of 12", "- 3 -", "3/12" alone on a line
+    noise            lines with no letters or digits (table rules), runs of
+                     dot leaders and underscores, BOILERPLATE sentences
+    whitespace       runs of spaces collapsed, blank lines dropped
+
+and puts the dates, amounts, GSTINs and section/rule references it finds
+first, as a short "Key facts" header, so they survive the character budget.
+
+    VYAPAR_DOC_PREPROCESS=0   send the raw extracted text (default 1)
+
+    python -m benchmarks.doc_preprocess     token reduction on a generated corpus
+"""
+import os
+import re
+
+from metrics import DOCUMENT_TEXT_CHARS
+
+ENABLED = os.environ.get("VYAPAR_DOC_PREPROCESS", "1") != "0"
+# Bumped when the output changes, so cached extractions are not reused
+VERSION = 2
+HEADER_LINES = 3   # lines at the top and bottom of a page treated as header/footer
+MAX_FACTS = 8      # values kept per kind in the header
+
+BOILERPLATE = re.compile("|".join((
+    r"\b(system|computer|electronically)[ -]generated\b",
+    r"\bdoes not require (any )?(physical )?signature\b",
+    r"\bplease do not reply to this\b",
+    r"\b(printed|downloaded) (on|from)\b.*\d",
+)), re.I)
+
+_PAGE_NUMBER = re.compile(r"^(page\s*)?[-–(]?\s*\d+\s*[-–)]?(\s*(of|/)\s*\d+)?$", re.I)
+_LEADERS = re.compile(r"[.·_]{4,}|-{4,}|={3,}")
+_SPACES = re.compile(r"[ \t\u00a0]+")
+_DIGITS = re.compile(r"\d+")
+_ALNUM = re.compile(r"[^\W_]")
+
+_GSTIN = re.compile(r"\b\d{2}[A-Z]{5}\d{4}[A-Z][0-9A-Z]Z[0-9A-Z]\b")
+_MONTHS = r"(?:jan|feb|mar|apr|may|jun|jul|aug|sep|sept|oct|nov|dec)[a-z]*\.?"
+_DATE = re.compile(
+    r"\b\d{1,2}[/.-]\d{1,2}[/.-](?:\d{4}|\d{2})\b"
+    r"|\b\d{4}-\d{2}-\d{2}\b"
+    rf"|\b\d{{1,2}}(?:st|nd|rd|th)?[ -]{_MONTHS},?[ -]\d{{4}}\b"
+    rf"|\b{_MONTHS} \d{{1,2}},? \d{{4}}\b", re.I)
+# ₹ / Rs. / INR amounts, "1,20,000/-", and digit-grouped figures (tax tables)
+_AMOUNT = re.compile(r"(?:₹|\brs\.?|\binr)\s*(\d[\d,]*(?:\.\d{1,2})?)|\b(\d[\d,]*(?:\.\d{1,2})?)\s*/-"
+                     r"|\b(\d{1,3}(?:,\d{2})*,\d{3}(?:\.\d{1,2})?)\b", re.I)
+_SECTION = re.compile(r"\b(section|sec\.?|u/s|rule)\s*(\d+[A-Z]{0,2}(?:\s*\(\s*[0-9A-Za-z]{1,4}\s*\))*)", re.I)
+
+
+def _line_key(line, numbers=False):
+    key = line.lower()
+    return _DIGITS.sub("#", key) if numbers else key
+
+
+def _lines(page):
+    return [line.strip() for line in _SPACES.sub(" ", _LEADERS.sub(" ", page or "")).splitlines()]
+
+
+def _is_noise(line):
+    return not _ALNUM.search(line) or bool(_PAGE_NUMBER.match(line) or BOILERPLATE.search(line))
+
+
+def page_lines(page):
+    """A page's lines without noise and whitespace runs (what clean_pages does per page)."""
+    return [line for line in _lines(page) if line and not _is_noise(line)]
+
+
+def _line_keys(lines, i):
+    keys = [_line_key(lines[i])]
+    if i < HEADER_LINES or i >= len(lines) - HEADER_LINES:
+        keys.append(_line_key(lines[i], numbers=True))
+    return keys
+
+
+class CleanedLength:
+    """Running lower bound on the length of clean_pages() output, as pages are added one at a time.
+
+    A line counts the first time any of its keys is seen. clean_pages only
+    drops a line whose key an earlier kept line had, so once `chars` passes a
+    budget the cleaned text does too; each page is looked at once.
+    """
+
+    def __init__(self):
+        self.chars = 0
+        self._seen = set()
+
+    def add(self, page) -> int:
+        lines = page_lines(page)
+        for i, line in enumerate(lines):
+            keys = _line_keys(lines, i)
+            if not any(key in self._seen for key in keys):
+                self.chars += len(line)
+            self._seen.update(keys)
+        return self.chars
+
+
+def clean_pages(pages):
+    """Page texts without repeated headers/footers, page numbers, noise and whitespace runs."""
+    pages = [page_lines(page) for page in pages]
+    repeated, edge_repeated = set(), set()
+    if len(pages) >= 2:
+        threshold = max(2, (len(pages) + 1) // 2)
+        counts, edge_counts = {}, {}
+        for lines in pages:
+            for key in {_line_key(line) for line in lines}:
+                counts[key] = counts.get(key, 0) + 1
+            edges = lines[:HEADER_LINES] + lines[-HEADER_LINES:]
+            for key in {_line_key(line, numbers=True) for line in edges}:
+                edge_counts[key] = edge_counts.get(key, 0) + 1
+        repeated = {key for key, n in counts.items() if n >= threshold}
+        edge_repeated = {key for key, n in edge_counts.items() if n >= threshold}
+
+    seen = set()
+    out = []
+    for lines in pages:
+        kept = []
+        for i, line in enumerate(lines):
+            keys = _line_keys(lines, i)
+            key = next((k for k in keys if k in repeated or k in edge_repeated), None)
+            if key is not None:
+                if key in seen:
+                    continue
+                seen.add(key)
+            kept.append(line)
+        out.append("\n".join(kept))
+    return out
+
+
+def _unique(values):
+    out = []
+    for value in values:
+        if value not in out:
+            out.append(value)
+        if len(out) == MAX_FACTS:
+            break
+    return out
+
+
+def extract_facts(text) -> dict:
+    """GSTINs, dates, amounts (as ₹) and section/rule references, in order of appearance."""
+    amounts = []
+    for m in _AMOUNT.finditer(text):
+        value = (m.group(1) or m.group(2) or m.group(3)).rstrip(",")
+        if any(ch != "0" for ch in value if ch.isdigit()):
+            amounts.append(f"₹{value}")
+    sections = []
+    for m in _SECTION.finditer(text):
+        kind = "Rule" if m.group(1).lower() == "rule" else "Section"
+        sections.append(f"{kind} {_SPACES.sub('', m.group(2))}")
+    return {
+        "GSTIN": _unique(_GSTIN.findall(text)),
+        "Dates": _unique(m.group(0) for m in _DATE.finditer(text)),
+        "Amounts": _unique(amounts),
+        "Sections": _unique(sections),
+    }
+
+
+def facts_header(facts) -> str:
+    lines = [f"{kind}: {', '.join(values)}" for kind, values in facts.items() if values]
+    return "Key facts:\n" + "\n".join(lines) if lines else ""
+
+
+def prepare(pages, max_chars=8000) -> str:
+    """Cleaned text of `pages` under a key facts header, at most `max_chars` long."""
+    body = "\n".join(page for page in clean_pages(pages) if page)
+    header = facts_header(extract_facts(body))
+    if header:
+        body = body[:max(0, max_chars - len(header) - 2)]
+        text = f"{header}\n\n{body}".strip()
+    else:
+        text = body[:max_chars].strip()
+    DOCUMENT_TEXT_CHARS.labels(stage="raw").inc(sum(len(page or "") for page in pages))
+    DOCUMENT_TEXT_CHARS.labels(stage="prepared").inc(len(text))
+    return text
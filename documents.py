@@ -0,0 +1,214 @@
+"""PDF generation (invoices, legal/HR documents) and PDF text extraction."""
+from io import BytesIO
+
+import doctext
+import uploads
+from cache import pdf_pages, pdf_text
+from metrics import PDF_EXTRACT_SECONDS, PDF_GENERATE_SECONDS
+from tracing import traced
+
+# Optional imports for PDFs
+try:
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+except Exception:
+    A4 = None
+    canvas = None
+
+try:
+    import PyPDF2
+except Exception:
+    PyPDF2 = None
+
+@traced("pdf.generate_invoice_pdf")
+@PDF_GENERATE_SECONDS.labels(kind="invoice").time()
+def generate_invoice_pdf(customer: str, amount: float) -> BytesIO:
+    if canvas is None or A4 is None:
+        raise RuntimeError("reportlab not installed. Run: pip install reportlab")
+    buffer = BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4)
+    width, height = A4
+    pdf.setFont("Helvetica-Bold", 18)
+    pdf.drawString(72, height - 72, "VyaparGPT - Invoice")
+    pdf.setFont("Helvetica", 12)
+    y = height - 120
+    pdf.drawString(72, y, f"Customer: {customer or '-'}"); y -= 20
+    pdf.drawString(72, y, f"Amount: ₹{amount:,.2f}"); y -= 20
+    pdf.drawString(72, y, "Status: Pending"); y -= 30
+    pdf.setFont("Helvetica-Oblique", 10)
+    pdf.drawString(72, 72, "Generated by VyaparGPT (demo)")
+    pdf.showPage()
+    pdf.save()
+    buffer.seek(0)
+    return buffer
+
+def document_summary_prompt(text: str, pages=None, page_count=None) -> str:
+    excerpt = ""
+    if pages is not None and page_count:
+        first, last = pages[0], min(pages[1], page_count)
+        excerpt = f" (pages {first}-{last} of {page_count})" if first != last else f" (page {first} of {page_count})"
+    return (
+        "You are an MSME compliance assistant. Explain this document in simple language, "
+        "list key points, deadlines, and required actions.\n\n"
+        f"Document text{excerpt}:\n{text}"
+    )
+
+def parse_page_range(spec):
+    """"3" or "2-5" (1-based, inclusive) -> (first, last); None or "" -> None (all pages)."""
+    if spec is None or str(spec).strip() == "":
+        return None
+    first, _, last = str(spec).partition("-")
+    first, last = int(first), int(last or first)
+    if first < 1 or last < first:
+        raise ValueError(f"invalid page range {spec!r}")
+    return first, last
+
+class PageRangeError(ValueError):
+    """A page range with no page in the document."""
+
+
+class PdfDocument:
+    """A PDF parsed lazily: the page count and each page's text are read on first use.
+
+    Page text and counts go through cache.pdf_pages by file hash, so a first
+    page preview, explanations of different page ranges and re-uploads of
+    the same file each parse a page at most once. `source` is bytes or an
+    uploads.Upload; a spooled upload is parsed from a memory map.
+    """
+
+    def __init__(self, source):
+        self.upload = uploads.from_bytes(source) if isinstance(source, (bytes, bytearray)) else source
+        self.digest = self.upload.digest
+        self._reader = None
+        self._page_count = None
+
+    @property
+    def reader(self):
+        if self._reader is None:
+            if PyPDF2 is None:
+                raise RuntimeError("PyPDF2 not installed. Run: pip install PyPDF2")
+            self._reader = PyPDF2.PdfReader(self.upload.open())
+        return self._reader
+
+    @property
+    def page_count(self) -> int:
+        if self._page_count is None:
+            key = f"{self.digest}:count"
+            count = pdf_pages.get(key)
+            if count is None:
+                count = len(self.reader.pages)
+                pdf_pages.put(key, count)
+            self._page_count = count
+        return self._page_count
+
+    def clamp(self, pages=None):
+        """`pages` (first, last) limited to the document; None means every page.
+
+        PageRangeError for a range with no page in the document (it starts
+        past the last page, or first > last), rather than an empty text.
+        """
+        if pages is None:
+            return 1, self.page_count
+        first, last = max(1, pages[0]), min(pages[1], self.page_count)
+        if first > last:
+            raise PageRangeError(
+                f"page range {pages[0]}-{pages[1]} is outside the document's {self.page_count} page(s)")
+        return first, last
+
+    def page_text(self, number: int) -> str:
+        """Text of page `number` (1-based); "" for a page PyPDF2 cannot read."""
+        key = f"{self.digest}:{number}"
+        text = pdf_pages.get(key)
+        if text is None:
+            try:
+                text = self.reader.pages[number - 1].extract_text() or ""
+            except Exception:
+                text = ""
+            pdf_pages.put(key, text)
+        return text
+
+    def text(self, pages=None, max_chars=8000, prepare=None) -> str:
+        """Text of a page range, parsing pages only until `max_chars` is reached.
+
+        With `prepare` (default doctext.ENABLED) the text is cleaned and
+        headed by key facts first (doctext.prepare), so the budget goes to content.
+        """
+        prepare = doctext.ENABLED if prepare is None else prepare
+        first, last = self.clamp(pages)
+        text_chunks = []
+        # Running totals: raw characters, or (with prepare) at least what cleaning will keep
+        cleaned = doctext.CleanedLength()
+        size = 0
+        for number in range(first, last + 1):
+            page = self.page_text(number)
+            text_chunks.append(page)
+            size = cleaned.add(page) if prepare else size + len(page)
+            if size > max_chars:
+                break
+        if prepare:
+            return doctext.prepare(text_chunks, max_chars)
+        text = "\n".join(text_chunks)
+        if len(text) > max_chars:
+            text = text[:max_chars]
+        return text.strip()
+
+@traced("pdf.read_pdf_text")
+def read_pdf_text(uploaded_file, max_chars=8000, pages=None) -> str:
+    """Text of `pages` ((first, last), 1-based; None = all) of an uploaded PDF, up to `max_chars`."""
+    # The same notice gets uploaded by many users, through the app and the
+    # API; each file is extracted once per host (cache.pdf_text).
+    doc = PdfDocument(uploads.from_file(uploaded_file))
+    key = f"{doc.digest}:{max_chars}" + (f":{pages[0]}-{pages[1]}" if pages else "")
+    if doctext.ENABLED:
+        key += f":prep{doctext.VERSION}"
+    text = pdf_text.get(key)
+    if text is None:
+        text = _extract_pdf_text(doc, pages, max_chars)
+        pdf_text.put(key, text)
+    return text
+
+@PDF_EXTRACT_SECONDS.time()
+def _extract_pdf_text(doc, pages, max_chars) -> str:
+    return doc.text(pages, max_chars)
+
+@traced("pdf.generate_legal_doc_pdf")
+@PDF_GENERATE_SECONDS.labels(kind="legal").time()
+def generate_legal_doc_pdf(doc_type: str, name: str) -> BytesIO:
+    if canvas is None or A4 is None:
+        raise RuntimeError("reportlab not installed. Run: pip install reportlab")
+    buffer = BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4)
+    width, height = A4
+    pdf.setFont("Helvetica-Bold", 16)
+    pdf.drawString(72, height - 72, f"{doc_type}")
+    pdf.setFont("Helvetica", 12)
+    y = height - 120
+    if doc_type == "Offer Letter":
+        lines = [
+            f"Dear {name or 'Candidate'},",
+            "We are pleased to offer you a position at our company.",
+            "This offer is subject to company policies and applicable laws.",
+            "Please sign and return to confirm your acceptance.",
+        ]
+    elif doc_type == "NDA":
+        lines = [
+            f"Non-Disclosure Agreement with {name or 'Party'}",
+            "The parties agree to keep confidential information private.",
+            "This agreement covers disclosures, obligations, and term.",
+        ]
+    else:
+        lines = [
+            "Leave Policy (Summary)",
+            "- Earned Leave, Casual Leave, Sick Leave as per policy.",
+            "- Prior approval required for planned leaves.",
+            "- Medical certificate may be required for extended sick leave.",
+        ]
+    for line in lines:
+        pdf.drawString(72, y, line)
+        y -= 20
+    pdf.setFont("Helvetica-Oblique", 10)
+    pdf.drawString(72, 72, "Generated by VyaparGPT (demo)")
+    pdf.showPage()
+    pdf.save()
+    buffer.seek(0)
+    return buffer
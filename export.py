@@ -0,0 +1,266 @@
+"""Streaming chat history export (JSONL, CSV, PDF).
+
+Rows come from `retention.iter_history`, which walks archive segments one at
+a time and the hot rows through a live SQLite cursor, and each writer emits
+output as it goes. Neither the history nor the output is ever held in
+memory as a whole; peak memory is one archive segment plus one PDF volume.
+
+A PDF export is one ReportLab document per PDF_VOLUME_MESSAGES turns.
+ReportLab keeps a document in memory until save(), so longer histories are
+exported as a zip of volumes ("pdf_zip"), written straight to the output
+stream. Which of the two an export gets is decided once, by `resolve_format`,
+and the caller passes the result to the writer and uses it for the headers.
+
+    python export.py USER_ID --format csv > history.csv
+"""
+import argparse
+import csv
+import io
+import itertools
+import json
+import queue
+import sys
+import threading
+import zipfile
+
+import db
+import retention
+from documents import A4, canvas
+
+try:
+    from reportlab.lib.utils import simpleSplit
+except Exception:
+    simpleSplit = None
+
+PDF_VOLUME_MESSAGES = 5000
+PDF_TITLE = "VyaparGPT conversation history"
+CHUNK_BYTES = 64 * 1024
+
+# format -> (content type, file extension)
+FORMATS = {
+    "jsonl": ("application/x-ndjson", "jsonl"),
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "pdf": ("application/pdf", "pdf"),
+}
+# What "pdf" becomes past one volume (never asked for directly)
+PDF_ZIP = ("application/zip", "zip")
+
+
+def history_size(user_id) -> int:
+    conn = db.get_connection()
+    try:
+        archived = conn.execute(
+            "SELECT COALESCE(SUM(message_count), 0) FROM chat_archive WHERE user_id = ?", (user_id,)).fetchone()[0]
+    finally:
+        conn.close()
+    return db.repository().count_chat_messages(user_id) + archived
+
+
+def resolve_format(fmt, user_id):
+    """(format to write, content type, extension); a long PDF export becomes "pdf_zip"."""
+    if fmt == "pdf" and history_size(user_id) > PDF_VOLUME_MESSAGES:
+        return ("pdf_zip",) + PDF_ZIP
+    return (fmt,) + FORMATS[fmt]
+
+
+class _Buffered:
+    """Collects small text writes and hands them to `f` in CHUNK_BYTES pieces."""
+
+    def __init__(self, f):
+        self.f = f
+        self.parts = []
+        self.size = 0
+
+    def write(self, text):
+        data = text.encode("utf-8")
+        self.parts.append(data)
+        self.size += len(data)
+        if self.size >= CHUNK_BYTES:
+            self.flush()
+
+    def flush(self):
+        if self.parts:
+            self.f.write(b"".join(self.parts))
+            self.parts.clear()
+            self.size = 0
+
+
+# =========================
+# WRITERS (binary file-like `f`; return the number of turns written)
+# =========================
+def write_jsonl(user_id, f):
+    out = _Buffered(f)
+    count = 0
+    for message in retention.iter_history(user_id):
+        out.write(json.dumps(message, ensure_ascii=False) + "\n")
+        count += 1
+    out.flush()
+    return count
+
+
+def write_csv(user_id, f):
+    out = _Buffered(f)
+    row = io.StringIO()
+    writer = csv.writer(row)
+    writer.writerow(["timestamp", "role", "archived", "content"])
+    count = 0
+    for message in retention.iter_history(user_id):
+        writer.writerow([message["timestamp"], message["role"], int(message["archived"]), message["content"]])
+        count += 1
+        if row.tell() >= CHUNK_BYTES:
+            out.write(row.getvalue())
+            row.seek(0)
+            row.truncate()
+    out.write(row.getvalue())
+    out.flush()
+    return count
+
+
+def _pdf_volume(messages, f, title):
+    pdf = canvas.Canvas(f, pagesize=A4, pageCompression=1)
+    width, height = A4
+    page = 1
+
+    def new_page():
+        pdf.setFont("Helvetica-Oblique", 8)
+        pdf.drawString(72, 40, f"{title} - page {page}")
+        pdf.setFont("Helvetica", 9)
+        return height - 60
+
+    pdf.setFont("Helvetica-Bold", 14)
+    pdf.drawString(72, height - 60, title)
+    y = height - 90
+    pdf.setFont("Helvetica", 9)
+    count = 0
+    for message in messages:
+        count += 1
+        header = f"[{message['timestamp']}] {message['role']}{' (archived)' if message['archived'] else ''}"
+        lines = [header] + simpleSplit(message["content"], "Helvetica", 9, width - 144)
+        for i, line in enumerate(lines):
+            if y < 60:
+                pdf.showPage()
+                page += 1
+                y = new_page()
+            pdf.setFont("Helvetica-Bold" if i == 0 else "Helvetica", 9)
+            pdf.drawString(72, y, line)
+            y -= 12
+        y -= 6
+    pdf.showPage()
+    pdf.save()
+    return count
+
+
+def _volumes(messages):
+    """Runs of up to PDF_VOLUME_MESSAGES turns, each read lazily from `messages` (consume in order)."""
+    messages = iter(messages)
+    for first in messages:
+        yield itertools.chain([first], itertools.islice(messages, PDF_VOLUME_MESSAGES - 1))
+
+
+def _require_reportlab():
+    if canvas is None or A4 is None:
+        raise RuntimeError("reportlab not installed. Run: pip install reportlab")
+
+
+def write_pdf(user_id, f):
+    """One PDF document, whatever the history's length (see resolve_format)."""
+    _require_reportlab()
+    return _pdf_volume(retention.iter_history(user_id), f, PDF_TITLE)
+
+
+def write_pdf_zip(user_id, f):
+    """A zip of PDF volumes of PDF_VOLUME_MESSAGES turns each."""
+    _require_reportlab()
+    count = 0
+    # Works on non-seekable streams (zipfile falls back to data descriptors)
+    with zipfile.ZipFile(f, "w", compression=zipfile.ZIP_STORED) as zf:
+        for n, volume in enumerate(_volumes(retention.iter_history(user_id)), 1):
+            with zf.open(f"history_{n:04d}.pdf", "w", force_zip64=True) as member:
+                count += _pdf_volume(volume, member, f"{PDF_TITLE} (part {n})")
+    return count
+
+
+WRITERS = {"jsonl": write_jsonl, "csv": write_csv, "pdf": write_pdf, "pdf_zip": write_pdf_zip}
+
+
+def write_export(user_id, fmt, f):
+    """Write `fmt` (a format from resolve_format) to `f`; returns the number of turns."""
+    if fmt not in WRITERS:
+        raise ValueError(f"unknown export format {fmt!r}")
+    return WRITERS[fmt](user_id, f)
+
+
+# =========================
+# PULL-BASED STREAMING
+# =========================
+class _QueueSink:
+    """Write-only file-like that blocks once `maxsize` chunks are waiting."""
+
+    def __init__(self, q):
+        self.q = q
+        self.closed = False
+
+    def write(self, data):
+        if self.closed:
+            raise BrokenPipeError("export consumer went away")
+        if not data:
+            return 0
+        chunk = bytes(data)
+        while True:
+            try:
+                self.q.put(chunk, timeout=0.5)
+                return len(data)
+            except queue.Full:
+                if self.closed:
+                    raise BrokenPipeError("export consumer went away")
+
+    def flush(self):
+        pass
+
+
+def iter_export(user_id, fmt, maxsize=16):
+    """Yield the export as byte chunks while a writer thread produces them.
+
+    The queue is bounded, so a slow reader (a download over a slow link)
+    pauses the writer instead of letting output pile up in memory.
+    """
+    q = queue.Queue(maxsize=maxsize)
+    sink = _QueueSink(q)
+    done = object()
+
+    def produce():
+        try:
+            write_export(user_id, fmt, sink)
+            q.put(done)
+        except BaseException as e:
+            if not sink.closed:
+                q.put(e)
+
+    threading.Thread(target=produce, name="history-export", daemon=True).start()
+    try:
+        while True:
+            item = q.get()
+            if item is done:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        # A writer blocked on the full queue notices this and stops
+        sink.closed = True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export a user's chat history")
+    parser.add_argument("user_id", type=int)
+    parser.add_argument("--format", choices=sorted(FORMATS), default="jsonl")
+    args = parser.parse_args(argv)
+    db.init_db()
+    fmt, _, _ = resolve_format(args.format, args.user_id)
+    count = write_export(args.user_id, fmt, sys.stdout.buffer)
+    sys.stdout.buffer.flush()
+    print(f"exported {count} turns", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
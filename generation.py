@@ -0,0 +1,150 @@
+"""Chat answers generated in the background, independent of Streamlit reruns.
+
+Streamlit stops the script whenever the user clicks something, which used to
+end the `for chunk in stream` loop mid-answer: tokens already paid for were
+thrown away and the answer never reached chat_history. A chat turn now hands
+its admitted stream to a Generation; a worker thread drains it into a
+buffer and saves the answer when the stream ends. Script runs only render
+the buffer and find it again by key (login session id, turn), also after a
+browser refresh.
+
+`Generation.stop()` closes the upstream stream at the next chunk
+(singleflight cancels it once nobody else is listening) and the partial
+answer is saved with STOPPED_NOTE. An answer the intent classifier cut short
+(llm.RoutedStream) is not saved; the UI opens the tool instead.
+"""
+import os
+import threading
+import time
+
+import db
+from metrics import CHAT_REQUESTS, GENERATIONS, GENERATIONS_RUNNING
+
+RUNNING = "running"
+DONE = "done"
+STOPPED = "stopped"
+FAILED = "failed"
+REDIRECTED = "redirected"
+
+STOPPED_NOTE = "\n\n_(stopped)_"
+# Finished generations stay attachable this long (seconds)
+KEEP_FINISHED = int(os.environ.get("VYAPAR_GENERATION_KEEP", "600"))
+
+
+class Generation:
+    def __init__(self, key, user_id, stream):
+        self.key = key
+        self.user_id = user_id
+        self.status = RUNNING
+        self.text = ""
+        self.error = None
+        self.intent = "chat"
+        self.data = {}
+        self.finished_at = None
+        self._stream = stream
+        self._stop = threading.Event()
+        self._done = threading.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self._done.is_set()
+
+    @property
+    def content(self) -> str:
+        """The answer as saved to chat_history ("" if nothing is saved)."""
+        if self.status in (STOPPED, FAILED) and self.text:
+            return self.text + STOPPED_NOTE
+        return self.text if self.status == DONE else ""
+
+    def wait(self, timeout=None) -> bool:
+        return self._done.wait(timeout)
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self):
+        try:
+            for chunk in self._stream:
+                if self._stop.is_set():
+                    break
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    self.text += delta
+            if self._stop.is_set():
+                self.status = STOPPED
+            elif getattr(self._stream, "redirected", False):
+                self.status = REDIRECTED
+                self.intent, self.data = self._stream.intent, self._stream.data
+            else:
+                self.status = DONE
+        except Exception as e:
+            self.status = FAILED
+            self.error = str(e)
+        finally:
+            # Closing the stream cancels the upstream request if it is still running
+            self._stream.close()
+            if self.content:
+                try:
+                    db.save_chat_message(self.user_id, "assistant", self.content)
+                except Exception as e:
+                    print(f"generation: could not save answer: {e}")
+            GENERATIONS.labels(outcome=self.status).inc()
+            CHAT_REQUESTS.labels(intent=self.intent).inc()
+            self.finished_at = time.time()
+            self._done.set()
+
+
+class GenerationManager:
+    """Generations by (session, turn); a session runs one answer at a time."""
+
+    def __init__(self, keep=KEEP_FINISHED):
+        self.keep = keep
+        self._lock = threading.Lock()
+        self._generations = {}
+        self._turns = 0
+
+    def start(self, session, user_id, stream) -> Generation:
+        """Drain `stream` on a worker thread, stopping the session's previous answer."""
+        with self._lock:
+            self._prune()
+            for generation in self._generations.values():
+                if generation.key[0] == session and not generation.finished:
+                    generation.stop()
+            self._turns += 1
+            generation = Generation((session, self._turns), user_id, stream)
+            self._generations[generation.key] = generation
+        threading.Thread(target=generation.run, name="generation", daemon=True).start()
+        return generation
+
+    def get(self, key):
+        if key is None:
+            return None
+        with self._lock:
+            return self._generations.get(key)
+
+    def latest(self, session):
+        """The session's newest generation, or None."""
+        with self._lock:
+            keys = [key for key in self._generations if key[0] == session]
+            return self._generations[max(keys)] if keys else None
+
+    def stop_session(self, session):
+        with self._lock:
+            for generation in self._generations.values():
+                if generation.key[0] == session:
+                    generation.stop()
+
+    def running(self) -> int:
+        with self._lock:
+            return sum(1 for g in self._generations.values() if not g.finished)
+
+    def _prune(self):
+        cutoff = time.time() - self.keep
+        for key in [k for k, g in self._generations.items() if g.finished and g.finished_at < cutoff]:
+            del self._generations[key]
+
+
+# Shared by every Streamlit session in the process (app.py is re-executed on
+# each rerun, so the instance lives in an imported module).
+manager = GenerationManager()
+GENERATIONS_RUNNING.set_function(manager.running)
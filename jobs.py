@@ -0,0 +1,554 @@
+"""Durable background jobs for document and PDF work.
+
+Explain Document and invoice/legal PDF generation are written to the `jobs`
+table by `enqueue(...)` and run by workers, so the work survives Streamlit
+reruns and page changes, and throughput scales by adding workers.
+
+A worker claims a job by taking a lease (owner + expiry) and keeps renewing
+it while the job runs. If the worker dies, the lease expires and another
+worker picks the job up again. Failed attempts are retried with exponential
+backoff up to `max_attempts`; a throttled LLM call is retried once the rate
+limiter says so, without using up an attempt.
+
+    queued -> running -> done
+                      -> queued (retry) -> ... -> failed
+
+Each job kind has its own workers, so a quick invoice or legal PDF never
+waits in line behind other users' long explain jobs:
+
+    VYAPAR_JOB_WORKERS=2          worker threads per job kind started in each
+                                  app / API process (default 2, 0 = dedicated
+                                  workers only)
+    python jobs.py --workers 4    dedicated worker processes, 4 per job kind
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+
+import chatstore
+import db
+import documents
+import llm
+import metrics
+import prompts
+import retention
+import uploads
+from metrics import DB_WRITE_SECONDS
+from ratelimit import RateLimited
+from tracing import traced
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+LEASE_SECONDS = 60.0
+POLL_INTERVAL = 1.0
+PROGRESS_INTERVAL = 0.5   # seconds between progress writes while streaming
+MAX_BACKOFF = 300.0
+RETENTION = 7 * 86400     # finished jobs are purged after this many seconds
+PURGE_INTERVAL = 3600.0
+
+
+class LeaseLost(Exception):
+    """The job's lease expired and another worker may have taken it over."""
+
+
+@dataclass
+class Job:
+    id: int
+    user_id: int
+    kind: str
+    params: dict
+    status: str
+    progress: float
+    message: str
+    result: bytes
+    result_type: str
+    error: str
+    attempts: int
+    max_attempts: int
+    created_at: float
+    updated_at: float
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, FAILED)
+
+    def result_json(self):
+        return json.loads(self.result) if self.result and self.result_type == "application/json" else None
+
+
+_COLUMNS = ("id, user_id, kind, params, status, progress, message, result, result_type, error, "
+            "attempts, max_attempts, created_at, updated_at")
+
+
+def _job(row):
+    return Job(row[0], row[1], row[2], json.loads(row[3]), *row[4:])
+
+
+# Wakes this process's idle workers as soon as something is enqueued here.
+_wakeup = threading.Event()
+
+
+# =========================
+# QUEUE
+# =========================
+@traced("jobs.enqueue")
+@DB_WRITE_SECONDS.labels(op="enqueue_job").time()
+def enqueue(user_id, kind, params=None, input=None, max_attempts=3) -> int:
+    """Queue a job. `input` is bytes or an uploads.Upload, copied into job_inputs in chunks."""
+    if kind not in HANDLERS:
+        raise ValueError(f"unknown job kind {kind!r}")
+    now = time.time()
+    conn = db.get_connection()
+    try:
+        c = conn.cursor()
+        c.execute("""
+            INSERT INTO jobs (user_id, kind, params, max_attempts, run_after, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (user_id, kind, json.dumps(params or {}), max_attempts, now, now, now))
+        job_id = c.lastrowid
+        if input is not None:
+            # A large upload never sits in memory whole: the row gets a zeroblob
+            # of its size (kept lazy because it is the record's last column) and
+            # the chunks are copied in with incremental blob I/O.
+            upload = input if isinstance(input, uploads.Upload) else uploads.from_bytes(input)
+            c.execute("INSERT INTO job_inputs (job_id, data) VALUES (?, zeroblob(?))", (job_id, upload.size))
+            with conn.blobopen("job_inputs", "data", job_id, readonly=False) as blob:
+                for chunk in upload.chunks():
+                    blob.write(chunk)
+        conn.commit()
+    finally:
+        conn.close()
+    _wakeup.set()
+    return job_id
+
+
+@traced("jobs.get")
+def get(job_id, user_id=None):
+    """The job, or None. Pass `user_id` to only see that user's jobs."""
+    conn = db.get_connection()
+    c = conn.cursor()
+    if user_id is None:
+        c.execute(f"SELECT {_COLUMNS} FROM jobs WHERE id = ?", (job_id,))
+    else:
+        c.execute(f"SELECT {_COLUMNS} FROM jobs WHERE id = ? AND user_id = ?", (job_id, user_id))
+    row = c.fetchone()
+    conn.close()
+    return _job(row) if row else None
+
+
+@traced("jobs.latest")
+def latest(user_id, kind, since=0.0):
+    """The user's most recent job of `kind` created after `since`."""
+    conn = db.get_connection()
+    c = conn.cursor()
+    c.execute(f"""
+        SELECT {_COLUMNS} FROM jobs
+        WHERE user_id = ? AND kind = ? AND created_at >= ?
+        ORDER BY id DESC LIMIT 1
+    """, (user_id, kind, since))
+    row = c.fetchone()
+    conn.close()
+    return _job(row) if row else None
+
+
+def queue_depth() -> int:
+    conn = db.get_connection()
+    try:
+        return conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def claim(worker_id, kinds=None, lease=LEASE_SECONDS):
+    """Lease the next runnable job (queued and due, or running with an expired lease)."""
+    conn = db.get_connection()
+    conn.isolation_level = None
+    kind_filter, kind_args = "", ()
+    if kinds:
+        kind_filter = f" AND kind IN ({','.join('?' * len(kinds))})"
+        kind_args = tuple(kinds)
+    try:
+        # IMMEDIATE takes the write lock up front, so two workers can never
+        # both see the same job as free.
+        conn.execute("BEGIN IMMEDIATE")
+        while True:
+            now = time.time()
+            row = conn.execute(f"""
+                SELECT id, kind, attempts, max_attempts FROM jobs
+                WHERE ((status = 'queued' AND run_after <= ?) OR (status = 'running' AND lease_expires < ?))
+                {kind_filter}
+                ORDER BY run_after, id LIMIT 1
+            """, (now, now, *kind_args)).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            job_id, kind, attempts, max_attempts = row
+            if attempts >= max_attempts:
+                # Its last worker died mid-run; no attempts left to hand out.
+                conn.execute("""
+                    UPDATE jobs SET status = 'failed', error = 'worker lost (lease expired)',
+                        input = NULL, lease_owner = NULL, updated_at = ?
+                    WHERE id = ?
+                """, (now, job_id))
+                _drop_input(conn, job_id)
+                metrics.JOBS.labels(kind=kind, outcome="failed").inc()
+                if kind == "explain":
+                    metrics.DOCUMENTS_PROCESSED.labels(outcome="error").inc()
+                continue
+            conn.execute("""
+                UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_owner = ?,
+                    lease_expires = ?, updated_at = ?
+                WHERE id = ?
+            """, (worker_id, now + lease, now, job_id))
+            row = conn.execute(f"SELECT {_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            conn.execute("COMMIT")
+            return _job(row)
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def open_input(job):
+    """The job's input as an uploads.Upload (spooled to disk when large), or None."""
+    conn = db.get_connection()
+    try:
+        if conn.execute("SELECT 1 FROM job_inputs WHERE job_id = ?", (job.id,)).fetchone() is None:
+            # Queued before job_inputs existed
+            row = conn.execute("SELECT input FROM jobs WHERE id = ?", (job.id,)).fetchone()
+            return uploads.from_bytes(row[0]) if row and row[0] is not None else None
+        upload = uploads.Upload()
+        with conn.blobopen("job_inputs", "data", job.id) as blob:
+            while chunk := blob.read(uploads.CHUNK_SIZE):
+                upload.write(chunk)
+        return upload.finish()
+    finally:
+        conn.close()
+
+
+def _drop_input(conn, job_id):
+    conn.execute("DELETE FROM job_inputs WHERE job_id = ?", (job_id,))
+
+
+def _update_leased(job_id, worker_id, assignments, args, finished=False):
+    conn = db.get_connection()
+    try:
+        c = conn.cursor()
+        c.execute(
+            f"UPDATE jobs SET {assignments}, updated_at = ? WHERE id = ? AND lease_owner = ? AND status = 'running'",
+            (*args, time.time(), job_id, worker_id))
+        if c.rowcount == 0:
+            conn.rollback()
+            raise LeaseLost(f"job {job_id} is no longer leased by {worker_id}")
+        if finished:
+            _drop_input(conn, job_id)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+@DB_WRITE_SECONDS.labels(op="complete_job").time()
+def complete(job, worker_id, result, result_type):
+    _update_leased(job.id, worker_id, """
+        status = 'done', progress = 1, message = NULL, result = ?, result_type = ?, error = NULL,
+        input = NULL, lease_owner = NULL
+    """, (result, result_type), finished=True)
+
+
+@DB_WRITE_SECONDS.labels(op="fail_job").time()
+def fail(job, worker_id, error, delay=None, count_attempt=True, final=False) -> str:
+    """Reschedule the job, or mark it failed when out of attempts (or `final`). Returns the new status."""
+    attempts = job.attempts if count_attempt else job.attempts - 1
+    if final or attempts >= job.max_attempts:
+        _update_leased(job.id, worker_id, """
+            status = 'failed', error = ?, input = NULL, lease_owner = NULL
+        """, (error,), finished=True)
+        return FAILED
+    if delay is None:
+        delay = min(MAX_BACKOFF, 2.0 ** attempts)
+    _update_leased(job.id, worker_id, """
+        status = 'queued', error = ?, message = ?, attempts = ?, run_after = ?, lease_owner = NULL
+    """, (error, f"Retrying in {max(1, round(delay))}s", attempts, time.time() + delay))
+    return QUEUED
+
+
+def purge(max_age=RETENTION) -> int:
+    conn = db.get_connection()
+    try:
+        c = conn.cursor()
+        c.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?", (time.time() - max_age,))
+        removed = c.rowcount
+        c.execute("DELETE FROM job_inputs WHERE job_id NOT IN (SELECT id FROM jobs)")
+        conn.commit()
+        return removed
+    finally:
+        conn.close()
+
+
+def _queue_depth_or_zero():
+    try:
+        return queue_depth()
+    except Exception:
+        return 0
+
+
+metrics.JOBS_QUEUED.set_function(_queue_depth_or_zero)
+
+
+# =========================
+# HANDLERS
+# =========================
+class JobContext:
+    """Handed to a handler: progress reporting for one leased attempt."""
+
+    def __init__(self, job, worker_id, lease):
+        self.job = job
+        self.worker_id = worker_id
+        self.lease = lease
+        self.lost = False
+        self._last = 0.0
+
+    def progress(self, fraction=None, message=None, partial=None, force=False):
+        """Record progress (and an optional partial result); renews the lease.
+
+        Calls closer together than PROGRESS_INTERVAL are dropped unless `force`.
+        Raises LeaseLost if another worker has taken the job over.
+        """
+        if self.lost:
+            raise LeaseLost(f"job {self.job.id} lease lost")
+        now = time.monotonic()
+        if not force and now - self._last < PROGRESS_INTERVAL:
+            return
+        self._last = now
+        assignments, args = ["lease_expires = ?"], [time.time() + self.lease]
+        if fraction is not None:
+            assignments.append("progress = ?")
+            args.append(fraction)
+        if message is not None:
+            assignments.append("message = ?")
+            args.append(message)
+        if partial is not None:
+            assignments.append("result = ?")
+            args.append(partial)
+        try:
+            _update_leased(self.job.id, self.worker_id, ", ".join(assignments), args)
+        except LeaseLost:
+            self.lost = True
+            raise
+
+
+def _json(obj) -> bytes:
+    return json.dumps(obj).encode()
+
+
+def _run_invoice(job, ctx):
+    ctx.progress(0.1, "Generating invoice PDF", force=True)
+    amount = float(job.params.get("amount", 0) or 0)
+    pdf = documents.generate_invoice_pdf(job.params.get("customer", ""), amount)
+    return pdf.getvalue(), "application/pdf"
+
+
+def _run_legal(job, ctx):
+    ctx.progress(0.1, f"Generating {job.params.get('doc_type', 'document')}", force=True)
+    pdf = documents.generate_legal_doc_pdf(job.params.get("doc_type", ""), job.params.get("name", ""))
+    return pdf.getvalue(), "application/pdf"
+
+
+def _run_explain(job, ctx):
+    ctx.progress(0.05, "Reading the PDF", force=True)
+    page_count = None
+    # Only the chosen pages ("first-last") are parsed and explained
+    pages = documents.parse_page_range(job.params.get("pages"))
+    with open_input(job) or uploads.from_bytes(b"") as upload:
+        text = documents.read_pdf_text(upload, max_chars=int(job.params.get("max_chars", 8000)), pages=pages)
+        if pages is not None:
+            page_count = documents.PdfDocument(upload).page_count
+    prompt = documents.document_summary_prompt(text, pages, page_count)
+    # The conversation so far, bounded like a chat session's window (not sent in params)
+    messages = chatstore.recent_messages(job.user_id)
+    user = db.get_user(job.user_id)
+    messages = prompts.chat_messages(messages + [{"role": "user", "content": prompt}],
+                                     first_name=user.first_name if user else None)
+    out = {"preview": text[:1500], "answer": ""}
+    ctx.progress(0.2, "Waiting for the AI", partial=_json(out), force=True)
+
+    def on_wait(eta):
+        ctx.progress(message=f"Queued for AI capacity (about {max(1, round(eta))}s)", force=True)
+
+    max_tokens = int(job.params.get("max_tokens", 800))
+    # A failure or throttle here is retried; the worker counts the job's final outcome
+    stream = llm.llm_chat(messages, max_tokens=max_tokens, user_id=job.user_id, on_wait=on_wait)
+    chunks = 0
+    try:
+        for chunk in stream:
+            delta = chunk.choices[0].delta.content
+            if delta:
+                chunks += 1
+                out["answer"] += delta
+                ctx.progress(0.2 + 0.75 * min(1.0, chunks / max_tokens), "Explaining", partial=_json(out))
+    finally:
+        stream.close()
+
+    db.save_chat_message(job.user_id, "user", prompt)
+    db.save_chat_message(job.user_id, "assistant", out["answer"])
+    metrics.DOCUMENTS_PROCESSED.labels(outcome="ok").inc()
+    out["prompt"] = prompt
+    return _json(out), "application/json"
+
+
+# kind -> handler(job, ctx) -> (result bytes, content type)
+HANDLERS = {
+    "invoice": _run_invoice,
+    "legal": _run_legal,
+    "explain": _run_explain,
+}
+
+
+# =========================
+# WORKERS
+# =========================
+class Worker:
+    def __init__(self, kinds=None, poll_interval=POLL_INTERVAL, lease=LEASE_SECONDS, name=None):
+        self.kinds = list(kinds) if kinds else None
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.id = name or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.processed = 0
+
+    def _keep_lease(self, ctx, done):
+        # Renews the lease while a handler is busy in a long call (PDF parse,
+        # waiting for admission) that does not report progress itself.
+        while not done.wait(self.lease / 3):
+            try:
+                ctx.progress(force=True)
+            except LeaseLost:
+                return
+            except Exception as e:
+                print(f"jobs: lease renewal for job {ctx.job.id} failed: {e}")
+
+    def run_once(self) -> bool:
+        """Run one job if any is due. Returns False when the queue was empty."""
+        job = claim(self.id, self.kinds, self.lease)
+        if job is None:
+            return False
+        retention.touch()
+        ctx = JobContext(job, self.id, self.lease)
+        done = threading.Event()
+        threading.Thread(target=self._keep_lease, args=(ctx, done), daemon=True).start()
+        start = time.perf_counter()
+        try:
+            result, result_type = HANDLERS[job.kind](job, ctx)
+            done.set()
+            complete(job, self.id, result, result_type)
+            outcome = "done"
+        except LeaseLost:
+            outcome = "lost"
+        except RateLimited as e:
+            done.set()
+            fail(job, self.id, str(e), delay=e.retry_after, count_attempt=False)
+            outcome = "throttled"
+        except Exception as e:
+            done.set()
+            try:
+                # A page range outside the document fails the same way on every attempt
+                status = fail(job, self.id, f"{type(e).__name__}: {e}", final=isinstance(e, documents.PageRangeError))
+                outcome = "failed" if status == FAILED else "retried"
+            except LeaseLost:
+                outcome = "lost"
+        finally:
+            done.set()
+            metrics.JOB_SECONDS.labels(kind=job.kind).observe(time.perf_counter() - start)
+        metrics.JOBS.labels(kind=job.kind, outcome=outcome).inc()
+        if outcome == "failed" and job.kind == "explain":
+            # Once per document, when no attempts are left (not on each retried attempt)
+            metrics.DOCUMENTS_PROCESSED.labels(outcome="error").inc()
+        self.processed += 1
+        return True
+
+    def run(self, stop=None):
+        stop = stop or threading.Event()
+        last_purge = 0.0
+        while not stop.is_set():
+            try:
+                worked = self.run_once()
+            except Exception as e:
+                print(f"jobs: worker {self.id}: {e}")
+                worked = False
+            if worked:
+                continue
+            if time.time() - last_purge > PURGE_INTERVAL:
+                last_purge = time.time()
+                try:
+                    purge()
+                except Exception as e:
+                    print(f"jobs: purge failed: {e}")
+            _wakeup.wait(self.poll_interval)
+            _wakeup.clear()
+
+
+def start_workers(count, kinds=None, poll_interval=POLL_INTERVAL):
+    """Run `count` worker threads for each of `kinds` (default: every kind) in this process.
+
+    Returns (workers, stop event).
+    """
+    stop = threading.Event()
+    workers = [Worker([kind], poll_interval) for kind in kinds or HANDLERS for _ in range(count)]
+    for i, worker in enumerate(workers):
+        threading.Thread(target=worker.run, args=(stop,), name=f"job-worker-{worker.kinds[0]}-{i}",
+                         daemon=True).start()
+    return workers, stop
+
+
+_workers_lock = threading.Lock()
+_workers_started = False
+
+
+def start_workers_from_env():
+    """Start VYAPAR_JOB_WORKERS worker threads per job kind, once per process; safe to call on every rerun."""
+    global _workers_started
+    with _workers_lock:
+        if _workers_started:
+            return
+        _workers_started = True
+        count = int(os.environ.get("VYAPAR_JOB_WORKERS", "2"))
+        if count > 0:
+            start_workers(count)
+
+
+def _worker_process(kinds, poll_interval):
+    Worker(kinds, poll_interval).run()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="VyaparGPT background job workers")
+    parser.add_argument("--workers", type=int, default=2, help="worker processes per job kind")
+    parser.add_argument("--kinds", nargs="+", choices=sorted(HANDLERS), help="only run these job kinds")
+    parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL)
+    args = parser.parse_args(argv)
+
+    db.init_db()
+    metrics.start_exporter_from_env()
+    kinds = args.kinds or sorted(HANDLERS)
+    print(f"VyaparGPT job workers: {args.workers} process(es) for each of {', '.join(kinds)} on {db.DB_PATH}")
+    ctx = multiprocessing.get_context("spawn")
+    procs = [ctx.Process(target=_worker_process, args=([kind], args.poll_interval), daemon=True)
+             for kind in kinds for _ in range(args.workers)]
+    for p in procs:
+        p.start()
+    try:
+        for p in procs:
+            p.join()
+    except KeyboardInterrupt:
+        for p in procs:
+            p.terminate()
+
+if __name__ == "__main__":
+    main()
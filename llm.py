@@ -0,0 +1,321 @@
+"""Groq (OpenAI-compatible) chat client, intent detection and intent routing."""
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+# Groq OpenAI-compatible client
+from openai import OpenAI
+from cache import LLM_CHAT_CACHE, llm_answers
+from metrics import (
+    INTENT_CLASSIFICATIONS, INTENT_CLASSIFIER_SECONDS, LLM_COALESCED, LLM_COMPLETION_CHUNKS, LLM_INFLIGHT,
+    LLM_PROMPT_TOKENS, LLM_REQUESTS, LLM_STREAM_SECONDS, LLM_TTFT,
+)
+from singleflight import coalescer, request_key
+from tracing import trace_stream, traced
+import ratelimit
+import usage
+
+# =========================
+# GROQ CLIENT SETUP
+# =========================
+# Point VYAPAR_LLM_BASE_URL at mock_llm_server.py to run without the network.
+GROQ_API_KEY = os.environ.get("GROQ_API_KEY")
+LLM_BASE_URL = os.environ.get("VYAPAR_LLM_BASE_URL", "https://api.groq.com/openai/v1")
+
+
+class _MissingKey:
+    """Stands in for the client when no API key is configured; any use fails with a clear error."""
+
+    def __getattr__(self, name):
+        raise RuntimeError("GROQ_API_KEY is not set. Export it, or set VYAPAR_LLM_BASE_URL "
+                           "to a local server such as mock_llm_server.py")
+
+
+if GROQ_API_KEY:
+    client = OpenAI(api_key=GROQ_API_KEY, base_url=LLM_BASE_URL)
+elif "VYAPAR_LLM_BASE_URL" in os.environ:
+    # A local OpenAI-compatible server (mock_llm_server.py) ignores the key
+    client = OpenAI(api_key="unused", base_url=LLM_BASE_URL)
+else:
+    client = _MissingKey()
+DEFAULT_MODEL = os.environ.get("VYAPAR_LLM_MODEL", "llama-3.1-8b-instant")
+
+LLM_INFLIGHT.set_function(coalescer.in_flight)
+LLM_COALESCED.labels(role="leader").set_function(lambda: coalescer.leaders)
+LLM_COALESCED.labels(role="follower").set_function(lambda: coalescer.followers)
+
+# =========================
+# HELPERS
+# =========================
+def llm_chat(messages, model=DEFAULT_MODEL, max_tokens=800, user_id=None, on_wait=None, cache=None):
+    key = request_key(messages, model, max_tokens=max_tokens)
+    # A finished answer to the same request by the same user, from this or
+    # another worker process on the host, replays without quota or an
+    # upstream call. Opt-in (cache.LLM_CHAT_CACHE) unless `cache` says otherwise.
+    if cache is None:
+        cache = LLM_CHAT_CACHE
+    answer_key = request_key(messages, model, max_tokens=max_tokens, user_id=user_id) if cache else None
+    cached = llm_answers.get(answer_key) if cache else None
+    if cached is not None:
+        return trace_stream(_replay(cached))
+
+    # Admission control; raises ratelimit.RateLimited when the user is throttled.
+    # The reservation covers the whole answer and is trued up when it ends.
+    reserved = ratelimit.controller.acquire(
+        user_id, ratelimit.estimate_tokens(messages) + max_tokens, on_wait=on_wait)
+
+    # Identical in-flight requests (e.g. the same GST question from many users
+    # around a due date) share a single upstream stream.
+    stream = coalescer.stream(key, lambda: client.chat.completions.create(
+        model=model,
+        messages=messages,
+        max_tokens=max_tokens,
+        stream=True,
+        stream_options={"include_usage": True},
+    ))
+    if not stream.leader:
+        # Joining someone else's stream costs no upstream quota
+        ratelimit.controller.refund(None, reserved)
+    return trace_stream(_observe_stream(stream, model, user_id, messages, reserved, cache_key=answer_key))
+
+def _replay(answer):
+    # Shaped like an OpenAI stream chunk for callers reading choices[0].delta.content
+    yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=answer))], usage=None)
+
+def _chunk_usage(chunk):
+    # OpenAI-style usage chunk, or Groq's x_groq.usage on the final chunk
+    u = getattr(chunk, "usage", None)
+    if u is None:
+        x_groq = getattr(chunk, "x_groq", None)
+        u = x_groq.get("usage") if isinstance(x_groq, dict) else getattr(x_groq, "usage", None)
+    if u is None:
+        return None
+    if isinstance(u, dict):
+        details = u.get("prompt_tokens_details") or {}
+        return u.get("prompt_tokens") or 0, u.get("completion_tokens") or 0, details.get("cached_tokens") or 0
+    # Prompt tokens the provider served from its prefix cache (prompts.py layout)
+    cached = getattr(getattr(u, "prompt_tokens_details", None), "cached_tokens", 0) or 0
+    return getattr(u, "prompt_tokens", 0) or 0, getattr(u, "completion_tokens", 0) or 0, cached
+
+def _observe_stream(stream, model, user_id, messages, reserved=0, cache_key=None):
+    start = time.perf_counter()
+    ttft = None
+    chunks = 0
+    parts = []
+    reported = None
+    outcome = "cancelled"
+    try:
+        for chunk in stream:
+            reported = _chunk_usage(chunk) or reported
+            if not chunk.choices:
+                # Usage-only chunk; callers index chunk.choices[0]
+                continue
+            if chunk.choices[0].delta.content:
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                    LLM_TTFT.labels(model=model).observe(ttft)
+                chunks += 1
+                parts.append(chunk.choices[0].delta.content)
+            yield chunk
+        outcome = "ok"
+    except Exception:
+        outcome = "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        LLM_REQUESTS.labels(model=model, outcome=outcome).inc()
+        LLM_STREAM_SECONDS.labels(model=model).observe(elapsed)
+        LLM_COMPLETION_CHUNKS.labels(model=model).inc(chunks)
+        if reported is not None:
+            prompt_tokens, completion_tokens, cached_tokens = reported
+            LLM_PROMPT_TOKENS.labels(model=model, cached="true").inc(cached_tokens)
+            LLM_PROMPT_TOKENS.labels(model=model, cached="false").inc(prompt_tokens - cached_tokens)
+        else:
+            # Stream ended before the provider reported usage
+            prompt_tokens = sum(len(str(m.get("content") or "")) for m in messages) // 4
+            completion_tokens = chunks
+        usage.record(
+            user_id, model, prompt_tokens, completion_tokens,
+            latency_ms=elapsed * 1000,
+            ttft_ms=ttft * 1000 if ttft is not None else None,
+            estimated=reported is None,
+            shared=not getattr(stream, "leader", True),
+        )
+        ratelimit.controller.refund(
+            user_id, reserved - (prompt_tokens + completion_tokens),
+            shared_quota=getattr(stream, "leader", True))
+        # Only complete answers are reused; followers got the same chunks as the leader
+        if outcome == "ok" and cache_key is not None and parts and getattr(stream, "leader", True):
+            llm_answers.put(cache_key, "".join(parts))
+
+@traced("detect_intent")
+def detect_intent(user_text: str):
+    text = user_text.lower()
+    
+    # More precise invoice detection
+    invoice_phrases = [
+        "create invoice", "generate invoice", "make invoice",
+        "create bill", "generate bill", "make bill",
+        "invoice for", "bill for"
+    ]
+    if any(phrase in text for phrase in invoice_phrases):
+        name_match = re.search(r"(?:invoice|bill|for)\s+(?:for|to|of)?\s*([a-zA-Z\s]+?)\s*(?:for|of|₹|rs|rupees|amount)", text)
+        amt_match = re.search(r"(?:₹|rs\.?|rupees?|inr)\s*(\d{2,7}(?:,\d{3})*(?:\.\d{1,2})?)", text) or \
+                   re.search(r"\b(\d{2,7}(?:,\d{3})*(?:\.\d{1,2})?)\s*(?:₹|rs|rupees|inr)?\b", text)
+        
+        cust = name_match.group(1).strip().title() if name_match else ""
+        amt = float(amt_match.group(1).replace(',', '')) if amt_match else 0.0
+        return ("invoice", {"customer": cust, "amount": amt})
+    
+    # Strict document detection - only when user explicitly mentions uploading
+    doc_phrases = [
+        "upload document", "explain document", "analyze document",
+        "upload pdf", "explain pdf", "analyze pdf",
+        "upload gst", "explain gst", "analyze notice",
+        "can you analyze this", "help me understand this document"
+    ]
+    # Only trigger if user explicitly mentions uploading or analyzing a document
+    has_upload_words = any(word in text for word in ["upload", "analyze", "explain"])
+    has_doc_words = any(word in text for word in ["document", "pdf", "gst", "notice"])
+    if (has_upload_words and has_doc_words) or any(phrase in text for phrase in doc_phrases):
+        return ("document", {})
+    
+    return ("chat", {})
+
+# =========================
+# INTENT ROUTING
+# =========================
+# detect_intent only knows exact phrases ("please bill Ramesh 4500" slips
+# through). When it finds no tool intent but the message has tool-like words,
+# a small model classifies it while the chat answer is already streaming, so
+# plain chat is not held up by a second round-trip.
+INTENT_CLASSIFIER = os.environ.get("VYAPAR_INTENT_CLASSIFIER", "1") != "0"
+INTENT_MODEL = os.environ.get("VYAPAR_INTENT_MODEL", "llama-3.1-8b-instant")
+INTENT_TIMEOUT = float(os.environ.get("VYAPAR_INTENT_TIMEOUT", "3"))
+INTENTS = ("invoice", "document", "chat")
+
+# Words that make a message without a rule match worth a second opinion
+_INTENT_HINTS = re.compile(
+    r"\b(bills?|billing|invoices?|receipts?|charge|pdf|documents?|notices?|letters?|upload|attach\w*|scan\w*)\b"
+    r"|₹|\brs\.?\s*\d|\b\d{3,}")
+
+_CLASSIFIER_PROMPT = """Classify the last message sent to an assistant for Indian MSMEs. Reply with JSON only:
+{"intent": "invoice" | "document" | "chat", "customer": string, "amount": number}
+invoice: the user wants an invoice or bill made out to a customer now.
+document: the user wants to upload a document or PDF, or have one they have read or explained.
+chat: anything else, including questions about how invoices, GST or notices work.
+For invoice, give the customer name and amount if present ("" and 0 otherwise)."""
+
+_classifier_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="intent")
+
+def rule_intent(user_text: str):
+    """(intent, data, sure): detect_intent, plus whether a "chat" verdict needs a second opinion."""
+    intent, data = detect_intent(user_text)
+    return intent, data, intent != "chat" or not _INTENT_HINTS.search(user_text.lower())
+
+@traced("classify_intent")
+def classify_intent(user_text: str, user_id=None, model=INTENT_MODEL):
+    """Small-model structured classification: (intent, data), or None if it failed or was throttled."""
+    start = time.perf_counter()
+    messages = [{"role": "system", "content": _CLASSIFIER_PROMPT}, {"role": "user", "content": user_text}]
+    try:
+        reserved = ratelimit.controller.acquire(user_id, ratelimit.estimate_tokens(messages) + 60)
+    except ratelimit.RateLimited:
+        INTENT_CLASSIFICATIONS.labels(outcome="throttled").inc()
+        return None
+    prompt_tokens = completion_tokens = 0
+    try:
+        response = client.with_options(timeout=INTENT_TIMEOUT, max_retries=0).chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=60,
+            temperature=0,
+            response_format={"type": "json_object"},
+        )
+        if response.usage is not None:
+            prompt_tokens, completion_tokens = response.usage.prompt_tokens, response.usage.completion_tokens
+        out = json.loads(response.choices[0].message.content)
+        intent = out.get("intent")
+        if intent not in INTENTS:
+            raise ValueError(f"unknown intent {intent!r}")
+        data = {}
+        if intent == "invoice":
+            amount = re.sub(r"[^\d.]", "", str(out.get("amount") or 0)) or "0"
+            data = {"customer": str(out.get("customer") or "").strip().title(), "amount": float(amount)}
+    except Exception:
+        INTENT_CLASSIFICATIONS.labels(outcome="error").inc()
+        return None
+    finally:
+        elapsed = time.perf_counter() - start
+        INTENT_CLASSIFIER_SECONDS.observe(elapsed)
+        usage.record(user_id, model, prompt_tokens, completion_tokens, latency_ms=elapsed * 1000,
+                     estimated=not prompt_tokens)
+        ratelimit.controller.refund(user_id, reserved - (prompt_tokens + completion_tokens))
+    return intent, data
+
+class RoutedStream:
+    """A chat answer that a concurrent intent classification may cut short.
+
+    Iterating yields the answer's chunks. If the classifier decides the
+    message was an invoice or document request, iteration stops, the upstream
+    stream is closed (cancelling it) and `intent` / `data` say where to go.
+    A classification that has not finished when the answer ends is ignored.
+    """
+
+    def __init__(self, stream, classification=None):
+        self.intent = "chat"
+        self.data = {}
+        self._stream = stream
+        self._classification = classification
+
+    @property
+    def redirected(self) -> bool:
+        return self.intent != "chat"
+
+    def _verdict(self):
+        if self._classification is None or not self._classification.done():
+            return None
+        classification, self._classification = self._classification, None
+        result = classification.result()
+        if result is None:
+            return None
+        INTENT_CLASSIFICATIONS.labels(outcome="redirect" if result[0] != "chat" else "agree").inc()
+        return result
+
+    def __iter__(self):
+        try:
+            for chunk in self._stream:
+                verdict = self._verdict()
+                if verdict is not None and verdict[0] != "chat":
+                    self.intent, self.data = verdict
+                    return
+                yield chunk
+            if self._classification is not None:
+                # The answer finished first; redirecting after it was shown would be worse
+                self._classification.cancel()
+                self._classification = None
+                INTENT_CLASSIFICATIONS.labels(outcome="late").inc()
+        finally:
+            self.close()
+
+    def close(self):
+        if self._classification is not None:
+            self._classification.cancel()
+            self._classification = None
+        self._stream.close()
+
+def routed_chat(messages, user_text, user_id=None, on_wait=None, classify=True, **kwargs):
+    """llm_chat, with classify_intent running alongside when `classify` (see rule_intent)."""
+    classification = None
+    if classify and INTENT_CLASSIFIER:
+        classification = _classifier_pool.submit(classify_intent, user_text, user_id)
+    try:
+        stream = llm_chat(messages, user_id=user_id, on_wait=on_wait, **kwargs)
+    except BaseException:
+        if classification is not None:
+            classification.cancel()
+        raise
+    return RoutedStream(stream, classification)
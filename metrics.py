@@ -0,0 +1,410 @@
+"""Process-wide metrics in Prometheus text exposition format.
+
+Exposure (pick one, both are opt-in through the environment):
+
+    VYAPAR_METRICS_PORT=9108   serve GET /metrics from a side HTTP listener
+    VYAPAR_METRICS_FILE=/var/lib/node_exporter/vyapar.prom
+                               rewrite a scrape file every VYAPAR_METRICS_INTERVAL
+                               seconds (default 15) for the node_exporter
+                               textfile collector
+
+Metrics:
+
+    vyapar_chat_requests_total{intent}              chat turns by detected intent
+    vyapar_intent_classifications_total{outcome}    small-model intent checks (agree, redirect, late, error, throttled)
+    vyapar_intent_classifier_seconds                intent classification latency
+    vyapar_llm_requests_total{model,outcome}        LLM streams (ok, error, cancelled)
+    vyapar_chat_generations_total{outcome}          background chat answers (done, stopped, redirected, failed)
+    vyapar_chat_generations_running                 background chat answers still streaming
+    vyapar_llm_ttft_seconds{model}                  time to first content chunk
+    vyapar_llm_stream_seconds{model}                full stream duration
+    vyapar_llm_completion_chunks_total{model}       streamed content chunks (~tokens)
+    vyapar_llm_prompt_tokens_total{model,cached}    provider-reported prompt tokens, split by prefix cache hit
+    vyapar_llm_coalesced_requests_total{role}       single-flight leaders / followers
+    vyapar_llm_inflight_streams                     upstream streams currently open
+    vyapar_documents_processed_total{outcome}       Explain Document runs
+    vyapar_pdf_extract_seconds                      PDF text extraction latency (cache misses)
+    vyapar_document_text_chars_total{stage}         extracted document text before (raw) and after (prepared) doctext.py
+    vyapar_pdf_generate_seconds{kind}               invoice / legal PDF generation latency
+    vyapar_auth_events_total{action,outcome}        login, register, session resume, password reset
+    vyapar_usage_rows_dropped_total{reason}         LLM usage rows never written (queue_full, write_failed)
+    vyapar_db_write_seconds{op}                     SQLite write latency
+    vyapar_db_group_commit_size                     chat turns committed per transaction
+    vyapar_user_cache_lookups_total{result}         in-process user record cache (hit, miss)
+    vyapar_cache_lookups_total{cache,tier,result}   LLM answer / PDF text cache lookups per tier (cache.py)
+    vyapar_jobs_total{kind,outcome}                 background jobs (done, retried, failed)
+    vyapar_job_seconds{kind}                        background job run time per attempt
+    vyapar_jobs_queued                              jobs waiting for a worker
+    vyapar_history_archived_messages_total          chat turns moved into archive segments
+    vyapar_maintenance_slice_seconds{task}          idle-time maintenance slices (archive, vacuum)
+    vyapar_process_resident_memory_bytes            RSS of the app process
+
+    python -m benchmarks.metrics_exposition   check the rendered text format (exits 1 on mismatch)
+"""
+import os
+import threading
+import time
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _labels(names, values, extra=None) -> str:
+    pairs = list(zip(names, values)) + list(extra or [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class _Timer:
+    """Context manager and decorator observing elapsed seconds."""
+
+    def __init__(self, observe):
+        self._observe = observe
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._observe(time.perf_counter() - self._start)
+
+    def __call__(self, fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _Timer(self._observe):
+                return fn(*args, **kwargs)
+        return wrapper
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *values, **kwargs):
+        if kwargs:
+            values = tuple(kwargs[n] for n in self.labelnames)
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        key = tuple(str(v) for v in values)
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                child = self._children[key] = self._new_child()
+            return child
+
+    def _default(self):
+        # Unlabelled metrics behave like their single child.
+        return self.labels()
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            children = sorted(self._children.items())
+        for key, child in children:
+            lines.extend(child.samples(self.name, self.labelnames, key))
+        return lines
+
+
+class _Value:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+        self.fn = None
+
+    def inc(self, amount=1.0):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1.0):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value):
+        with self._lock:
+            self.value = float(value)
+
+    def set_function(self, fn):
+        self.fn = fn
+
+    def samples(self, name, labelnames, key):
+        value = self.fn() if self.fn is not None else self.value
+        return [f"{name}{_labels(labelnames, key)} {_fmt(value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1.0):
+        self._default().inc(amount)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1.0):
+        self._default().inc(amount)
+
+    def dec(self, amount=1.0):
+        self._default().dec(amount)
+
+    def set(self, value):
+        self._default().set(value)
+
+    def set_function(self, fn):
+        self._default().set_function(fn)
+
+
+class _HistogramValue:
+    def __init__(self, buckets):
+        self._lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        with self._lock:
+            self.sum += value
+            self.count += 1
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+
+    def time(self):
+        return _Timer(self.observe)
+
+    def samples(self, name, labelnames, key):
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        lines = []
+        cumulative = 0
+        for bound, n in zip(self.buckets, counts):
+            cumulative += n
+            lines.append(f"{name}_bucket{_labels(labelnames, key, [('le', _fmt(bound))])} {cumulative}")
+        lines.append(f"{name}_bucket{_labels(labelnames, key, [('le', '+Inf')])} {count}")
+        lines.append(f"{name}_sum{_labels(labelnames, key)} {_fmt(total)}")
+        lines.append(f"{name}_count{_labels(labelnames, key)} {count}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), registry=None, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"metric {metric.name} already registered")
+            self._metrics[metric.name] = metric
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# =========================
+# METRIC DEFINITIONS
+# =========================
+CHAT_REQUESTS = Counter(
+    "vyapar_chat_requests_total", "Chat turns by detected intent.", ["intent"], registry=REGISTRY)
+INTENT_CLASSIFICATIONS = Counter(
+    "vyapar_intent_classifications_total", "Concurrent small-model intent classifications by outcome.", ["outcome"],
+    registry=REGISTRY)
+INTENT_CLASSIFIER_SECONDS = Histogram(
+    "vyapar_intent_classifier_seconds", "Latency of the small-model intent classification.", registry=REGISTRY)
+GENERATIONS = Counter(
+    "vyapar_chat_generations_total", "Background chat answers by outcome.", ["outcome"], registry=REGISTRY)
+GENERATIONS_RUNNING = Gauge(
+    "vyapar_chat_generations_running", "Background chat answers still streaming.", registry=REGISTRY)
+LLM_REQUESTS = Counter(
+    "vyapar_llm_requests_total", "LLM chat streams by outcome.", ["model", "outcome"], registry=REGISTRY)
+LLM_TTFT = Histogram(
+    "vyapar_llm_ttft_seconds", "Time to first streamed content chunk.", ["model"], registry=REGISTRY)
+LLM_STREAM_SECONDS = Histogram(
+    "vyapar_llm_stream_seconds", "Duration of a full LLM stream.", ["model"], registry=REGISTRY,
+    buckets=(0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0))
+LLM_COMPLETION_CHUNKS = Counter(
+    "vyapar_llm_completion_chunks_total", "Streamed content chunks (roughly tokens).", ["model"], registry=REGISTRY)
+LLM_PROMPT_TOKENS = Counter(
+    "vyapar_llm_prompt_tokens_total", "Prompt tokens reported by the provider, by whether its prefix cache served them.",
+    ["model", "cached"], registry=REGISTRY)
+LLM_COALESCED = Counter(
+    "vyapar_llm_coalesced_requests_total", "LLM requests that opened (leader) or joined (follower) a stream.",
+    ["role"], registry=REGISTRY)
+LLM_INFLIGHT = Gauge(
+    "vyapar_llm_inflight_streams", "Upstream LLM streams currently open.", registry=REGISTRY)
+DOCUMENTS_PROCESSED = Counter(
+    "vyapar_documents_processed_total", "Explain Document runs by outcome.", ["outcome"], registry=REGISTRY)
+DOCUMENT_TEXT_CHARS = Counter(
+    "vyapar_document_text_chars_total", "Characters of extracted document text, raw and after preprocessing.",
+    ["stage"], registry=REGISTRY)
+PDF_EXTRACT_SECONDS = Histogram(
+    "vyapar_pdf_extract_seconds", "Latency of PDF text extraction.", registry=REGISTRY)
+PDF_GENERATE_SECONDS = Histogram(
+    "vyapar_pdf_generate_seconds", "Latency of invoice and legal PDF generation.", ["kind"], registry=REGISTRY)
+AUTH_EVENTS = Counter(
+    "vyapar_auth_events_total", "Authentication events by action and outcome.", ["action", "outcome"],
+    registry=REGISTRY)
+USAGE_ROWS_DROPPED = Counter(
+    "vyapar_usage_rows_dropped_total", "LLM usage rows dropped before reaching the DB, by reason.", ["reason"],
+    registry=REGISTRY)
+DB_WRITE_SECONDS = Histogram(
+    "vyapar_db_write_seconds", "Latency of SQLite writes.", ["op"], registry=REGISTRY,
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+DB_GROUP_COMMIT_SIZE = Histogram(
+    "vyapar_db_group_commit_size", "Writes folded into one group commit.", registry=REGISTRY,
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+USER_CACHE_LOOKUPS = Counter(
+    "vyapar_user_cache_lookups_total", "User record cache lookups by result.", ["result"], registry=REGISTRY)
+CACHE_LOOKUPS = Counter(
+    "vyapar_cache_lookups_total", "Two-level cache lookups by cache, tier (memory, disk) and result.",
+    ["cache", "tier", "result"], registry=REGISTRY)
+JOBS = Counter(
+    "vyapar_jobs_total", "Background job attempts by kind and outcome.", ["kind", "outcome"], registry=REGISTRY)
+JOB_SECONDS = Histogram(
+    "vyapar_job_seconds", "Run time of one background job attempt.", ["kind"], registry=REGISTRY,
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0))
+JOBS_QUEUED = Gauge(
+    "vyapar_jobs_queued", "Background jobs waiting for a worker.", registry=REGISTRY)
+HISTORY_ARCHIVED = Counter(
+    "vyapar_history_archived_messages_total", "Chat turns moved into archive segments.", registry=REGISTRY)
+MAINTENANCE_SLICE_SECONDS = Histogram(
+    "vyapar_maintenance_slice_seconds", "Duration of one idle-time maintenance slice.", ["task"],
+    registry=REGISTRY, buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+PROCESS_RSS = Gauge(
+    "vyapar_process_resident_memory_bytes", "Resident set size of the app process.", registry=REGISTRY)
+
+
+def _rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+PROCESS_RSS.set_function(_rss_bytes)
+
+
+# =========================
+# EXPOSITION
+# =========================
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port, host="0.0.0.0", registry=REGISTRY):
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    server.registry = registry
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def write_textfile(path, registry=REGISTRY):
+    # Write-then-rename so scrapers never read a half-written file.
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        f.write(registry.render())
+    os.replace(tmp, path)
+
+
+def _textfile_loop(path, interval, registry):
+    while True:
+        try:
+            write_textfile(path, registry)
+        except OSError as e:
+            print(f"metrics: could not write {path}: {e}")
+        time.sleep(interval)
+
+
+_exporter_lock = threading.Lock()
+_exporter_started = False
+
+
+def start_exporter_from_env():
+    """Start the configured exporter once per process; safe to call on every rerun."""
+    global _exporter_started
+    with _exporter_lock:
+        if _exporter_started:
+            return
+        _exporter_started = True
+        port = os.environ.get("VYAPAR_METRICS_PORT")
+        if port:
+            try:
+                start_http_server(int(port))
+            except OSError as e:
+                # Another worker process on this host already owns the port.
+                print(f"metrics: could not listen on {port}: {e}")
+        path = os.environ.get("VYAPAR_METRICS_FILE")
+        if path:
+            interval = float(os.environ.get("VYAPAR_METRICS_INTERVAL", "15"))
+            threading.Thread(target=_textfile_loop, args=(path, interval, REGISTRY), daemon=True).start()
@@ -0,0 +1,375 @@
+"""Offline OpenAI-compatible stand-in for the Groq chat completions API.
+
+Serves `POST .../chat/completions` (streaming SSE or plain JSON) with
+configurable time-to-first-token, inter-token delay, error injection and 429s,
+so the chat and document paths can be benchmarked and regression-tested
+without the network.
+
+With --prefill-per-token, time to first token also grows with the prompt
+tokens that have to be processed, and a provider-style prefix cache (at
+message boundaries) lets prompts that start like an earlier one skip that
+part; usage reports it as prompt_tokens_details.cached_tokens.
+
+Requests with response_format {"type": "json_object"} are answered like the
+small-model intent classifier in llm.py (a keyword guess at invoice /
+document / chat) after --classify-latency seconds.
+
+Run standalone:
+
+    python mock_llm_server.py --port 8011 --ttft 0.25 --inter-token-delay 0.01
+
+and point app.py at it:
+
+    VYAPAR_LLM_BASE_URL=http://127.0.0.1:8011/v1 streamlit run app.py
+
+Or embed it (tests, load harness):
+
+    server = MockLLMServer(MockConfig(ttft=0.05)).start()
+    ... server.base_url ...
+    server.stop()
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from hashlib import sha256
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FILLER = (
+    "As an MSME you should keep GST returns, invoices and payment records in order. "
+    "File GSTR-1 by the 11th and GSTR-3B by the 20th of the following month, reconcile "
+    "input tax credit with GSTR-2B, and respond to any notice within the stated deadline. "
+    "Maintain Udyam registration details and consult a tax professional for specific cases."
+).split()
+
+
+@dataclass
+class MockConfig:
+    ttft: float = 0.2                # seconds before the first content chunk
+    inter_token_delay: float = 0.01  # seconds between content chunks
+    completion_tokens: int = 120     # tokens per answer, capped by max_tokens
+    error_rate: float = 0.0          # fraction of requests answered with HTTP 500
+    stream_error_rate: float = 0.0   # fraction of streams aborted part-way
+    rate_limit_rate: float = 0.0     # fraction of requests answered with HTTP 429
+    retry_after: float = 1.0         # Retry-After sent with 429s
+    prefill_per_token: float = 0.0   # extra TTFT per prompt token not served from the prefix cache
+    prefix_cache: bool = True        # reuse prefill of message-aligned prefixes seen before
+    prefix_cache_ttl: float = 0.0    # seconds a prefix stays cached after its last use; 0 = forever
+    classify_latency: float = 0.15   # seconds for a JSON-mode (intent classification) answer
+    seed: int = 0
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def mock_answer(messages, n_tokens):
+    """Deterministic answer text for a conversation, `n_tokens` words long."""
+    last_user = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+    digest = int(sha256(str(last_user).encode()).hexdigest(), 16)
+    start = digest % len(FILLER)
+    words = [FILLER[(start + i) % len(FILLER)] for i in range(n_tokens)]
+    return words
+
+
+def mock_intent(messages):
+    """Keyword stand-in for the intent classifier's JSON answer."""
+    text = str(next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")).lower()
+    amount = re.search(r"(?:₹|rs\.?\s*)?(\d[\d,]{1,9})", text)
+    asking = re.match(r"\s*(what|how|why|when|which|is|are|do|does|can i|should)\b", text)
+    if re.search(r"\b(bill|invoice|charge)\b", text) and amount and not asking:
+        name = re.search(r"\b(?:bill|invoice|charge)\s+(?:for\s+|to\s+)?(?:mr\.?\s+|ms\.?\s+)?([a-z]+)", text)
+        return {"intent": "invoice", "customer": name.group(1).title() if name else "",
+                "amount": float(amount.group(1).replace(",", ""))}
+    if re.search(r"\b(pdf|document|notice|letter|attachment)\b", text) and \
+            re.search(r"\b(upload|attach\w*|read|check|look at|go through|review|sending|sent|this|my)\b", text) and not asking:
+        return {"intent": "document", "customer": "", "amount": 0}
+    return {"intent": "chat", "customer": "", "amount": 0}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "VyaparMockLLM/1.0"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def handle(self):
+        try:
+            super().handle()
+        except ConnectionResetError:
+            # Clients drop idle keep-alive connections; not worth a traceback.
+            self.close_connection = True
+
+    # ---- helpers -------------------------------------------------------
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+
+    def _sse(self, payload):
+        self._write_chunk(f"data: {json.dumps(payload)}\n\n".encode())
+
+    # ---- routes --------------------------------------------------------
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": "mock", "object": "model"}]})
+        elif self.path.rstrip("/").endswith("/stats"):
+            self._send_json(200, self.server.snapshot_stats())
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": {"message": "invalid JSON body"}})
+            return
+
+        cfg = self.server.config
+        self.server.bump("requests")
+        roll = self.server.roll()
+        if roll < cfg.rate_limit_rate:
+            self.server.bump("rate_limited")
+            self._send_json(
+                429,
+                {"error": {"message": "Rate limit reached (mock)", "type": "rate_limit_error"}},
+                headers={"Retry-After": f"{cfg.retry_after:g}"},
+            )
+            return
+        if roll < cfg.rate_limit_rate + cfg.error_rate:
+            self.server.bump("errors")
+            self._send_json(500, {"error": {"message": "Injected upstream failure (mock)", "type": "server_error"}})
+            return
+
+        messages = body.get("messages") or []
+        model = body.get("model") or "mock"
+        if (body.get("response_format") or {}).get("type") == "json_object" and not body.get("stream"):
+            self.server.bump("classifications")
+            time.sleep(cfg.classify_latency)
+            content = json.dumps(mock_intent(messages))
+            prompt_tokens = sum(estimate_tokens(str(m.get("content") or "")) for m in messages)
+            self._send_json(200, {
+                "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": estimate_tokens(content),
+                          "total_tokens": prompt_tokens + estimate_tokens(content)},
+            })
+            return
+        n_tokens = min(cfg.completion_tokens, int(body.get("max_tokens") or cfg.completion_tokens))
+        words = mock_answer(messages, n_tokens)
+        prompt_tokens, cached_tokens = self.server.prefill(messages)
+        ttft = cfg.ttft + cfg.prefill_per_token * (prompt_tokens - cached_tokens)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(words),
+            "total_tokens": prompt_tokens + len(words),
+            "prompt_tokens_details": {"cached_tokens": cached_tokens},
+        }
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+
+        if not body.get("stream"):
+            time.sleep(ttft + cfg.inter_token_delay * len(words))
+            self._send_json(200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": " ".join(words)},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            })
+            return
+
+        abort_at = None
+        if self.server.roll() < cfg.stream_error_rate:
+            abort_at = len(words) // 2
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self.server.bump("streams")
+
+        def chunk(delta, finish_reason=None):
+            return {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+
+        try:
+            time.sleep(ttft)
+            self._sse(chunk({"role": "assistant", "content": ""}))
+            for i, word in enumerate(words):
+                if i == abort_at:
+                    # Simulate the upstream dropping the connection mid-answer.
+                    self.server.bump("stream_errors")
+                    self.close_connection = True
+                    return
+                if i:
+                    time.sleep(cfg.inter_token_delay)
+                self._sse(chunk({"content": word + (" " if i < len(words) - 1 else "")}))
+            self._sse(chunk({}, finish_reason="stop"))
+            if (body.get("stream_options") or {}).get("include_usage"):
+                self._sse({
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [],
+                    "usage": usage,
+                })
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._write_chunk(b"")
+            self.server.bump("completed")
+        except (BrokenPipeError, ConnectionResetError):
+            self.server.bump("cancelled")
+            self.close_connection = True
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # load tests open hundreds of streams at once
+    prefix_cache_entries = 50000
+
+    def __init__(self, config=None, host="127.0.0.1", port=0, verbose=False):
+        super().__init__((host, port), _Handler)
+        self.config = config or MockConfig()
+        self.verbose = verbose
+        self._rng = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._prefixes = OrderedDict()  # hash of messages[:i] -> (prompt tokens up to i, expires)
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def roll(self) -> float:
+        with self._lock:
+            return self._rng.random()
+
+    def bump(self, name, n=1):
+        with self._lock:
+            self._stats[name] = self._stats.get(name, 0) + n
+
+    def prefill(self, messages):
+        """(prompt tokens, tokens served from the prefix cache) for `messages`."""
+        digest = sha256()
+        tokens = 0
+        boundaries = []
+        for m in messages:
+            digest.update(json.dumps({"role": m.get("role"), "content": m.get("content")}, ensure_ascii=False).encode())
+            tokens += estimate_tokens(str(m.get("content") or ""))
+            boundaries.append((digest.hexdigest(), tokens))
+        cached = 0
+        if self.config.prefix_cache:
+            now = time.monotonic()
+            expires = now + self.config.prefix_cache_ttl if self.config.prefix_cache_ttl else float("inf")
+            with self._lock:
+                for key, upto in boundaries:
+                    entry = self._prefixes.get(key)
+                    if entry is None or entry[1] < now:
+                        break
+                    cached = upto
+                for key, upto in boundaries:
+                    self._prefixes[key] = (upto, expires)
+                    self._prefixes.move_to_end(key)
+                while len(self._prefixes) > self.prefix_cache_entries:
+                    self._prefixes.popitem(last=False)
+        self.bump("prompt_tokens", tokens)
+        self.bump("cached_prompt_tokens", cached)
+        return tokens, cached
+
+    def snapshot_stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline OpenAI-compatible mock LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8011)
+    parser.add_argument("--ttft", type=float, default=MockConfig.ttft)
+    parser.add_argument("--inter-token-delay", type=float, default=MockConfig.inter_token_delay)
+    parser.add_argument("--completion-tokens", type=int, default=MockConfig.completion_tokens)
+    parser.add_argument("--error-rate", type=float, default=MockConfig.error_rate)
+    parser.add_argument("--stream-error-rate", type=float, default=MockConfig.stream_error_rate)
+    parser.add_argument("--rate-limit-rate", type=float, default=MockConfig.rate_limit_rate)
+    parser.add_argument("--retry-after", type=float, default=MockConfig.retry_after)
+    parser.add_argument("--prefill-per-token", type=float, default=MockConfig.prefill_per_token)
+    parser.add_argument("--no-prefix-cache", action="store_true")
+    parser.add_argument("--prefix-cache-ttl", type=float, default=MockConfig.prefix_cache_ttl)
+    parser.add_argument("--classify-latency", type=float, default=MockConfig.classify_latency)
+    parser.add_argument("--seed", type=int, default=MockConfig.seed)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    config = MockConfig(
+        ttft=args.ttft,
+        inter_token_delay=args.inter_token_delay,
+        completion_tokens=args.completion_tokens,
+        error_rate=args.error_rate,
+        stream_error_rate=args.stream_error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        prefill_per_token=args.prefill_per_token,
+        prefix_cache=not args.no_prefix_cache,
+        prefix_cache_ttl=args.prefix_cache_ttl,
+        classify_latency=args.classify_latency,
+        seed=args.seed,
+    )
+    server = MockLLMServer(config, host=args.host, port=args.port, verbose=args.verbose)
+    print(f"Mock LLM listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Chat prompt layout.
+
+LLM providers reuse the work done on the longest prompt prefix they have
+already seen (prompt / prefix caching), which cuts time to first token and
+input cost, but only for byte-identical prefixes. Every chat request is
+therefore laid out as:
+
+    1. SYSTEM_PROMPT    static: the same bytes for every user, turn and process
+    2. context          per-user facts (first name, today's date), fixed for the session
+    3. conversation     earlier turns, only ever appended to, then the new one
+
+so (1) is shared by all users and everything but the newest turns by
+consecutive requests of a session, even when a user pauses long enough for
+the provider to drop the session's own prefix. Nothing user-specific may go
+into SYSTEM_PROMPT, and only the first name is ever sent: email and phone
+stay out of LLM requests.
+
+`prefix_fingerprint` hashes a leading slice of a request; STATIC_FINGERPRINT
+is the fingerprint of the static prefix, for checks and dashboards
+(benchmarks/prompt_prefix.py).
+"""
+import json
+import time
+from hashlib import sha256
+
+# Edit with care: any change (even whitespace) starts every provider-side
+# prefix cache from scratch.
+SYSTEM_PROMPT = "You are VyaparGPT, an AI assistant helping Indian MSMEs with business, compliance, invoices, legal, HR, and documents."
+
+
+def system_message():
+    return {"role": "system", "content": SYSTEM_PROMPT}
+
+
+def context_message(first_name=None, today=None):
+    """The per-user / per-turn system message; deliberately nothing beyond the first name."""
+    lines = []
+    if first_name:
+        lines.append(f"The user's first name is {first_name}.")
+    lines.append(f"Today's date is {today or time.strftime('%d %B %Y')}.")
+    return {"role": "system", "content": " ".join(lines)}
+
+
+def chat_messages(history, first_name=None, today=None):
+    """The request for a chat turn: `history` (static system prompt first, newest
+    turn last) with the context message right after the system prompt.
+    `history` itself is not modified.
+    """
+    messages = list(history)
+    # Sessions started before a prompt change still hold the old system prompt
+    if messages and messages[0]["role"] == "system":
+        messages[0] = system_message()
+    else:
+        messages.insert(0, system_message())
+    messages.insert(1, context_message(first_name, today))
+    return messages
+
+
+def prefix_fingerprint(messages, n=None) -> str:
+    """sha256 over the first `n` messages (all if None), as they are serialized for the provider."""
+    head = [{"role": m["role"], "content": m["content"]} for m in messages[:n]]
+    return sha256(json.dumps(head, ensure_ascii=False, separators=(",", ":")).encode()).hexdigest()
+
+
+STATIC_FINGERPRINT = prefix_fingerprint([system_message()])
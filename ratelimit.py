@@ -0,0 +1,324 @@
+"""Per-user admission control for LLM calls.
+
+Every llm_chat call asks the process-wide `controller` for admission before
+it opens a stream. Requests are weighted by estimated tokens (prompt estimate
+plus max_tokens, with the unused part refunded once real usage is known) and
+checked against two token buckets:
+
+* the user's bucket, sized by their tier, so one user pasting huge prompts in
+  a loop only throttles themselves, and
+* a process-wide bucket for the shared upstream quota. When it is saturated,
+  waiting requests are admitted in start-time fair order (SFQ) across users,
+  so a heavy user cannot starve everyone queued behind them.
+
+Bucket levels and tiers live in the `rate_limit_buckets` table and are
+written back in the background, so limits survive process restarts.
+
+Configuration (environment):
+
+    VYAPAR_RATE_TIERS   JSON, e.g. {"free": {"capacity": 12000, "per_minute": 12000}}
+                        capacity 0 means unlimited
+    VYAPAR_DEFAULT_TIER tier for users without a row (default "free")
+    VYAPAR_GLOBAL_TPM   shared upstream tokens per minute (default 300000, 0 = off)
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+
+import db
+
+MAX_USER_WAIT = 5.0    # seconds we will queue a user behind their own bucket
+MAX_QUEUE_WAIT = 30.0  # seconds we will queue for the shared upstream quota
+FLUSH_INTERVAL = 1.0
+POLL_INTERVAL = 0.25
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after, reason="user"):
+        self.retry_after = retry_after
+        self.reason = reason  # "user": own tier exhausted, "busy": shared quota saturated
+        super().__init__(f"rate limited ({reason}), retry after {retry_after:.1f}s")
+
+
+@dataclass(frozen=True)
+class Tier:
+    name: str
+    capacity: float      # bucket size in tokens; 0 = unlimited
+    refill_per_s: float
+
+
+DEFAULT_TIERS = {
+    "free": Tier("free", 12000, 200.0),
+    "pro": Tier("pro", 60000, 1000.0),
+    "unlimited": Tier("unlimited", 0, 0.0),
+}
+
+
+def load_tiers():
+    raw = os.environ.get("VYAPAR_RATE_TIERS")
+    if not raw:
+        return dict(DEFAULT_TIERS)
+    tiers = {}
+    for name, spec in json.loads(raw).items():
+        tiers[name] = Tier(name, float(spec.get("capacity", 0)), float(spec.get("per_minute", 0)) / 60)
+    return tiers
+
+
+def estimate_tokens(messages) -> int:
+    return sum(len(str(m.get("content") or "")) for m in messages) // 4
+
+
+class _Bucket:
+    __slots__ = ("tier", "tokens", "updated")
+
+    def __init__(self, tier, tokens, updated):
+        self.tier = tier
+        self.tokens = tokens
+        self.updated = updated
+
+    def refill(self, now, capacity, rate):
+        if now > self.updated:
+            self.tokens = min(capacity, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+
+    def wait_for(self, weight, rate) -> float:
+        if self.tokens >= weight or rate <= 0:
+            return 0.0
+        return (weight - self.tokens) / rate
+
+
+class _Waiter:
+    __slots__ = ("user_id", "weight", "start", "seq")
+
+    def __init__(self, user_id, weight, start, seq):
+        self.user_id = user_id
+        self.weight = weight
+        self.start = start
+        self.seq = seq
+
+
+class AdmissionController:
+    def __init__(self, tiers=None, default_tier=None, global_tpm=None,
+                 max_user_wait=MAX_USER_WAIT, max_queue_wait=MAX_QUEUE_WAIT, persist=True):
+        self.tiers = tiers or load_tiers()
+        self.default_tier = default_tier or os.environ.get("VYAPAR_DEFAULT_TIER", "free")
+        if global_tpm is None:
+            global_tpm = float(os.environ.get("VYAPAR_GLOBAL_TPM", "300000"))
+        self.global_capacity = float(global_tpm)
+        self.global_rate = self.global_capacity / 60
+        self.max_user_wait = max_user_wait
+        self.max_queue_wait = max_queue_wait
+        self.persist = persist
+
+        self._cond = threading.Condition()
+        self._buckets = {}
+        self._global = _Bucket("global", self.global_capacity, time.time())
+        self._waiters = []
+        self._finish = {}  # user_id -> SFQ finish tag of their last request
+        self._vclock = 0.0
+        self._seq = 0
+        self._dirty = set()
+        self._flusher = None
+        self.throttled = 0
+        self.queued = 0
+
+    # ---- state -----------------------------------------------------------
+    def _tier(self, bucket):
+        return self.tiers.get(bucket.tier) or self.tiers[self.default_tier]
+
+    def _load(self, user_id):
+        row = None
+        if self.persist:
+            conn = db.get_connection()
+            c = conn.cursor()
+            c.execute("SELECT tier, tokens, updated_at FROM rate_limit_buckets WHERE user_id = ?", (user_id,))
+            row = c.fetchone()
+            conn.close()
+        if row is None:
+            tier = self.tiers.get(self.default_tier) or next(iter(self.tiers.values()))
+            return _Bucket(tier.name, tier.capacity, time.time())
+        return _Bucket(row[0], row[1], row[2])
+
+    def _ensure_bucket(self, user_id):
+        """Load a user's bucket into memory; called without the lock, since it may read the DB."""
+        if user_id is None:
+            return
+        with self._cond:
+            if user_id in self._buckets:
+                return
+        loaded = self._load(user_id)
+        with self._cond:
+            # A racing loader may have inserted it meanwhile; the first one wins
+            self._buckets.setdefault(user_id, loaded)
+
+    def _bucket(self, user_id):
+        # Under the lock, after _ensure_bucket; buckets are never dropped
+        return self._buckets[user_id]
+
+    def set_user_tier(self, user_id, tier):
+        if tier not in self.tiers:
+            raise ValueError(f"unknown tier {tier!r}")
+        self._ensure_bucket(user_id)
+        with self._cond:
+            bucket = self._bucket(user_id)
+            bucket.tier = tier
+            self._dirty.add(user_id)
+        self.flush()
+
+    def remaining(self, user_id):
+        """(tokens left, capacity) for a user; capacity 0 means unlimited."""
+        self._ensure_bucket(user_id)
+        with self._cond:
+            bucket = self._bucket(user_id)
+            tier = self._tier(bucket)
+            bucket.refill(time.time(), tier.capacity, tier.refill_per_s)
+            return bucket.tokens, tier.capacity
+
+    # ---- admission -------------------------------------------------------
+    def _user_wait(self, user_id, weight, now):
+        if user_id is None:
+            return 0.0, weight
+        bucket = self._bucket(user_id)
+        tier = self._tier(bucket)
+        if not tier.capacity:
+            return 0.0, weight
+        bucket.refill(now, tier.capacity, tier.refill_per_s)
+        weight = min(weight, tier.capacity)
+        return bucket.wait_for(weight, tier.refill_per_s), weight
+
+    def _global_wait(self, weight, now):
+        if not self.global_capacity:
+            return 0.0
+        self._global.refill(now, self.global_capacity, self.global_rate)
+        return self._global.wait_for(min(weight, self.global_capacity), self.global_rate)
+
+    def _next_waiter(self, now):
+        eligible = [w for w in self._waiters if self._user_wait(w.user_id, w.weight, now)[0] == 0]
+        return min(eligible, key=lambda w: (w.start, w.seq)) if eligible else None
+
+    def _grant(self, waiter, now):
+        self._waiters.remove(waiter)
+        self._vclock = waiter.start
+        if waiter.user_id is not None:
+            bucket = self._buckets[waiter.user_id]
+            if self._tier(bucket).capacity:
+                bucket.tokens -= waiter.weight
+                self._dirty.add(waiter.user_id)
+        if self.global_capacity:
+            self._global.tokens -= min(waiter.weight, self.global_capacity)
+        self._cond.notify_all()
+
+    def acquire(self, user_id, weight, on_wait=None) -> int:
+        """Block until `weight` tokens are admitted for `user_id`.
+
+        Returns the weight actually charged. Raises RateLimited when the user's
+        own bucket, or the shared queue, cannot admit the request in time.
+        `on_wait(seconds)` is called once, without locks held, if the request
+        has to queue.
+        """
+        weight = max(1, int(weight))
+        self._ensure_bucket(user_id)
+        with self._cond:
+            now = time.time()
+            user_wait, weight = self._user_wait(user_id, weight, now)
+            if user_wait > self.max_user_wait:
+                self.throttled += 1
+                raise RateLimited(user_wait, "user")
+            self._seq += 1
+            start = max(self._vclock, self._finish.get(user_id, 0.0))
+            self._finish[user_id] = start + weight
+            waiter = _Waiter(user_id, weight, start, self._seq)
+            self._waiters.append(waiter)
+            deadline = now + max(self.max_queue_wait, user_wait)
+            notified = False
+            while True:
+                now = time.time()
+                chosen = self._next_waiter(now)
+                global_wait = self._global_wait(weight, now) if chosen is waiter else None
+                if global_wait == 0:
+                    self._grant(waiter, now)
+                    self._schedule_flush()
+                    return weight
+                if now >= deadline:
+                    self._waiters.remove(waiter)
+                    self._cond.notify_all()
+                    self.throttled += 1
+                    reason = "user" if self._user_wait(user_id, weight, now)[0] else "busy"
+                    raise RateLimited(global_wait or POLL_INTERVAL * 4, reason)
+                if not notified:
+                    notified = True
+                    self.queued += 1
+                    if on_wait is not None:
+                        eta = max(self._user_wait(user_id, weight, now)[0], global_wait or 0.0)
+                        self._cond.release()
+                        try:
+                            on_wait(eta)
+                        finally:
+                            self._cond.acquire()
+                        continue
+                self._cond.wait(min(POLL_INTERVAL, deadline - now, global_wait or POLL_INTERVAL))
+
+    def refund(self, user_id, tokens, shared_quota=True):
+        """Return unused reserved tokens once real usage is known."""
+        if tokens <= 0:
+            return
+        with self._cond:
+            now = time.time()
+            if user_id is not None and user_id in self._buckets:
+                bucket = self._buckets[user_id]
+                tier = self._tier(bucket)
+                if tier.capacity:
+                    bucket.refill(now, tier.capacity, tier.refill_per_s)
+                    bucket.tokens = min(tier.capacity, bucket.tokens + tokens)
+                    self._dirty.add(user_id)
+            if shared_quota and self.global_capacity:
+                self._global.refill(now, self.global_capacity, self.global_rate)
+                self._global.tokens = min(self.global_capacity, self._global.tokens + tokens)
+            self._cond.notify_all()
+
+    # ---- persistence -----------------------------------------------------
+    def _schedule_flush(self):
+        if not self.persist or self._flusher is not None:
+            return
+        self._flusher = threading.Thread(target=self._flush_loop, name="ratelimit-flush", daemon=True)
+        self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"ratelimit: flush failed: {e}")
+
+    def flush(self):
+        if not self.persist:
+            return
+        with self._cond:
+            rows = [
+                (uid, self._buckets[uid].tier, self._buckets[uid].tokens, self._buckets[uid].updated)
+                for uid in self._dirty
+            ]
+            self._dirty.clear()
+        if not rows:
+            return
+        conn = db.get_connection()
+        try:
+            conn.executemany("""
+                INSERT INTO rate_limit_buckets (user_id, tier, tokens, updated_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    tier = excluded.tier,
+                    tokens = excluded.tokens,
+                    updated_at = excluded.updated_at
+            """, rows)
+            conn.commit()
+        finally:
+            conn.close()
+
+
+controller = AdmissionController()
+atexit.register(controller.flush)
@@ -0,0 +1,284 @@
+"""Chat history retention, archival and incremental vacuum.
+
+`chat_history` holds only the hot part of each conversation: the last
+VYAPAR_HISTORY_HOT_DAYS days, capped at VYAPAR_HISTORY_HOT_MESSAGES turns
+per user. Older turns are moved into compressed per-user segments in
+`chat_archive` (JSON lines, zstd/zlib via db.compress), where they stay
+searchable (`search_history`) and exportable (`iter_history`, export.py).
+
+Archiving and page reclamation run in the background in bounded slices, and
+only while the process is idle: every request path calls `touch()`, and the
+maintenance thread waits until nothing has touched it for IDLE_AFTER seconds.
+Each slice moves at most SEGMENT_ROWS turns for one user, or frees at most
+VACUUM_PAGES pages with `PRAGMA incremental_vacuum`, then re-checks idleness.
+Archival only applies to the SQLite backend; with PostgreSQL (storage.py)
+chat history stays in one table.
+
+Configuration (environment):
+
+    VYAPAR_HISTORY_HOT_DAYS       days of history kept hot (default 90)
+    VYAPAR_HISTORY_HOT_MESSAGES   turns kept hot per user (default 400)
+    VYAPAR_MAINTENANCE            0 disables the background thread (default 1)
+
+Databases created before incremental vacuum need a one-off conversion (a
+full VACUUM, so run it off-peak):
+
+    python retention.py --enable-incremental-vacuum
+    python retention.py --run-once          archive + vacuum until done
+"""
+import argparse
+import json
+import os
+import threading
+import time
+
+import db
+import metrics
+
+HOT_DAYS = float(os.environ.get("VYAPAR_HISTORY_HOT_DAYS", "90"))
+HOT_MESSAGES = int(os.environ.get("VYAPAR_HISTORY_HOT_MESSAGES", "400"))
+SEGMENT_ROWS = 200       # turns archived per slice (one segment)
+VACUUM_PAGES = 256       # pages freed per incremental_vacuum slice
+MIN_FREE_PAGES = 64      # below this, vacuuming is not worth a slice
+IDLE_AFTER = 10.0        # seconds without activity before maintenance runs
+CHECK_INTERVAL = 5.0
+SLICE_PAUSE = 0.05       # breathing room between slices for live requests
+
+_last_activity = time.monotonic()
+
+
+def touch():
+    """Mark the process busy; maintenance backs off for IDLE_AFTER seconds."""
+    global _last_activity
+    _last_activity = time.monotonic()
+
+
+def idle() -> bool:
+    return time.monotonic() - _last_activity >= IDLE_AFTER
+
+
+def _cutoff(hot_days):
+    # chat_history.timestamp is SQLite CURRENT_TIMESTAMP (UTC text)
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(time.time() - hot_days * 86400))
+
+
+# =========================
+# ARCHIVAL
+# =========================
+def _user_to_archive(c, cutoff, hot_messages):
+    row = c.execute("SELECT user_id FROM chat_history WHERE timestamp < ? LIMIT 1", (cutoff,)).fetchone()
+    if row is None:
+        row = c.execute("""
+            SELECT user_id FROM chat_history GROUP BY user_id HAVING COUNT(*) > ? LIMIT 1
+        """, (hot_messages,)).fetchone()
+    return row[0] if row else None
+
+
+def archive_slice(hot_days=None, hot_messages=None, max_rows=SEGMENT_ROWS, user_id=None) -> int:
+    """Move up to `max_rows` cold turns of one user into a new segment. Returns turns moved.
+
+    Picks any user with cold turns unless `user_id` is given.
+    """
+    hot_days = HOT_DAYS if hot_days is None else hot_days
+    hot_messages = HOT_MESSAGES if hot_messages is None else hot_messages
+    cutoff = _cutoff(hot_days)
+    conn = db.get_connection()
+    conn.isolation_level = None
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        c = conn.cursor()
+        if user_id is None:
+            user_id = _user_to_archive(c, cutoff, hot_messages)
+        if user_id is None:
+            conn.execute("COMMIT")
+            return 0
+        # Everything older than the cutoff, or beyond the newest `hot_messages` turns
+        boundary = c.execute("""
+            SELECT id FROM chat_history WHERE user_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?
+        """, (user_id, hot_messages)).fetchone()
+        rows = c.execute("""
+            SELECT h.id, h.role, h.content, h.timestamp, b.codec, b.data FROM chat_history h
+            LEFT JOIN blobs b ON b.hash = h.blob_hash
+            WHERE h.user_id = ? AND (h.timestamp < ? OR h.id <= ?)
+            ORDER BY h.id LIMIT ?
+        """, (user_id, cutoff, boundary[0] if boundary else 0, max_rows)).fetchall()
+        if not rows:
+            conn.execute("COMMIT")
+            return 0
+        lines = []
+        for _, role, content, ts, codec, data in rows:
+            if codec is not None:
+                content = db.decompress(codec, data).decode("utf-8")
+            lines.append(json.dumps({"role": role, "content": content, "timestamp": ts}))
+        raw = "\n".join(lines).encode("utf-8")
+        codec, data = db.compress(raw)
+        c.execute("""
+            INSERT INTO chat_archive (user_id, first_ts, last_ts, message_count, raw_size, codec, data, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (user_id, rows[0][3], rows[-1][3], len(rows), len(raw), codec, data, time.time()))
+        last_id = rows[-1][0]
+        where = "user_id = ? AND id <= ? AND (timestamp < ? OR id <= ?)"
+        args = (user_id, last_id, cutoff, boundary[0] if boundary else 0)
+        db.release_blobs(c, where, args)
+        c.execute(f"DELETE FROM chat_history WHERE {where}", args)
+        conn.execute("COMMIT")
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    metrics.HISTORY_ARCHIVED.inc(len(rows))
+    return len(rows)
+
+
+# =========================
+# VACUUM
+# =========================
+def vacuum_slice(max_pages=VACUUM_PAGES) -> int:
+    """Return up to `max_pages` free pages to the filesystem. Returns pages freed."""
+    conn = db.get_connection()
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return 0
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if free < MIN_FREE_PAGES:
+            return 0
+        # executescript steps the pragma to completion; execute() frees one page
+        conn.executescript(f"PRAGMA incremental_vacuum({int(max_pages)});")
+        return free - conn.execute("PRAGMA freelist_count").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def enable_incremental_vacuum():
+    """Switch an existing database to auto_vacuum=INCREMENTAL (rewrites the file once)."""
+    conn = db.get_connection()
+    try:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        return conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    finally:
+        conn.close()
+
+
+def storage_stats():
+    conn = db.get_connection()
+    try:
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        return {
+            "auto_vacuum": {0: "none", 1: "full", 2: "incremental"}[conn.execute("PRAGMA auto_vacuum").fetchone()[0]],
+            "file_bytes": conn.execute("PRAGMA page_count").fetchone()[0] * page_size,
+            "free_bytes": conn.execute("PRAGMA freelist_count").fetchone()[0] * page_size,
+            "hot_messages": conn.execute("SELECT COUNT(*) FROM chat_history").fetchone()[0],
+            "archived_messages": conn.execute("SELECT COALESCE(SUM(message_count), 0) FROM chat_archive").fetchone()[0],
+            "archive_segments": conn.execute("SELECT COUNT(*) FROM chat_archive").fetchone()[0],
+        }
+    finally:
+        conn.close()
+
+
+# =========================
+# SEARCH & EXPORT
+# =========================
+def _segments(user_id, newest_first=False):
+    conn = db.get_connection()
+    try:
+        order = "DESC" if newest_first else "ASC"
+        ids = [r[0] for r in conn.execute(
+            f"SELECT id FROM chat_archive WHERE user_id = ? ORDER BY id {order}", (user_id,))]
+        for segment_id in ids:
+            row = conn.execute("SELECT codec, data FROM chat_archive WHERE id = ?", (segment_id,)).fetchone()
+            if row is None:
+                continue
+            # One segment decompressed at a time keeps memory flat
+            lines = db.decompress(*row).decode("utf-8").split("\n")
+            yield [json.loads(line) for line in (reversed(lines) if newest_first else lines)]
+    finally:
+        conn.close()
+
+
+def iter_history(user_id, include_archive=True):
+    """Every turn for a user, oldest first: archived segments, then hot rows."""
+    if include_archive:
+        for segment in _segments(user_id):
+            for message in segment:
+                yield {**message, "archived": True}
+    for message in db.repository().iter_chat_history(user_id):
+        yield {**message, "archived": False}
+
+
+def search_history(user_id, query, limit=50):
+    """Turns containing `query` (case-insensitive), newest first, hot rows then archive."""
+    needle = query.lower()
+    if not needle:
+        return []
+    hits = []
+    hot = [m for m in iter_history(user_id, include_archive=False) if needle in m["content"].lower()]
+    hits.extend(reversed(hot))
+    for segment in _segments(user_id, newest_first=True):
+        if len(hits) >= limit:
+            break
+        hits.extend({**m, "archived": True} for m in segment if needle in m["content"].lower())
+    return hits[:limit]
+
+
+# =========================
+# IDLE-TIME MAINTENANCE
+# =========================
+def run_slice():
+    """One bounded unit of maintenance work. Returns False when there is nothing to do."""
+    # Archival moves rows out of SQLite's chat_history; other backends keep one table
+    if db.repository().kind == "sqlite":
+        with metrics.MAINTENANCE_SLICE_SECONDS.labels(task="archive").time():
+            if archive_slice():
+                return True
+    with metrics.MAINTENANCE_SLICE_SECONDS.labels(task="vacuum").time():
+        return vacuum_slice() > 0
+
+
+def _maintenance_loop(stop):
+    while not stop.wait(CHECK_INTERVAL):
+        try:
+            while idle() and not stop.is_set() and run_slice():
+                time.sleep(SLICE_PAUSE)
+        except Exception as e:
+            print(f"retention: maintenance failed: {e}")
+
+
+_maintenance_lock = threading.Lock()
+_maintenance_started = False
+
+
+def start_maintenance_from_env():
+    """Start the idle-time maintenance thread once per process; safe to call on every rerun."""
+    global _maintenance_started
+    with _maintenance_lock:
+        if _maintenance_started:
+            return
+        _maintenance_started = True
+        if os.environ.get("VYAPAR_MAINTENANCE", "1") != "0":
+            threading.Thread(target=_maintenance_loop, args=(threading.Event(),),
+                             name="history-maintenance", daemon=True).start()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Chat history retention and vacuum")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true",
+                        help="one-off full VACUUM to switch an existing DB to auto_vacuum=INCREMENTAL")
+    parser.add_argument("--run-once", action="store_true", help="archive and vacuum until nothing is left")
+    args = parser.parse_args(argv)
+
+    db.init_db()
+    if args.enable_incremental_vacuum:
+        print("auto_vacuum=INCREMENTAL" if enable_incremental_vacuum() else "could not enable incremental vacuum")
+    if args.run_once:
+        slices = 0
+        while run_slice():
+            slices += 1
+        print(f"{slices} maintenance slice(s)")
+    print(json.dumps(storage_stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""Single-flight coalescing for streamed LLM requests.
+
+Identical concurrent requests (same model, parameters and whitespace-normalized
+messages) share one upstream stream. The first caller opens it on a background
+thread; every caller, including ones that join mid-stream, replays the chunks
+received so far and then follows the live stream.
+"""
+import json
+import threading
+from hashlib import sha256
+
+
+def _normalize_content(content):
+    if isinstance(content, str):
+        return " ".join(content.split())
+    return content
+
+
+def request_key(messages, model, **params) -> str:
+    payload = {
+        "model": model,
+        "messages": [
+            {"role": m["role"], "content": _normalize_content(m["content"])}
+            for m in messages
+        ],
+        "params": params,
+    }
+    return sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+
+class _Flight:
+    def __init__(self, key):
+        self.key = key
+        self.chunks = []
+        self.done = False
+        self.cancelled = False
+        self.error = None
+        self.subscribers = 0
+        self.cond = threading.Condition()
+
+
+class Subscription:
+    """Iterator over a coalesced stream; `leader` is True for the caller that opened it."""
+
+    def __init__(self, chunks, leader):
+        self._chunks = chunks
+        self.leader = leader
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._chunks)
+
+    def close(self):
+        self._chunks.close()
+
+
+class StreamCoalescer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._flights)
+
+    def stream(self, key, open_stream):
+        """Return an iterator over the chunks of the stream identified by `key`.
+
+        `open_stream` is only called if no identical request is in flight.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight(key)
+                self._flights[key] = flight
+                self.leaders += 1
+            else:
+                self.followers += 1
+            with flight.cond:
+                flight.subscribers += 1
+        if leader:
+            threading.Thread(target=self._pump, args=(flight, open_stream), daemon=True).start()
+        return Subscription(self._subscribe(flight), leader)
+
+    def _pump(self, flight, open_stream):
+        upstream = None
+        try:
+            upstream = open_stream()
+            for chunk in upstream:
+                with flight.cond:
+                    if flight.cancelled:
+                        break
+                    flight.chunks.append(chunk)
+                    flight.cond.notify_all()
+        except Exception as e:
+            flight.error = e
+        finally:
+            # Closing the upstream response stops token generation we would
+            # otherwise pay for after the last subscriber went away.
+            if flight.cancelled and hasattr(upstream, "close"):
+                try:
+                    upstream.close()
+                except Exception:
+                    pass
+            self._retire(flight)
+            with flight.cond:
+                flight.done = True
+                flight.cond.notify_all()
+
+    def _retire(self, flight):
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+
+    def _subscribe(self, flight):
+        i = 0
+        try:
+            while True:
+                with flight.cond:
+                    while i >= len(flight.chunks) and not flight.done:
+                        flight.cond.wait()
+                    pending = flight.chunks[i:]
+                    done = flight.done
+                for chunk in pending:
+                    i += 1
+                    yield chunk
+                if done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+        finally:
+            self._unsubscribe(flight)
+
+    def _unsubscribe(self, flight):
+        with flight.cond:
+            flight.subscribers -= 1
+            abandoned = flight.subscribers == 0 and not flight.done
+            if abandoned:
+                flight.cancelled = True
+        if abandoned:
+            # Nobody is listening any more; make sure new callers start afresh
+            # instead of joining a stream that is being torn down.
+            self._retire(flight)
+
+
+# Shared by every Streamlit session in the process. Streamlit re-executes
+# app.py on each rerun, so the instance has to live in an imported module.
+coalescer = StreamCoalescer()
@@ -0,0 +1,422 @@
+"""Storage backends for users, auth tokens and chat history.
+
+db.py's public functions (register_user, save_chat_message, ...) go through
+`db.repository()`, a Repository picked by VYAPAR_DATABASE_URL:
+
+    (unset)                          SQLite file at VYAPAR_DB_PATH (db.SQLiteRepository)
+    postgresql://user:pw@host/db     PostgreSQL (PostgresRepository, needs psycopg2)
+
+With PostgreSQL, any number of app and API hosts share users, sessions, API
+tokens and chat history. Background jobs, usage accounting, rate-limit
+buckets and the chat archive stay in each host's local SQLite file.
+
+Both backends borrow connections from a ConnectionPool and write chat turns
+through GroupCommit, which folds concurrent writes into one transaction.
+
+    python -m benchmarks.storage_backends --pg-url postgresql://...   conformance + throughput
+"""
+import os
+import queue
+import threading
+from contextlib import contextmanager
+
+from metrics import DB_GROUP_COMMIT_SIZE
+
+# Optional PostgreSQL driver
+try:
+    import psycopg2
+    import psycopg2.extras
+except Exception:
+    psycopg2 = None
+
+POOL_SIZE = int(os.environ.get("VYAPAR_DB_POOL_SIZE", "8"))
+POOL_TIMEOUT = 30.0     # seconds to wait for a free connection
+GROUP_COMMIT_MAX = 256  # writes folded into one transaction at most
+ITER_PAGE = 2000        # turns per query when streaming a history
+
+# Bearer secrets are stored hashed in one table per kind
+TOKEN_TABLES = {"session": "sessions", "api": "api_tokens"}
+
+
+class Repository:
+    """What VyaparGPT needs from a database for users, auth tokens and chat history.
+
+    User rows are tuples in db.USER_COLUMNS order; messages are dicts with
+    "role" and "content" (plus "timestamp" from iter_chat_history).
+    """
+    kind = None
+
+    def init_schema(self):
+        raise NotImplementedError
+
+    # Users
+    def create_user(self, username, password_hash, first_name, last_name, email, phone) -> bool:
+        """False if the username is taken."""
+        raise NotImplementedError
+
+    def get_user(self, user_id):
+        raise NotImplementedError
+
+    def get_user_by_username(self, username):
+        raise NotImplementedError
+
+    def set_password(self, user_id, password_hash):
+        """Also marks the user's reset tokens used and ends their web sessions."""
+        raise NotImplementedError
+
+    # Password reset tokens
+    def create_reset_token(self, user_id, token, expires_at):
+        raise NotImplementedError
+
+    def reset_token_user_id(self, token, now):
+        raise NotImplementedError
+
+    # Sessions and API tokens (kind in TOKEN_TABLES)
+    def add_token(self, kind, token_hash, user_id, created_at, expires_at):
+        """Store a token hash; expired tokens of the same kind are dropped on the way."""
+        raise NotImplementedError
+
+    def token_user_id(self, kind, token_hash, now):
+        raise NotImplementedError
+
+    def delete_token(self, kind, token_hash):
+        raise NotImplementedError
+
+    # Chat history
+    def save_chat_messages(self, rows):
+        """Insert [(user_id, role, content), ...] in one transaction."""
+        raise NotImplementedError
+
+    def save_chat_message(self, user_id, role, content):
+        # Concurrent callers share a commit
+        self.chat_writer.submit((user_id, role, content))
+
+    def count_chat_messages(self, user_id) -> int:
+        raise NotImplementedError
+
+    def load_chat_history(self, user_id):
+        raise NotImplementedError
+
+    def load_chat_window(self, user_id, limit, before_id=None):
+        """(up to `limit` newest turns older than `before_id`, oldest first; oldest id or None)."""
+        raise NotImplementedError
+
+    def iter_chat_history(self, user_id):
+        """Every stored turn, oldest first, without holding them all in memory."""
+        raise NotImplementedError
+
+    def clear_chat_history(self, user_id):
+        raise NotImplementedError
+
+    def close(self):
+        self.pool.close()
+
+
+# =========================
+# CONNECTION POOL
+# =========================
+class ConnectionPool:
+    """At most `size` connections, opened on demand; callers block while all are in use.
+
+    A connection goes back rolled back, so anything not committed is dropped;
+    one that fails to roll back is closed and replaced later.
+    """
+
+    def __init__(self, connect, size=POOL_SIZE, timeout=POOL_TIMEOUT):
+        self._connect = connect
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._opened < self.size:
+                self._opened += 1
+                opening = True
+            else:
+                opening = False
+        if not opening:
+            try:
+                return self._idle.get(timeout=self.timeout)
+            except queue.Empty:
+                raise TimeoutError(f"no database connection free after {self.timeout:.0f}s") from None
+        try:
+            return self._connect()
+        except BaseException:
+            with self._lock:
+                self._opened -= 1
+            raise
+
+    def _release(self, conn):
+        try:
+            conn.rollback()
+        except Exception:
+            self._discard(conn)
+            return
+        self._idle.put(conn)
+
+    def _discard(self, conn):
+        with self._lock:
+            self._opened -= 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+
+    def close(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(conn)
+
+
+# =========================
+# GROUP COMMIT
+# =========================
+class _Write:
+    __slots__ = ("item", "done", "error")
+
+    def __init__(self, item):
+        self.item = item
+        self.done = False
+        self.error = None
+
+
+class GroupCommit:
+    """Folds concurrent writes into one transaction.
+
+    submit() returns once its item is committed. Whoever holds the write lock
+    commits everything queued up to then, so under load one commit (one
+    fsync, one round trip) serves many writers, and a lone write is never
+    held back waiting for company.
+    """
+
+    def __init__(self, write_many, max_batch=GROUP_COMMIT_MAX):
+        self.write_many = write_many
+        self.max_batch = max_batch
+        self._pending = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def submit(self, item):
+        write = _Write(item)
+        with self._lock:
+            self._pending.append(write)
+        with self._write_lock:
+            while not write.done:
+                with self._lock:
+                    batch = self._pending[:self.max_batch]
+                    del self._pending[:self.max_batch]
+                self._commit(batch)
+        if write.error is not None:
+            raise write.error
+
+    def _commit(self, batch):
+        DB_GROUP_COMMIT_SIZE.observe(len(batch))
+        try:
+            self.write_many([w.item for w in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0].error = e
+            else:
+                # One bad row must not fail everyone else's write
+                for w in batch:
+                    try:
+                        self.write_many([w.item])
+                    except Exception as err:
+                        w.error = err
+        for w in batch:
+            w.done = True
+
+
+# =========================
+# POSTGRESQL
+# =========================
+_PG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id BIGSERIAL PRIMARY KEY,
+    username TEXT UNIQUE NOT NULL,
+    password TEXT NOT NULL,
+    first_name TEXT,
+    last_name TEXT,
+    email TEXT,
+    phone TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc')
+);
+CREATE TABLE IF NOT EXISTS password_reset_tokens (
+    id BIGSERIAL PRIMARY KEY,
+    user_id BIGINT NOT NULL REFERENCES users (id),
+    token TEXT NOT NULL,
+    expires_at DOUBLE PRECISION NOT NULL,
+    used BOOLEAN NOT NULL DEFAULT FALSE
+);
+CREATE INDEX IF NOT EXISTS idx_password_reset_tokens_token ON password_reset_tokens (token);
+CREATE TABLE IF NOT EXISTS chat_history (
+    id BIGSERIAL PRIMARY KEY,
+    user_id BIGINT NOT NULL REFERENCES users (id),
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    timestamp TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc')
+);
+CREATE INDEX IF NOT EXISTS idx_chat_history_user ON chat_history (user_id, id);
+CREATE TABLE IF NOT EXISTS sessions (
+    token_hash TEXT PRIMARY KEY,
+    user_id BIGINT NOT NULL REFERENCES users (id),
+    created_at DOUBLE PRECISION NOT NULL,
+    expires_at DOUBLE PRECISION NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON sessions (expires_at);
+CREATE TABLE IF NOT EXISTS api_tokens (
+    token_hash TEXT PRIMARY KEY,
+    user_id BIGINT NOT NULL REFERENCES users (id),
+    created_at DOUBLE PRECISION NOT NULL,
+    expires_at DOUBLE PRECISION NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_api_tokens_expires_at ON api_tokens (expires_at);
+"""
+
+# Same text form as SQLite's CURRENT_TIMESTAMP
+_PG_USER_COLUMNS = ("id, username, password, first_name, last_name, email, phone, "
+                    "to_char(created_at, 'YYYY-MM-DD HH24:MI:SS')")
+
+
+class PostgresRepository(Repository):
+    """PostgreSQL backend. Large messages are stored inline; PostgreSQL compresses them (TOAST)."""
+    kind = "postgresql"
+
+    def __init__(self, dsn, pool_size=POOL_SIZE, group_commit=GROUP_COMMIT_MAX):
+        if psycopg2 is None:
+            raise RuntimeError("psycopg2 not installed. Run: pip install psycopg2-binary")
+        self.dsn = dsn
+        self.pool = ConnectionPool(lambda: psycopg2.connect(dsn), pool_size)
+        self.chat_writer = GroupCommit(self.save_chat_messages, max_batch=group_commit)
+
+    def _one(self, sql, args=()):
+        with self.pool.connection() as conn:
+            with conn.cursor() as c:
+                c.execute(sql, args)
+                return c.fetchone()
+
+    def _write(self, *statements):
+        with self.pool.connection() as conn:
+            with conn.cursor() as c:
+                for sql, args in statements:
+                    c.execute(sql, args)
+            conn.commit()
+
+    def init_schema(self):
+        self._write((_PG_SCHEMA, ()))
+
+    def create_user(self, username, password_hash, first_name, last_name, email, phone):
+        with self.pool.connection() as conn:
+            with conn.cursor() as c:
+                c.execute("""
+                    INSERT INTO users (username, password, first_name, last_name, email, phone)
+                    VALUES (%s, %s, %s, %s, %s, %s) ON CONFLICT (username) DO NOTHING RETURNING id
+                """, (username, password_hash, first_name, last_name, email, phone))
+                created = c.fetchone() is not None
+            conn.commit()
+        return created
+
+    def get_user(self, user_id):
+        return self._one(f"SELECT {_PG_USER_COLUMNS} FROM users WHERE id = %s", (user_id,))
+
+    def get_user_by_username(self, username):
+        return self._one(f"SELECT {_PG_USER_COLUMNS} FROM users WHERE username = %s", (username,))
+
+    def set_password(self, user_id, password_hash):
+        self._write(
+            ("UPDATE users SET password = %s WHERE id = %s", (password_hash, user_id)),
+            ("UPDATE password_reset_tokens SET used = TRUE WHERE user_id = %s", (user_id,)),
+            ("DELETE FROM sessions WHERE user_id = %s", (user_id,)),
+        )
+
+    def create_reset_token(self, user_id, token, expires_at):
+        self._write(("INSERT INTO password_reset_tokens (user_id, token, expires_at) VALUES (%s, %s, %s)",
+                     (user_id, token, expires_at)))
+
+    def reset_token_user_id(self, token, now):
+        row = self._one("""
+            SELECT user_id FROM password_reset_tokens WHERE token = %s AND expires_at > %s AND NOT used
+        """, (token, now))
+        return row[0] if row else None
+
+    def add_token(self, kind, token_hash, user_id, created_at, expires_at):
+        table = TOKEN_TABLES[kind]
+        self._write(
+            (f"DELETE FROM {table} WHERE expires_at <= %s", (created_at,)),
+            (f"INSERT INTO {table} (token_hash, user_id, created_at, expires_at) VALUES (%s, %s, %s, %s)",
+             (token_hash, user_id, created_at, expires_at)),
+        )
+
+    def token_user_id(self, kind, token_hash, now):
+        row = self._one(f"SELECT user_id FROM {TOKEN_TABLES[kind]} WHERE token_hash = %s AND expires_at > %s",
+                        (token_hash, now))
+        return row[0] if row else None
+
+    def delete_token(self, kind, token_hash):
+        self._write((f"DELETE FROM {TOKEN_TABLES[kind]} WHERE token_hash = %s", (token_hash,)))
+
+    def save_chat_messages(self, rows):
+        with self.pool.connection() as conn:
+            with conn.cursor() as c:
+                psycopg2.extras.execute_values(
+                    c, "INSERT INTO chat_history (user_id, role, content) VALUES %s", rows, page_size=len(rows))
+            conn.commit()
+
+    def count_chat_messages(self, user_id):
+        return self._one("SELECT COUNT(*) FROM chat_history WHERE user_id = %s", (user_id,))[0]
+
+    def load_chat_history(self, user_id):
+        with self.pool.connection() as conn:
+            with conn.cursor() as c:
+                c.execute("SELECT role, content FROM chat_history WHERE user_id = %s ORDER BY id", (user_id,))
+                return [{"role": role, "content": content} for role, content in c.fetchall()]
+
+    def load_chat_window(self, user_id, limit, before_id=None):
+        with self.pool.connection() as conn:
+            with conn.cursor() as c:
+                c.execute("""
+                    SELECT id, role, content FROM chat_history
+                    WHERE user_id = %s AND id < %s ORDER BY id DESC LIMIT %s
+                """, (user_id, before_id if before_id is not None else 2**63 - 1, limit))
+                rows = c.fetchall()
+        messages = [{"role": role, "content": content} for _, role, content in reversed(rows)]
+        return messages, (rows[-1][0] if rows else None)
+
+    def iter_chat_history(self, user_id):
+        # Keyset pages, each on a briefly borrowed connection: a slow export
+        # download holds neither a pool slot nor an open transaction
+        last_id = 0
+        while True:
+            with self.pool.connection() as conn:
+                with conn.cursor() as c:
+                    c.execute("""
+                        SELECT id, role, content, to_char(timestamp, 'YYYY-MM-DD HH24:MI:SS')
+                        FROM chat_history WHERE user_id = %s AND id > %s ORDER BY id LIMIT %s
+                    """, (user_id, last_id, ITER_PAGE))
+                    rows = c.fetchall()
+            for last_id, role, content, ts in rows:
+                yield {"role": role, "content": content, "timestamp": ts}
+            if len(rows) < ITER_PAGE:
+                return
+
+    def clear_chat_history(self, user_id):
+        self._write(("DELETE FROM chat_history WHERE user_id = %s", (user_id,)))
+
@@ -0,0 +1,164 @@
+"""Lightweight per-session stage timing for the debug sidebar.
+
+app.py activates a `Tracer` for the current script run when debug is on.
+Helpers wrapped with `traced(...)`, blocks wrapped in `span(...)` and LLM
+streams passed through `trace_stream(...)` record spans into it. With no
+active tracer each of those is a single thread-local lookup.
+
+Streamlit runs each session's script on its own thread, so the active tracer
+is thread-local.
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+_local = threading.local()
+_NOOP = nullcontext()
+
+
+class Span:
+    __slots__ = ("name", "start", "end", "depth", "attrs")
+
+    def __init__(self, name, start, depth, attrs=None):
+        self.name = name
+        self.start = start
+        self.end = start
+        self.depth = depth
+        self.attrs = attrs or {}
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+class Run:
+    def __init__(self, label):
+        self.label = label
+        self.started = time.perf_counter()
+        self.spans = []
+        self.depth = 0
+
+    @property
+    def duration(self) -> float:
+        if not self.spans:
+            return 0.0
+        return max(s.end for s in self.spans) - self.started
+
+
+class Tracer:
+    """Keeps the last few runs of one session plus running per-stage totals."""
+
+    def __init__(self, max_runs=10):
+        self.runs = deque(maxlen=max_runs)
+        self.totals = {}  # name -> [count, total_seconds, max_seconds]
+
+    def begin_run(self, label="rerun"):
+        run = Run(label)
+        self.runs.append(run)
+        return run
+
+    @property
+    def current(self):
+        return self.runs[-1] if self.runs else None
+
+    def last_with_spans(self):
+        for run in reversed(self.runs):
+            if run.spans:
+                return run
+        return None
+
+    def _open(self, name, attrs=None):
+        run = self.current or self.begin_run()
+        s = Span(name, time.perf_counter(), run.depth, attrs)
+        run.spans.append(s)
+        run.depth += 1
+        return run, s
+
+    def _close(self, run, s):
+        s.end = time.perf_counter()
+        run.depth = max(0, run.depth - 1)
+        self._aggregate(s.name, s.duration)
+
+    def _aggregate(self, name, seconds):
+        entry = self.totals.setdefault(name, [0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] = max(entry[2], seconds)
+
+    def add(self, name, start, end, **attrs):
+        """Record an already measured interval (perf_counter timestamps)."""
+        run = self.current or self.begin_run()
+        s = Span(name, start, run.depth, attrs)
+        s.end = end
+        run.spans.append(s)
+        self._aggregate(name, end - start)
+
+
+def activate(tracer):
+    _local.tracer = tracer
+
+
+def active():
+    return getattr(_local, "tracer", None)
+
+
+@contextmanager
+def _span(tracer, name, attrs):
+    run, s = tracer._open(name, attrs)
+    try:
+        yield s
+    finally:
+        tracer._close(run, s)
+
+
+def span(name, **attrs):
+    tracer = getattr(_local, "tracer", None)
+    if tracer is None:
+        return _NOOP
+    return _span(tracer, name, attrs)
+
+
+def traced(name):
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            tracer = getattr(_local, "tracer", None)
+            if tracer is None:
+                return fn(*args, **kwargs)
+            with _span(tracer, name, None):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def trace_stream(stream, name="llm"):
+    """Time an LLM chunk stream: TTFT, total stream time and tokens/sec."""
+    tracer = getattr(_local, "tracer", None)
+    if tracer is None:
+        return stream
+    return _traced_stream(tracer, stream, name)
+
+
+def _traced_stream(tracer, stream, name):
+    start = time.perf_counter()
+    first = None
+    tokens = 0
+    try:
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                if first is None:
+                    first = time.perf_counter()
+                    tracer.add(f"{name}.ttft", start, first)
+                # Groq/OpenAI stream roughly one token per content chunk.
+                tokens += 1
+            yield chunk
+    finally:
+        end = time.perf_counter()
+        gen_seconds = end - (first or end)
+        tracer.add(
+            f"{name}.stream", start, end,
+            tokens=tokens,
+            tokens_per_s=round(tokens / gen_seconds, 1) if gen_seconds > 0 else None,
+        )
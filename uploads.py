@@ -0,0 +1,188 @@
+"""Memory-bounded handling of uploaded files (PDFs for Explain Document).
+
+An upload is read in CHUNK_SIZE pieces into an `Upload`: hashed (sha256)
+as it arrives, kept in memory up to SPOOL_BYTES and spooled to a temporary
+file beyond that, and refused with UploadTooLarge past MAX_UPLOAD_BYTES.
+Readers get a seekable stream over it: the in-memory bytes, or the spool
+file mapped read-only with mmap. PyPDF2 then reads only the objects of the
+pages it parses, from the page cache, instead of every reader holding a
+private copy of a scanned 50 MB bundle.
+
+A Streamlit UploadedFile is already in memory; `from_file` hashes and reads
+it in place instead of copying it. Spooled uploads pickle as their path, so
+the API hands them to its PDF process pool without sending the bytes.
+
+    VYAPAR_MAX_UPLOAD_MB     larger uploads are refused (default 50)
+    VYAPAR_UPLOAD_SPOOL_MB   uploads up to this size stay in memory (default 1)
+    VYAPAR_UPLOAD_DIR        directory for spool files (default: the system temp dir)
+"""
+import mmap
+import os
+import tempfile
+from hashlib import sha256
+from io import BytesIO
+
+MAX_UPLOAD_BYTES = int(float(os.environ.get("VYAPAR_MAX_UPLOAD_MB", "50")) * 2**20)
+SPOOL_BYTES = int(float(os.environ.get("VYAPAR_UPLOAD_SPOOL_MB", "1")) * 2**20)
+UPLOAD_DIR = os.environ.get("VYAPAR_UPLOAD_DIR") or None
+CHUNK_SIZE = 1 << 20
+
+
+class UploadTooLarge(ValueError):
+    def __init__(self, size, max_bytes=MAX_UPLOAD_BYTES):
+        super().__init__(f"file is larger than the {max_bytes / 2**20:.0f} MB upload limit")
+        self.size = size
+        self.max_bytes = max_bytes
+
+
+class Upload:
+    """An uploaded file: `digest`, `size`, and `open()` for a seekable binary stream.
+
+    Build one with `from_stream`, `from_file` or `from_bytes`, or by calling
+    `write()` per chunk and then `finish()`. `close()` removes the spool file.
+    """
+
+    def __init__(self, max_bytes=MAX_UPLOAD_BYTES, spool_bytes=SPOOL_BYTES):
+        self.max_bytes = max_bytes
+        self.spool_bytes = spool_bytes
+        self.size = 0
+        self.digest = None
+        self.path = None
+        self._sha = sha256()
+        self._memory = BytesIO()
+        self._data = None       # finished in-memory content
+        self._source = None     # a caller's in-memory file, read in place
+        self._file = None
+        self._owner = True      # this process created the spool file and removes it
+
+    # ---- building ------------------------------------------------------
+    def write(self, chunk):
+        if self.size + len(chunk) > self.max_bytes:
+            raise UploadTooLarge(self.size + len(chunk), self.max_bytes)
+        self._sha.update(chunk)
+        self.size += len(chunk)
+        if self._file is None and self.size > self.spool_bytes:
+            fd, self.path = tempfile.mkstemp(prefix="vyapar-upload-", suffix=".pdf", dir=UPLOAD_DIR)
+            self._file = os.fdopen(fd, "w+b")
+            self._file.write(self._memory.getbuffer())
+            self._memory = None
+        (self._file or self._memory).write(chunk)
+
+    def finish(self):
+        self.digest = self._sha.hexdigest()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        elif self._memory is not None:
+            self._data = self._memory.getvalue()
+            self._memory = None
+        return self
+
+    # ---- reading -------------------------------------------------------
+    @property
+    def spooled(self) -> bool:
+        return self.path is not None
+
+    def open(self):
+        """A new seekable binary stream over the content, at offset 0."""
+        if self._source is not None:
+            # The caller's buffer, read in place: one reader at a time
+            self._source.seek(0)
+            return self._source
+        if self.path is None:
+            return BytesIO(self._data)
+        if self.size == 0:
+            return BytesIO(b"")
+        with open(self.path, "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def chunks(self, size=CHUNK_SIZE):
+        stream = self.open()
+        stream.seek(0)
+        while True:
+            chunk = stream.read(size)
+            if not chunk:
+                return
+            yield chunk
+
+    def getvalue(self) -> bytes:
+        """The whole content as bytes (a copy unless it is small and in memory)."""
+        if self._data is not None:
+            return self._data
+        return b"".join(self.chunks())
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self.path is not None and self._owner:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+    def __getstate__(self):
+        # Spool files travel by path: a process pool worker maps the same file
+        if self.path is not None:
+            return {"path": self.path, "size": self.size, "digest": self.digest}
+        return {"data": self.getvalue(), "size": self.size, "digest": self.digest}
+
+    def __setstate__(self, state):
+        self.__init__()
+        self.size, self.digest = state["size"], state["digest"]
+        if "path" in state:
+            self.path, self._owner = state["path"], False
+        else:
+            self._data = state["data"]
+
+
+def from_stream(stream, max_bytes=MAX_UPLOAD_BYTES, spool_bytes=SPOOL_BYTES) -> Upload:
+    """Read a binary stream to its end, CHUNK_SIZE at a time."""
+    upload = Upload(max_bytes, spool_bytes)
+    try:
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                return upload.finish()
+            upload.write(chunk)
+    except BaseException:
+        upload.close()
+        raise
+
+
+def from_file(f, max_bytes=MAX_UPLOAD_BYTES) -> Upload:
+    """An Upload over a file object; an in-memory one (BytesIO, Streamlit's UploadedFile) is not copied."""
+    if isinstance(f, Upload):
+        return f
+    if not isinstance(f, BytesIO):
+        return from_stream(f, max_bytes)
+    # Chunked reads of a BytesIO are slices; getbuffer() would unshare (copy) its bytes
+    upload = Upload(max_bytes)
+    f.seek(0)
+    while chunk := f.read(CHUNK_SIZE):
+        upload.size += len(chunk)
+        if upload.size > max_bytes:
+            raise UploadTooLarge(upload.size, max_bytes)
+        upload._sha.update(chunk)
+    upload._source, upload._memory = f, None
+    return upload.finish()
+
+
+def from_bytes(data, max_bytes=MAX_UPLOAD_BYTES) -> Upload:
+    if len(data) > max_bytes:
+        raise UploadTooLarge(len(data), max_bytes)
+    upload = Upload(max_bytes)
+    upload._sha.update(data)
+    upload.size = len(data)
+    upload._data = bytes(data)
+    upload._memory = None
+    return upload.finish()
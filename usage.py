@@ -0,0 +1,200 @@
+"""Per-user LLM token accounting.
+
+Every llm_chat stream ends with a call to `record(...)`, which only enqueues.
+A background thread drains the queue in batches: one transaction inserts the
+raw rows into `llm_usage` and folds them into the `llm_usage_daily` rollup,
+so the chat hot path never waits on SQLite.
+
+A batch whose write fails is kept and retried first, with the flush interval
+doubling (up to MAX_BACKOFF) while writes keep failing; after
+MAX_WRITE_ATTEMPTS failures it is dropped. Dropped rows, there or on a full
+queue, are counted in vyapar_usage_rows_dropped_total{reason}.
+"""
+import atexit
+import queue
+import threading
+import time
+from collections import defaultdict
+
+import db
+from metrics import USAGE_ROWS_DROPPED
+
+FLUSH_INTERVAL = 2.0  # seconds
+BATCH_SIZE = 200
+MAX_PENDING = 10000
+MAX_WRITE_ATTEMPTS = 5  # failed writes of one batch before it is dropped
+MAX_BACKOFF = 60.0      # seconds between flushes at most while writes fail
+
+
+class UsageRecorder:
+    def __init__(self, flush_interval=FLUSH_INTERVAL, batch_size=BATCH_SIZE, max_pending=MAX_PENDING):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._failed = []   # the batch whose last write failed, retried first
+        self._attempts = 0  # failed writes of that batch
+        self.dropped = 0
+        self.written = 0
+
+    def record(self, user_id, model, prompt_tokens, completion_tokens, latency_ms,
+               ttft_ms=None, estimated=False, shared=False):
+        row = (
+            user_id or 0, model, int(prompt_tokens), int(completion_tokens),
+            round(latency_ms, 1), round(ttft_ms, 1) if ttft_ms is not None else None,
+            int(bool(estimated)), int(bool(shared)), time.time(),
+        )
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            # Accounting must never block or fail a chat turn.
+            self._drop(1, "queue_full")
+            return
+        self._ensure_worker()
+
+    def _ensure_worker(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="usage-writer", daemon=True)
+                self._thread.start()
+
+    def _drop(self, count, reason):
+        self.dropped += count
+        USAGE_ROWS_DROPPED.labels(reason=reason).inc(count)
+
+    def _run(self):
+        delay = self.flush_interval
+        while True:
+            time.sleep(delay)
+            try:
+                self.flush()
+                delay = self.flush_interval
+            except Exception as e:
+                delay = min(delay * 2, MAX_BACKOFF)
+                print(f"usage: flush failed, retrying in {delay:.0f}s: {e}")
+
+    def _drain(self):
+        rows = []
+        while len(rows) < self.batch_size:
+            try:
+                rows.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return rows
+
+    def flush(self):
+        """Write everything queued so far. Safe to call from any thread."""
+        with self._flush_lock:
+            while True:
+                rows = self._failed or self._drain()
+                if not rows:
+                    return
+                try:
+                    self._write(rows)
+                except Exception:
+                    self._attempts += 1
+                    if self._attempts >= MAX_WRITE_ATTEMPTS:
+                        self._drop(len(rows), "write_failed")
+                        self._failed, self._attempts = [], 0
+                    else:
+                        self._failed = rows
+                    raise
+                self._failed, self._attempts = [], 0
+                self.written += len(rows)
+
+    def _write(self, rows):
+        daily = defaultdict(lambda: [0, 0, 0, 0.0])
+        for user_id, model, prompt, completion, latency_ms, _, _, _, ts in rows:
+            day = time.strftime("%Y-%m-%d", time.gmtime(ts))
+            agg = daily[(user_id, day, model)]
+            agg[0] += 1
+            agg[1] += prompt
+            agg[2] += completion
+            agg[3] += latency_ms
+        conn = db.get_connection()
+        try:
+            c = conn.cursor()
+            c.executemany("""
+                INSERT INTO llm_usage
+                    (user_id, model, prompt_tokens, completion_tokens, latency_ms, ttft_ms, estimated, shared, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+            c.executemany("""
+                INSERT INTO llm_usage_daily
+                    (user_id, day, model, requests, prompt_tokens, completion_tokens, latency_ms_total)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (user_id, day, model) DO UPDATE SET
+                    requests = requests + excluded.requests,
+                    prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                    completion_tokens = completion_tokens + excluded.completion_tokens,
+                    latency_ms_total = latency_ms_total + excluded.latency_ms_total
+            """, [(u, d, m, *agg) for (u, d, m), agg in daily.items()])
+            conn.commit()
+        finally:
+            conn.close()
+
+
+recorder = UsageRecorder()
+atexit.register(recorder.flush)
+
+
+def record(*args, **kwargs):
+    recorder.record(*args, **kwargs)
+
+
+def top_consumers(days=7, limit=20):
+    """Users ranked by total tokens over the last `days` days (UTC)."""
+    since = time.strftime("%Y-%m-%d", time.gmtime(time.time() - (days - 1) * 86400))
+    conn = db.get_connection()
+    c = conn.cursor()
+    c.execute("""
+        SELECT d.user_id,
+               SUM(d.requests), SUM(d.prompt_tokens), SUM(d.completion_tokens),
+               SUM(d.prompt_tokens + d.completion_tokens) AS total_tokens,
+               SUM(d.latency_ms_total) / SUM(d.requests)
+        FROM llm_usage_daily d
+        WHERE d.day >= ?
+        GROUP BY d.user_id
+        ORDER BY total_tokens DESC
+        LIMIT ?
+    """, (since, limit))
+    rows = c.fetchall()
+    conn.close()
+    result = []
+    for r in rows:
+        # Users may live in another backend (storage.py), so no SQL join
+        user = db.get_user(r[0]) if r[0] else None
+        result.append({
+            "user_id": r[0],
+            "username": user.username if user else None,
+            "name": f"{user.first_name or ''} {user.last_name or ''}".strip() if user else "",
+            "requests": r[1],
+            "prompt_tokens": r[2],
+            "completion_tokens": r[3],
+            "total_tokens": r[4],
+            "avg_latency_ms": round(r[5] or 0, 1),
+        })
+    return result
+
+
+def daily_totals(days=30):
+    since = time.strftime("%Y-%m-%d", time.gmtime(time.time() - (days - 1) * 86400))
+    conn = db.get_connection()
+    c = conn.cursor()
+    c.execute("""
+        SELECT day, SUM(requests), SUM(prompt_tokens), SUM(completion_tokens)
+        FROM llm_usage_daily
+        WHERE day >= ?
+        GROUP BY day
+        ORDER BY day
+    """, (since,))
+    rows = c.fetchall()
+    conn.close()
+    return [
+        {"day": r[0], "requests": r[1], "prompt_tokens": r[2], "completion_tokens": r[3]}
+        for r in rows
+    ]